@@ -22,6 +22,8 @@ themselves, and managers.
 RTCTREE_VERSION = '4.2.0'
 NAMESERVERS_ENV_VAR = 'RTCTREE_NAMESERVERS'
 ORB_ARGS_ENV_VAR = 'RTCTREE_ORB_ARGS'
+DAEMON_SOCKET_ENV_VAR = 'RTCTREE_DAEMON_SOCKET'
+LEASE_DIR_ENV_VAR = 'RTCTREE_LEASE_DIR'
 
 
 # vim: set expandtab tabstop=8 shiftwidth=4 softtabstop=4 textwidth=79
@@ -17,6 +17,10 @@ Object representing a component node in the tree.
 
 '''
 
+from __future__ import print_function
+
+import sys
+import threading
 import time
 import uuid
 
@@ -24,9 +28,11 @@ from rtctree import exceptions
 from rtctree import ports
 from rtctree import sdo
 from rtctree import utils
+from rtctree import wait
 from rtctree.config_set import ConfigurationSet
 from rtctree.exec_context import ExecutionContext
 from rtctree.node import TreeNode
+from rtctree.options import Options
 from rtctree.rtc import RTC
 from rtctree.rtc import SDOPackage
 
@@ -67,6 +73,10 @@ class Component(TreeNode):
       one of Component.CFG_UPDATE_SET, Component.CFG_UPDATE_PARAM,
       Component.CFG_UPDATE_PARAM_IN_ACTIVE, Component.CFG_ADD_SET,
       Component.CFG_REMOVE_SET and Component.CFG_ACTIVATE_SET.
+    - config_error(exception)
+      The configuration sets changed by config_event notifications could not
+      be fetched in the background. The exception raised is passed. The sets
+      are fetched again when they are next used.
     - heartbeat(type, time)
       A heartbeat was received from the component or from the execution context.
       The time the beat was received is passed.
@@ -232,25 +242,36 @@ class Component(TreeNode):
     >>> p[1].wait()
     -15
     '''
-    def __init__(self, name=None, parent=None, obj=None, *args, **kwargs):
+    def __init__(self, name=None, parent=None, obj=None, profile=None,
+            *args, **kwargs):
         '''Constructor.
 
         @param name Name of this component (i.e. its entry in the path).
         @param parent The parent node of this node, if any.
         @param obj The CORBA LightweightRTObject object to wrap.
+        @param profile The component's profile, if it has already been
+                       retrieved. If None, the profile is retrieved from the
+                       component.
 
         '''
         self._obj = obj
         self._obs = None
         self._obs_id = None
+        self._observer_profile = None
+        self._observer_status = 'off'
         self._loggers = {}
+        self._owned_ecs = None
+        self._participating_ecs = None
+        self._owned_ec_states = None
+        self._participating_ec_states = None
+        self._merged_state = None
+        self._conf_timer = None
         self._last_heartbeat = time.time() # RTC is alive at construction time
         super(Component, self).__init__(name=name, parent=parent,
                                         *args, **kwargs)
-        self._set_events(['rtc_status', 'component_profile', 'ec_event',
-            'port_event', 'config_event', 'heartbeat', 'fsm_event'])
+        self._set_events(self._events)
         self._reset_data()
-        self._parse_profile()
+        self._parse_profile(profile)
 
     def reparse(self):
         '''Reparse the component's information.
@@ -364,6 +385,10 @@ class Component(TreeNode):
         org.add_members([x.object for x in rtcs])
         # Force a reparse of the member information
         self._orgs = []
+        self._members = {}
+        index = self._composition_index()
+        if index is not None:
+            index.add_members(self, rtcs)
 
     def remove_members(self, rtcs):
         '''Remove other RT Components from this composite component.
@@ -391,24 +416,42 @@ class Component(TreeNode):
             org.remove_member(rtc_name)
         # Force a reparse of the member information
         self._orgs = []
+        self._members = {}
+        index = self._composition_index()
+        if index is not None:
+            index.remove_members(self, rtcs)
 
     @property
     def composite_parent(self):
         '''The parent component in the composition.
 
-        None if this component is not a member of a composition.
+        None if this component is not a member of a composition, or if the
+        tree's composition index has not been built (see
+        @ref RTCTree.composition).
 
         '''
+        index = self._composition_index()
+        if index is None:
+            return None
+        parents = index.parents(self)
+        if parents:
+            return parents[0]
         return None
 
     @property
     def is_composite(self):
         '''Is the component a composite component.'''
+        index = self._composition_index()
+        if index is not None:
+            return index.is_composite(self)
         return self._obj.get_owned_organizations() != []
 
     @property
     def is_composite_member(self):
         '''Is the component a member of a composite component.'''
+        index = self._composition_index()
+        if index is not None:
+            return index.parents(self) != []
         return self._obj.get_organizations() != []
 
     def is_member(self, rtc):
@@ -425,6 +468,9 @@ class Component(TreeNode):
         '''
         if not self.is_composite:
             raise exceptions.NotCompositeError(self.name)
+        index = self._composition_index()
+        if index is not None:
+            return index.is_member(self, rtc)
         members = self.organisations[0].obj.get_members()
         if type(rtc) is str:
             for m in members:
@@ -438,13 +484,26 @@ class Component(TreeNode):
 
     @property
     def members(self):
-        '''Member components if this component is composite.'''
+        '''Member components if this component is composite.
+
+        A dictionary mapping organisation IDs to lists of members. Members
+        that are in the tree are given as their nodes; others are given as
+        CORBA object references.
+
+        '''
+        index = self._composition_index()
+        if index is not None:
+            return index.members(self)
         with self._mutex:
             if not self._members:
+                tree = self.tree
                 self._members = {}
                 for o in self.organisations:
-                    # TODO: Search for these in the tree
-                    self._members[o.org_id] = o.obj.get_members()
+                    members = o.obj.get_members()
+                    if tree is not None:
+                        members = [tree._identities.lookup(m) or m \
+                                for m in members]
+                    self._members[o.org_id] = members
         return self._members
 
     @property
@@ -585,10 +644,10 @@ class Component(TreeNode):
         '''
         with self._mutex:
             for ec in self.owned_ecs:
-                if ec.handle == ec_handle:
+                if ec.get_handle(self) == ec_handle:
                     return ec
             for ec in self.participating_ecs:
-                if ec.handle == ec_handle:
+                if ec.get_handle(self) == ec_handle:
                     return ec
             raise exceptions.NoECWithHandleError
 
@@ -606,10 +665,10 @@ class Component(TreeNode):
         '''
         with self._mutex:
             for ii, ec in enumerate(self.owned_ecs):
-                if ec.handle == ec_handle:
+                if ec.get_handle(self) == ec_handle:
                     return ii
             for ii, ec in enumerate(self.participating_ecs):
-                if ec.handle == ec_handle:
+                if ec.get_handle(self) == ec_handle:
                     return ii + len(self.owned_ecs)
             raise exceptions.NoECWithHandleError
 
@@ -621,17 +680,7 @@ class Component(TreeNode):
         @return A string describing the state of this component.
 
         '''
-        with self._mutex:
-            if self.state == self.INACTIVE:
-                result = 'Inactive', ['bold', 'blue']
-            elif self.state == self.ACTIVE:
-                result = 'Active', ['bold', 'green']
-            elif self.state == self.ERROR:
-                result = 'Error', ['bold', 'white', 'bgred']
-            elif self.state == self.UNKNOWN:
-                result = 'Unknown', ['bold', 'red']
-            elif self.state == self.CREATED:
-                result = 'Created', ['reset']
+        result = self._state_strings[self.state]
         if add_colour:
             return utils.build_attr_string(result[1], supported=add_colour) + \
                     result[0] + utils.build_attr_string('reset', supported=add_colour)
@@ -658,16 +707,7 @@ class Component(TreeNode):
                 state = self.participating_ec_states[ec_index]
             else:
                 state = self.owned_ec_states[ec_index]
-        if state == self.INACTIVE:
-            result = 'Inactive', ['bold', 'blue']
-        elif state == self.ACTIVE:
-            result = 'Active', ['bold', 'green']
-        elif state == self.ERROR:
-            result = 'Error', ['bold', 'white', 'bgred']
-        elif state == self.UNKNOWN:
-            result = 'Unknown', ['bold', 'red']
-        elif state == self.CREATED:
-            result = 'Created', ['reset']
+        result = self._state_strings[state]
         if add_colour:
             return utils.build_attr_string(result[1], supported=add_colour) + \
                     result[0] + utils.build_attr_string('reset',
@@ -743,8 +783,38 @@ class Component(TreeNode):
             else:
                 state = self._get_ec_state(self.owned_ecs[ec_index])
                 self.owned_ec_states[ec_index] = state
+            self._update_merged_state()
             return state
 
+    def wait_for_state(self, state, timeout=None):
+        '''Wait until the component is in a state.
+
+        If the component is dynamic, its state changes arrive as events and
+        the wait returns as soon as the state is reached. Otherwise, the
+        component's execution contexts and states are reparsed at increasing
+        intervals.
+
+        @param state The state to wait for, such as Component.ACTIVE.
+        @param timeout The longest time to wait, in seconds, or None to wait
+                       until the component is in the state.
+        @raises WaitTimeoutError
+
+        '''
+        def refresh():
+            if not self._observes('RTC_STATUS'):
+                self.reparse_ecs()
+        wait.wait_until(self.tree, lambda: self.state == state, refresh,
+                timeout)
+
+    def wait_for_state_async(self, state, timeout=None):
+        '''Asyncio version of @ref wait_for_state.
+
+        @return An asyncio future that completes when the component is in the
+                state.
+
+        '''
+        return wait.run_async(self.wait_for_state, state, timeout)
+
     @property
     def alive(self):
         '''Is this component alive?'''
@@ -759,7 +829,7 @@ class Component(TreeNode):
     def owned_ec_states(self):
         '''The state of each execution context this component owns.'''
         with self._mutex:
-            if not self._owned_ec_states:
+            if self._owned_ec_states is None:
                 if self.owned_ecs:
                     states = []
                     for ec in self.owned_ecs:
@@ -767,6 +837,7 @@ class Component(TreeNode):
                     self._owned_ec_states = states
                 else:
                     self._owned_ec_states = []
+                self._update_merged_state()
         return self._owned_ec_states
 
     @property
@@ -774,7 +845,7 @@ class Component(TreeNode):
         '''A list of the execution contexts owned by this component.'''
         with self._mutex:
             if not self._owned_ecs:
-                self._owned_ecs = [ExecutionContext(ec,
+                self._owned_ecs = [self._get_shared_ec(ec,
                     self._obj.get_context_handle(ec)) \
                     for ec in self._obj.get_owned_contexts()]
         return self._owned_ecs
@@ -786,7 +857,7 @@ class Component(TreeNode):
 
         '''
         with self._mutex:
-            if not self._participating_ec_states:
+            if self._participating_ec_states is None:
                 if self.participating_ecs:
                     states = []
                     for ec in self.participating_ecs:
@@ -794,6 +865,7 @@ class Component(TreeNode):
                     self._participating_ec_states = states
                 else:
                     self._participating_ec_states = []
+                self._update_merged_state()
         return self._participating_ec_states
 
     @property
@@ -803,7 +875,7 @@ class Component(TreeNode):
         '''
         with self._mutex:
             if not self._participating_ecs:
-                self._participating_ecs = [ExecutionContext(ec,
+                self._participating_ecs = [self._get_shared_ec(ec,
                                     self._obj.get_context_handle(ec)) \
                              for ec in self._obj.get_participating_contexts()]
         return self._participating_ecs
@@ -821,34 +893,17 @@ class Component(TreeNode):
         The order of precedence is:
             Error > Active > Inactive > Created > Unknown
 
+        The merged state is kept up to date as the states in the execution
+        contexts change, so reading it does not contact the component once
+        the states are known.
+
         '''
-        def merge_state(current, new):
-            if new == self.ERROR:
-                return self.ERROR
-            elif new == self.ACTIVE and current != self.ERROR:
-                return self.ACTIVE
-            elif new == self.INACTIVE and \
-                    current not in [self.ACTIVE, self.ERROR]:
-                return self.INACTIVE
-            elif new == self.CREATED and \
-                    current not in [self.ACTIVE, self.ERROR, self.INACTIVE]:
-                return self.CREATED
-            elif current not in [self.ACTIVE, self.ERROR, self.INACTIVE,
-                                 self.CREATED]:
-                return self.UNKNOWN
-            return current
-
-        with self._mutex:
-            if not self.owned_ec_states and not self.participating_ec_states:
-                return self.UNKNOWN
-            merged_state = self.CREATED
-            if self.owned_ec_states:
-                for ec_state in self.owned_ec_states:
-                    merged_state = merge_state(merged_state, ec_state)
-            if self.participating_ec_states:
-                for ec_state in self.participating_ec_states:
-                    merged_state = merge_state(merged_state, ec_state)
-            return merged_state
+        with self._mutex:
+            if self._merged_state is None:
+                # Retrieving the states merges them
+                self.owned_ec_states
+                self.participating_ec_states
+            return self._merged_state
 
     @property
     def state_string(self):
@@ -1004,6 +1059,44 @@ class Component(TreeNode):
         with self._mutex:
             return self._obj
 
+    @property
+    def observer_status(self):
+        '''The state of this component's observer.
+
+        'observing' if the component is dynamic and its observer is
+        registered; 'pending' if the observer is waiting to be registered in
+        the background (see @ref RTCTree.wait_for_observers); 'failed' if it
+        could not be registered; 'off' if the component is not dynamic.
+
+        '''
+        with self._mutex:
+            return self._observer_status
+
+    @property
+    def observer_profile(self):
+        '''The notifications sent to this component's observer when it is
+        dynamic, as an rtctree.sdo.ObserverProfile.
+
+        If no profile has been set for this component, the tree's profile is
+        used (see @ref RTCTree.observer_profile). Setting the profile changes
+        the notifications sent to an existing observer without replacing it.
+        Set None to go back to using the tree's profile.
+
+        '''
+        with self._mutex:
+            if self._observer_profile is not None:
+                return self._observer_profile
+        tree = self.tree
+        if tree is not None:
+            return tree.observer_profile
+        return sdo.ObserverProfile()
+
+    @observer_profile.setter
+    def observer_profile(self, profile):
+        with self._mutex:
+            self._observer_profile = profile
+            self._update_observer()
+
     def add_logger(self, cb, level='NORMAL', filters='ALL'):
         '''Add a callback to receive log events from this component.
 
@@ -1026,13 +1119,14 @@ class Component(TreeNode):
             intf_type = obs._this()._NP_RepositoryId
             props = {'logger.log_level': level,
                     'logger.filter': filters}
-            props = utils.dict_to_nvlist(props)
-            sprof = SDOPackage.ServiceProfile(id=uuid_val.get_bytes(),
+            props = utils.dict_to_nvlist(self._tag_properties(props))
+            sprof = SDOPackage.ServiceProfile(id=uuid_val.bytes,
                     interface_type=intf_type, service=obs._this(),
                     properties=props)
             conf = self.object.get_configuration()
             res = conf.add_service_profile(sprof)
             if res:
+                self._record_lease(True, uuid_val.bytes, 'logger')
                 self._loggers[uuid_val] = obs
                 return uuid_val
             raise exceptions.AddLoggerError(self.name)
@@ -1047,7 +1141,8 @@ class Component(TreeNode):
         if cb_id not in self._loggers:
             raise exceptions.NoLoggerError(cb_id, self.name)
         conf = self.object.get_configuration()
-        res = conf.remove_service_profile(cb_id.get_bytes())
+        res = conf.remove_service_profile(cb_id.bytes)
+        self._record_lease(False, cb_id.bytes)
         del self._loggers[cb_id]
 
     ###########################################################################
@@ -1073,15 +1168,32 @@ class Component(TreeNode):
         @param value The new value for the parameter.
         @raises NoSuchConfSetError, NoSuchConfParamError
 
+        '''
+        self.set_conf_set_values(set_name, {param: value})
+
+    def set_conf_set_values(self, set_name, values):
+        '''Set several parameter values in a configuration set at once.
+
+        Only the given parameters are sent to the component, in a single
+        call. To change the configuration of many components, use an
+        rtctree.transaction.ConfigTransaction.
+
+        @param set_name The name of the configuration set the parameters are
+                        in.
+        @param values A dictionary of parameter names and their new values.
+        @raises NoSuchConfSetError, NoSuchConfParamError
+
         '''
         with self._mutex:
-            if not set_name in self.conf_sets:
-                raise exceptions.NoSuchConfSetError(set_name)
-            if not self.conf_sets[set_name].has_param(param):
-                raise exceptions.NoSuchConfParamError(param)
-            self.conf_sets[set_name].set_param(param, value)
-            self._conf.set_configuration_set_values(\
-                    self.conf_sets[set_name].object)
+            self._check_conf_set_values(set_name, values)
+            cs = self.conf_sets[set_name]
+            # The component merges the values into the set, so the parameters
+            # that are not changing do not need to be sent.
+            update = SDOPackage.ConfigurationSet(set_name, cs.description,
+                    utils.dict_to_nvlist(values))
+            self._conf.set_configuration_set_values(update)
+            for param in values:
+                cs.set_param(param, values[param])
 
     @property
     def active_conf_set(self):
@@ -1109,6 +1221,8 @@ class Component(TreeNode):
         with self._mutex:
             if not self._conf_sets:
                 self._parse_configuration()
+            elif self._conf_dirty:
+                self._flush_conf_updates()
         return self._conf_sets
 
     ###########################################################################
@@ -1118,29 +1232,33 @@ class Component(TreeNode):
         # Components cannot contain children.
         raise exceptions.CannotHoldChildrenError
 
+    def _check_conf_set_values(self, set_name, values):
+        # Check that a configuration set and its parameters exist.
+        with self._mutex:
+            if not set_name in self.conf_sets:
+                raise exceptions.NoSuchConfSetError(set_name)
+            for param in values:
+                if not self.conf_sets[set_name].has_param(param):
+                    raise exceptions.NoSuchConfParamError(param)
+
     def _config_event(self, name, event):
+        # The changed values are not fetched here, on the ORB's thread. The
+        # changed sets are noted, and fetched once however many changes
+        # arrive before they are next read or the debounce timer fires.
         with self._mutex:
             if self._conf_sets:
-                if event == self.CFG_UPDATE_SET:
-                    # A configuration set has been updated
-                    cs = self._conf.get_configuration_set(name)
-                    self._conf_sets[name]._reload(cs, cs.description,
-                            utils.nvlist_to_dict(cs.configuration_data))
-                elif event == self.CFG_UPDATE_PARAM:
+                if event == self.CFG_UPDATE_PARAM:
                     # A parameter in a configuration set has been changed
-                    cset, param = name.split('.')
-                    cs = self._conf.get_configuration_set(cset)
-                    data = utils.nvlist_to_dict(cs.configuration_data)
-                    self._conf_sets[cset].set_param(param, data[param])
-                elif event == self.CFG_ADD_SET:
-                    # A new configuration set has been added
-                    cs = self._conf.get_configuration_set(name)
-                    self._conf_sets[name] = ConfigurationSet(self, cs,
-                            cs.description,
-                            utils.nvlist_to_dict(cs.configuration_data))
+                    cset, param = name.split('.', 1)
+                    self._mark_conf_dirty(cset, param)
+                elif event in (self.CFG_UPDATE_SET, self.CFG_SET_SET,
+                        self.CFG_ADD_SET):
+                    # A configuration set has been updated or added
+                    self._mark_conf_dirty(name, None)
                 elif event == self.CFG_REMOVE_SET:
                     # Remove the configuration set
-                    del self._conf_sets[name]
+                    self._conf_sets.pop(name, None)
+                    self._conf_dirty.pop(name, None)
                 elif event == self.CFG_ACTIVATE_SET:
                     # Change the active configuration set
                     self._active_conf_set = name
@@ -1149,36 +1267,105 @@ class Component(TreeNode):
 
     def _enable_dynamic(self, enable=True):
         if enable:
-            obs = sdo.RTCObserver(self)
-            uuid_val = uuid.uuid4().get_bytes()
-            intf_type = obs._this()._NP_RepositoryId
-            props = utils.dict_to_nvlist({'heartbeat.enable': 'YES',
-                'heartbeat.interval': '1.0',
-                'rtc_heartbeat.enable': 'YES',
-                'rtc_heartbeat.interval': '1.0',
-                'ec_heartbeat.enable': 'YES',
-                'ec_heartbeat.interval': '1.0',
-                'observed_status': 'ALL'})
-            sprof = SDOPackage.ServiceProfile(id=uuid_val,
-                    interface_type=intf_type, service=obs._this(),
-                    properties=props)
-            conf = self.object.get_configuration()
-            res = conf.add_service_profile(sprof)
-            if res:
+            with self._mutex:
+                if self._observer_status in ('pending', 'observing'):
+                    return
                 self._dynamic = True
-                self._obs = obs
-                self._obs_id = uuid_val
-                # If we could set an observer, the component is alive
-                self._last_heartbeat = time.time()
-            else:
-                raise exceptions.InvalidSdoServiceError('Observer')
+                tree = self.tree
+                if tree is None:
+                    self._observer_status = 'pending'
+                    self._register_observer()
+                else:
+                    # Registered in the background so the tree can be used
+                    # while the observers are being registered
+                    self._observer_status = 'pending'
+                    tree._registrar.submit(self)
         else: # Disable
-            conf = self.object.get_configuration()
-            res = conf.remove_service_profile(self._obs_id)
-            if res:
+            with self._mutex:
+                if self._observer_status != 'observing':
+                    # Any queued registration will be skipped
+                    self._dynamic = False
+                    self._observer_status = 'off'
+                    return
+                conf = self.object.get_configuration()
+                res = conf.remove_service_profile(self._obs_id)
+                if res:
+                    self._record_lease(False, self._obs_id)
+                    self._dynamic = False
+                    self._obs = None
+                    self._obs_id = None
+                    self._observer_status = 'off'
+                    self._set_ecs_observed(False)
+
+    def _observer_failed(self):
+        # Called when the observer could not be registered.
+        with self._mutex:
+            if self._observer_status == 'pending':
                 self._dynamic = False
-                self._obs = None
-                self._obs_id = None
+                self._observer_status = 'failed'
+
+    def _record_lease(self, added, service_id, kind=None):
+        # Record a service profile added to or removed from the component in
+        # the tree's lease file, so it can be reclaimed if the tree is not
+        # released.
+        tree = self.tree
+        if tree is None:
+            return
+        if added:
+            tree._leases.add(self._obj, service_id, kind)
+        else:
+            tree._leases.remove(self._obj, service_id)
+
+    def _observes(self, kind):
+        # Is the observer registered and sent updates of a kind of status
+        # (one of rtctree.sdo.ObserverProfile.KINDS)? Cached values of other
+        # kinds are not kept current by the observer.
+        with self._mutex:
+            if self._observer_status != 'observing':
+                return False
+            kinds = self.observer_profile.kinds
+        return kinds is None or kind in kinds
+
+    def _register_observer(self):
+        # Register an observer with the component, if one is still wanted.
+        with self._mutex:
+            if self._observer_status != 'pending':
+                return False
+            obs = sdo.RTCObserver(self)
+            uuid_val = uuid.uuid4().bytes
+            res = self._add_observer_profile(obs, uuid_val)
+            if not res:
+                raise exceptions.InvalidSdoServiceError('Observer')
+            self._record_lease(True, uuid_val, 'observer')
+            self._obs = obs
+            self._obs_id = uuid_val
+            self._observer_status = 'observing'
+            self._set_ecs_observed(self._observes('EC_STATUS'))
+            # If we could set an observer, the component is alive
+            self._last_heartbeat = time.time()
+            return True
+
+    def _add_observer_profile(self, obs, obs_id):
+        # Add the service profile for an observer to the component, using the
+        # current observer profile. Adding a profile with the ID of an
+        # existing one updates it.
+        props = utils.dict_to_nvlist(self._tag_properties(
+            self.observer_profile.properties()))
+        sprof = SDOPackage.ServiceProfile(id=obs_id,
+                interface_type=obs._this()._NP_RepositoryId,
+                service=obs._this(), properties=props)
+        conf = self.object.get_configuration()
+        return conf.add_service_profile(sprof)
+
+    def _update_observer(self):
+        # Send the current observer profile to the component's observer.
+        with self._mutex:
+            if self._observer_status != 'observing':
+                # A pending registration will use the new profile
+                return
+            if not self._add_observer_profile(self._obs, self._obs_id):
+                raise exceptions.InvalidSdoServiceError('Observer')
+            self._set_ecs_observed(self._observes('EC_STATUS'))
 
     def _ec_event(self, ec_handle, event):
         def get_ec(ec_handle):
@@ -1186,13 +1373,13 @@ class Component(TreeNode):
             loc = None
             if self._owned_ecs:
                 for ec in self._owned_ecs:
-                    if ec.handle == ec_handle:
+                    if ec.get_handle(self) == ec_handle:
                         tgt_ec = ec
                         loc = self._owned_ecs
                         break
-            if not del_ec and self._participating_ecs:
+            if self._participating_ecs:
                 for ec in self._participating_ecs:
-                    if ec.handle == ec_handle:
+                    if ec.get_handle(self) == ec_handle:
                         tgt_ec = ec
                         loc = self._participating_ecs
                         break
@@ -1201,8 +1388,12 @@ class Component(TreeNode):
         with self._mutex:
             if event == self.EC_ATTACHED:
                 # New EC has been attached
-                self._participating_ecs.append(ExecutionContext(
-                    self._obj.get_context(ec_handle), ec_handle))
+                ec = self._get_shared_ec(self._obj.get_context(ec_handle),
+                        ec_handle)
+                # The EC's participants have changed
+                ec._parse()
+                if self._participating_ecs is not None:
+                    self._participating_ecs.append(ec)
             elif event == self.EC_DETACHED:
                 # An EC has been detached; delete the local facade
                 # if ec is not None, the corresponding EC has a local
@@ -1210,9 +1401,12 @@ class Component(TreeNode):
                 ec, loc = get_ec(ec_handle)
                 if ec:
                     loc.remove(ec)
+                    ec._parse()
             elif event == self.EC_RATE_CHANGED:
-                # Nothing to do
-                pass
+                # The new rate is not sent with the event
+                ec, loc = get_ec(ec_handle)
+                if ec:
+                    ec._set_rate(None)
             elif event == self.EC_STARTUP:
                 ec, loc = get_ec(ec_handle)
                 if ec:
@@ -1222,37 +1416,135 @@ class Component(TreeNode):
                 if ec:
                     ec._set_running(False)
         # Call callbacks outside the mutex
-        self._call_cb('ec_event', (ec_handle, state))
+        self._call_cb('ec_event', (ec_handle, event))
 
     def _get_ec_state(self, ec):
         # Get the state of this component in an EC and return the enum value.
         if self._obj.is_alive(ec._obj):
-            ec_state = ec.get_component_state(self._obj)
-            if ec_state == RTC.ACTIVE_STATE:
-                return self.ACTIVE
-            elif ec_state == RTC.ERROR_STATE:
-                return self.ERROR
-            elif ec_state == RTC.INACTIVE_STATE:
-                return self.INACTIVE
-            else:
-                return self.UNKNOWN
+            return self._lifecycle_state(ec.get_component_state(self._obj))
         else:
             return self.CREATED
 
-    def _heartbeat(self, kind):
+    def _composition_index(self):
+        # The tree's composition index, if it has been built.
+        tree = self.tree
+        if tree is None:
+            return None
+        return tree._composition
+
+    def _get_shared_ec(self, ec_obj, handle):
+        # Get the ExecutionContext object for an EC, shared with the other
+        # components in the tree that use the same EC.
+        tree = self.tree
+        if tree is None:
+            ec = ExecutionContext(ec_obj, handle)
+            ec._set_handle(self, handle)
+        else:
+            ec = tree._ecs.get(ec_obj, self, handle)
+        if self._observes('EC_STATUS'):
+            # This component's observer keeps the EC's cached values current
+            self._set_ec_observed(ec, True)
+        return ec
+
+    def _lifecycle_state(self, ec_state):
+        # Convert a LifeCycleState value to the enum value.
+        if ec_state == RTC.ACTIVE_STATE:
+            return self.ACTIVE
+        elif ec_state == RTC.ERROR_STATE:
+            return self.ERROR
+        elif ec_state == RTC.INACTIVE_STATE:
+            return self.INACTIVE
+        else:
+            return self.UNKNOWN
+
+    def _heartbeat(self, kind, hint=''):
         # Received a heart beat signal
         self._last_heartbeat = time.time()
+        if kind == 'EC_HEARTBEAT':
+            # The hint ends with the handle of the EC
+            try:
+                ec = self._known_ec(int(hint.rpartition(':')[2]))
+            except ValueError:
+                ec = None
+            if ec is not None:
+                ec.monitor.record_heartbeat(self._last_heartbeat)
         self._call_cb('heartbeat', (kind, self._last_heartbeat))
 
+    def _known_ec(self, ec_handle):
+        # Find an EC by handle without fetching the lists of ECs.
+        with self._mutex:
+            for ec in (self._owned_ecs or []) + (self._participating_ecs or []):
+                if ec.get_handle(self) == ec_handle:
+                    return ec
+        return None
+
+    def _flush_conf_updates(self, name=None):
+        # Fetch the configuration sets that have changed, or only the named
+        # set. A set with changed parameters only has those parameters
+        # updated.
+        with self._mutex:
+            if name is None:
+                names = list(self._conf_dirty.keys())
+            elif name in self._conf_dirty:
+                names = [name]
+            else:
+                return
+            for n in names:
+                params = self._conf_dirty.pop(n)
+                try:
+                    cs = self._conf.get_configuration_set(n)
+                except Exception:
+                    # Try again the next time the set is used
+                    self._conf_dirty[n] = params
+                    raise
+                if params is None or n not in self._conf_sets:
+                    data = utils.nvlist_to_dict(cs.configuration_data)
+                    if n in self._conf_sets:
+                        self._conf_sets[n]._reload(cs, cs.description, data)
+                    else:
+                        self._conf_sets[n] = ConfigurationSet(self, cs,
+                                cs.description, data)
+                else:
+                    self._conf_sets[n]._update_params(cs,
+                            dict([(nv.name, nv.value.value()) \
+                                for nv in cs.configuration_data \
+                                if nv.name in params]))
+
+    def _conf_timer_fired(self):
+        # Fetch the changed configuration sets in the background.
+        with self._mutex:
+            self._conf_timer = None
+        try:
+            self._flush_conf_updates()
+        except Exception as e:
+            self._call_cb('config_error', e)
+
     def _fsm_event(self, kind, hint):
         # Received a fsm event
         self._call_cb('fsm_event', (kind, hint))
 
+    def _mark_conf_dirty(self, name, param):
+        # Note a change to a configuration set, or to one parameter in it, and
+        # start the debounce timer if it is not already running.
+        params = self._conf_dirty.get(name, set())
+        if param is None or params is None:
+            self._conf_dirty[name] = None
+        else:
+            params.add(param)
+            self._conf_dirty[name] = params
+        if self._conf_timer is None:
+            self._conf_timer = threading.Timer(
+                    Options().get_option('config_debounce'),
+                    self._conf_timer_fired)
+            self._conf_timer.daemon = True
+            self._conf_timer.start()
+
     def _parse_configuration(self):
         # Parse the component's configuration sets
         with self._mutex:
             self._conf = self.object.get_configuration()
             self._conf_sets = {}
+            self._conf_dirty = {}
             for cs in self._conf.get_configuration_sets():
                 self._conf_sets[cs.id] = ConfigurationSet(self, cs, cs.description,
                         utils.nvlist_to_dict(cs.configuration_data))
@@ -1261,10 +1553,11 @@ class Component(TreeNode):
             except SDOPackage.NotAvailable:
                 self._active_conf_set = ''
 
-    def _parse_profile(self):
-        # Parse the component's profile
+    def _parse_profile(self, profile=None):
+        # Parse the component's profile, retrieving it if it is not given
         with self._mutex:
-            profile = self._obj.get_component_profile()
+            if profile is None:
+                profile = self._obj.get_component_profile()
             self._instance_name = profile.instance_name
             self._type_name = profile.type_name
             self._description = profile.description
@@ -1313,10 +1606,47 @@ class Component(TreeNode):
         # Call callbacks outside the mutex
         self._call_cb('component_profile', items)
 
+    def _restore(self, data, orb):
+        # Restore the component from snapshot data without contacting it.
+        with self._mutex:
+            self._obj = orb.string_to_object(data['ior'])._unchecked_narrow(
+                    RTC.RTObject)
+            self._obs = None
+            self._obs_id = None
+            self._observer_profile = None
+            self._observer_status = 'off'
+            self._loggers = {}
+            self._conf_timer = None
+            self._last_heartbeat = time.time()
+            self._set_events(self._events)
+            self._reset_data()
+            profile = data['profile']
+            self._instance_name = profile['instance_name']
+            self._type_name = profile['type_name']
+            self._description = profile['description']
+            self._version = profile['version']
+            self._vendor = profile['vendor']
+            self._category = profile['category']
+            self._parent_obj = profile['parent_object']
+            self._properties = profile['properties']
+            if data['ports'] is not None:
+                self._ports = [ports.restore_port(p, self, orb) \
+                        for p in data['ports']]
+
+    def _release_services(self):
+        # Remove the observer and loggers this component has registered.
+        self.dynamic = False
+        for cb_id in list(self._loggers.keys()):
+            self.remove_logger(cb_id)
+
     def _reset_conf_sets(self):
         with self._mutex:
             self._conf_sets = None
             self._active_conf_set = None
+            self._conf_dirty = {}
+            if self._conf_timer is not None:
+                self._conf_timer.cancel()
+                self._conf_timer = None
 
     def _reset_data(self):
         self._reset_owned_ecs()
@@ -1329,19 +1659,23 @@ class Component(TreeNode):
         with self._mutex:
             self._owned_ecs = None
             self._owned_ec_states = None
+            self._merged_state = None
 
     def _reset_owned_ec_states(self):
         with self._mutex:
             self._owned_ec_states = None
+            self._merged_state = None
 
     def _reset_participating_ecs(self):
         with self._mutex:
             self._participating_ecs = None
             self._participating_ec_states = None
+            self._merged_state = None
 
     def _reset_participating_ec_states(self):
         with self._mutex:
             self._participating_ec_states = None
+            self._merged_state = None
 
     def _reset_ports(self):
         with self._mutex:
@@ -1353,6 +1687,63 @@ class Component(TreeNode):
             self._parent_orgs = []
             self._members = {}
 
+    def _set_ec_states(self, owned, participating):
+        # Set the states of this component in its ECs, fetched elsewhere.
+        with self._mutex:
+            self._owned_ec_states = owned
+            self._participating_ec_states = participating
+            self._update_merged_state()
+
+    def _set_ecs_observed(self, observed):
+        # Tell the known ECs whether this component is observing them.
+        with self._mutex:
+            for ec in (self._owned_ecs or []) + (self._participating_ecs or []):
+                self._set_ec_observed(ec, observed)
+
+    def _set_ec_observed(self, ec, observed):
+        # Tell an EC whether this component is observing its status, and the
+        # period of the heartbeats it will receive.
+        ec._set_observed(self, observed)
+        if self._observer_status == 'observing':
+            period = self.observer_profile.ec_heartbeat
+            if period is not None:
+                ec.monitor.expected_period = period
+
+    def _tag_properties(self, props):
+        # Add the tree's session ID to the properties of a service profile,
+        # identifying the tree that registered it.
+        tree = self.tree
+        if tree is not None:
+            props = dict(props)
+            props['rtctree.session'] = tree.session_id
+        return props
+
+    def _update_merged_state(self):
+        # Merge the states in the execution contexts into the component's
+        # state. Called whenever the lists of states change. The tree is told
+        # when the merged state changes, so it can count the components in
+        # each state.
+        with self._mutex:
+            if self._owned_ec_states is None or \
+                    self._participating_ec_states is None:
+                # Not known until both lists have been retrieved
+                return
+            states = self._owned_ec_states + self._participating_ec_states
+            if not states:
+                merged = self.UNKNOWN
+            elif self.ERROR in states:
+                merged = self.ERROR
+            elif self.ACTIVE in states:
+                merged = self.ACTIVE
+            elif self.INACTIVE in states:
+                merged = self.INACTIVE
+            else:
+                merged = self.CREATED
+            if merged == self._merged_state:
+                return
+            self._merged_state = merged
+        self._tree_event('state_changed', self, merged)
+
     def _set_state_in_ec(self, ec_handle, state):
         # Forcefully set the state of this component in an EC
         with self._mutex:
@@ -1361,11 +1752,19 @@ class Component(TreeNode):
                 if ec_handle >= len(self.participating_ecs):
                     raise exceptions.BadECIndexError(ec_handle)
                 self.participating_ec_states[ec_handle] = state
+                ec = self.participating_ecs[ec_handle]
             else:
                 self.owned_ec_states[ec_handle] = state
+                ec = self.owned_ecs[ec_handle]
+            self._update_merged_state()
+        ec.monitor.record_state_change()
         # Call callbacks outside the mutex
         self._call_cb('rtc_status', (ec_handle, state))
 
+    # The callback events available on component nodes
+    _events = ['rtc_status', 'component_profile', 'ec_event', 'port_event',
+            'config_event', 'config_error', 'heartbeat', 'fsm_event']
+
     # Constant for a component in the inactive state
     INACTIVE = 1
     # Constant for a component in the active state
@@ -1377,6 +1776,13 @@ class Component(TreeNode):
     # Constant for a component in the created state
     CREATED = 5
 
+    # The string and colours used to display each state
+    _state_strings = {INACTIVE: ('Inactive', ['bold', 'blue']),
+            ACTIVE: ('Active', ['bold', 'green']),
+            ERROR: ('Error', ['bold', 'white', 'bgred']),
+            UNKNOWN: ('Unknown', ['bold', 'red']),
+            CREATED: ('Created', ['reset'])}
+
     # Constant for execution context event "attached"
     EC_ATTACHED = 11
     # Constant for execution context event "detached"
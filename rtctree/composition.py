@@ -0,0 +1,293 @@
+# -*- Python -*-
+# -*- coding: utf-8 -*-
+
+'''rtctree
+
+Copyright (C) 2009-2015
+    Geoffrey Biggs
+    RT-Synthesis Research Group
+    Intelligent Systems Research Institute,
+    National Institute of Advanced Industrial Science and Technology (AIST),
+    Japan
+    All rights reserved.
+Licensed under the GNU Lesser General Public License version 3.
+http://www.gnu.org/licenses/lgpl-3.0.en.html
+
+Index of the composite components in a tree and their members.
+
+'''
+
+
+import collections
+import threading
+import time
+
+from rtctree import utils
+from rtctree.node import shared_node
+
+
+# Maximum value for CORBA object hashes
+_MAX_HASH = 0x7FFFFFFF
+# The first delay before the organisations of a component that could not be
+# reached are retrieved again, in seconds
+_FIRST_RETRY = 1.0
+# The longest delay between retries, in seconds
+_MAX_RETRY = 60.0
+
+
+##############################################################################
+## Composition index object
+
+class CompositionIndex(object):
+    '''Maps composite components to their members and back.
+
+    The organisations of all components are retrieved once, concurrently,
+    when the index is built, and their members are resolved to the nodes in
+    the tree. After that, membership and parent queries are answered without
+    contacting the components. Components added to the tree later have their
+    organisations retrieved the next time the index is queried. Components
+    whose organisations could not be retrieved are treated as having no
+    members, and are retried when the index is queried at increasing
+    intervals, or immediately when the index is built again.
+
+    Shared nodes are treated as the nodes they share.
+
+    Members that are not in the tree are kept as CORBA object references, and
+    resolved to nodes if they are added to the tree later.
+
+    '''
+    def __init__(self, *args, **kwargs):
+        super(CompositionIndex, self).__init__(*args, **kwargs)
+        self._mutex = threading.RLock()
+        # Composite node -> {organisation ID: [member nodes or objects]}
+        self._members = {}
+        # Member node -> list of composite nodes
+        self._parents = {}
+        # Object hash -> list of component nodes
+        self._objs = {}
+        # Components whose organisations have not been retrieved
+        self._pending = set()
+        # Unreachable component -> (time of the next retry, retry delay)
+        self._failed = {}
+        self._max_workers = None
+
+    def add(self, comp):
+        '''Add a component to the index.
+
+        Its organisations are retrieved the next time the index is queried.
+
+        '''
+        comp = shared_node(comp)
+        with self._mutex:
+            if comp in self._members or comp in self._pending or \
+                    comp in self._failed:
+                return
+            self._objs.setdefault(comp.object._hash(_MAX_HASH), []).append(
+                    comp)
+            self._pending.add(comp)
+            # Resolve any references to it from existing compositions
+            for composite, orgs in self._members.items():
+                for members in orgs.values():
+                    for ii, m in enumerate(members):
+                        if not _is_node(m) and \
+                                m._is_equivalent(comp.object):
+                            members[ii] = comp
+                            self._parents.setdefault(comp, []).append(
+                                    composite)
+
+    def add_members(self, composite, members):
+        '''Record that members have been added to a composite component.
+
+        @param composite The composite component node.
+        @param members A list of component nodes.
+
+        '''
+        composite = shared_node(composite)
+        with self._mutex:
+            self._refresh()
+            orgs = self._members.get(composite)
+            if not orgs:
+                return
+            # Members are added to the first organisation, as in
+            # Component.add_members
+            org_members = list(orgs.values())[0]
+            for m in [shared_node(m) for m in members]:
+                if m not in org_members:
+                    org_members.append(m)
+                    self._parents.setdefault(m, []).append(composite)
+
+    def build(self, comps, max_workers=None):
+        '''Build the index from a list of component nodes.
+
+        @param comps The component nodes.
+        @param max_workers The maximum number of remote calls to make at once.
+
+        '''
+        with self._mutex:
+            self._max_workers = max_workers
+            for c in utils.unique_nodes(comps):
+                self.add(c)
+            # Retry unreachable components now
+            self._pending.update(self._failed.keys())
+            self._refresh()
+
+    def is_composite(self, comp):
+        '''Is a component a composite component?'''
+        comp = shared_node(comp)
+        with self._mutex:
+            self._refresh()
+            return bool(self._members.get(comp))
+
+    def is_member(self, composite, rtc):
+        '''Is a component a member of a composite component?
+
+        @param composite The composite component node.
+        @param rtc A component node or an instance name.
+
+        '''
+        if type(rtc) is not str:
+            rtc = shared_node(rtc)
+        for m in self.member_list(composite):
+            if m is rtc:
+                return True
+            if _is_node(m) and type(rtc) is str and m.instance_name == rtc:
+                return True
+        return False
+
+    def member_list(self, composite):
+        '''Get all the members of a composite component as a list.'''
+        composite = shared_node(composite)
+        with self._mutex:
+            self._refresh()
+            return [m for members in self._members.get(composite, {}).values()
+                    for m in members]
+
+    def members(self, composite):
+        '''Get the members of each organisation of a composite component.
+
+        @return A dictionary mapping organisation IDs to lists of members.
+                Members in the tree are nodes; others are CORBA object
+                references.
+
+        '''
+        composite = shared_node(composite)
+        with self._mutex:
+            self._refresh()
+            return dict([(k, list(v)) for k, v in \
+                    self._members.get(composite, {}).items()])
+
+    def parents(self, comp):
+        '''Get the composite components a component is a member of.'''
+        comp = shared_node(comp)
+        with self._mutex:
+            self._refresh()
+            return list(self._parents.get(comp, []))
+
+    def remove(self, comp):
+        '''Remove a component from the index.'''
+        comp = shared_node(comp)
+        with self._mutex:
+            self._pending.discard(comp)
+            self._failed.pop(comp, None)
+            bucket = self._objs.get(comp.object._hash(_MAX_HASH), [])
+            if comp in bucket:
+                bucket.remove(comp)
+            # Compositions it belongs to keep a reference to its object
+            for composite in self._parents.pop(comp, []):
+                for members in self._members.get(composite, {}).values():
+                    if comp in members:
+                        members[members.index(comp)] = comp.object
+            for members in self._members.pop(comp, {}).values():
+                for m in members:
+                    if _is_node(m) and comp in self._parents.get(m, []):
+                        self._parents[m].remove(comp)
+
+    def remove_members(self, composite, members):
+        '''Record that members have been removed from a composite component.
+
+        @param composite The composite component node.
+        @param members A list of component nodes or instance names.
+
+        '''
+        composite = shared_node(composite)
+        with self._mutex:
+            self._refresh()
+            for rtc in members:
+                if type(rtc) is not str:
+                    rtc = shared_node(rtc)
+                for org_members in self._members.get(composite, {}).values():
+                    for m in list(org_members):
+                        if m is rtc or (_is_node(m) and type(rtc) is str and \
+                                m.instance_name == rtc):
+                            org_members.remove(m)
+                            if composite in self._parents.get(m, []):
+                                self._parents[m].remove(composite)
+
+    @property
+    def composites(self):
+        '''The composite components in the index.'''
+        with self._mutex:
+            self._refresh()
+            return [c for c, orgs in self._members.items() if orgs]
+
+    def _find(self, obj):
+        # Find the node for an object reference.
+        for c in self._objs.get(obj._hash(_MAX_HASH), []):
+            if c.object._is_equivalent(obj):
+                return c
+        return None
+
+    def _refresh(self):
+        # Retrieve the organisations of the pending components, and of the
+        # unreachable components that are due to be retried.
+        now = time.time()
+        for comp, (retry_at, delay) in list(self._failed.items()):
+            if retry_at <= now:
+                self._pending.add(comp)
+        if not self._pending:
+            return
+        pending = list(self._pending)
+        self._pending = set()
+        results = utils.parallel_map(_get_orgs, pending,
+                max_workers=self._max_workers, return_exceptions=True)
+        for comp, orgs in zip(pending, results):
+            if isinstance(orgs, Exception):
+                # Treat unreachable components as having no members until
+                # they can be reached, retrying at increasing intervals
+                if comp in self._failed:
+                    delay = min(self._failed[comp][1] * 2, _MAX_RETRY)
+                else:
+                    delay = _FIRST_RETRY
+                self._failed[comp] = (time.time() + delay, delay)
+                continue
+            self._failed.pop(comp, None)
+            resolved = collections.OrderedDict()
+            for org_id, objs in orgs.items():
+                resolved[org_id] = []
+                for obj in objs:
+                    node = self._find(obj)
+                    if node is None:
+                        resolved[org_id].append(obj)
+                    else:
+                        resolved[org_id].append(node)
+                        self._parents.setdefault(node, []).append(comp)
+            self._members[comp] = resolved
+
+
+##############################################################################
+## Internal functions
+
+def _get_orgs(comp):
+    # Get the members of each organisation owned by a component, in the
+    # order the component gives the organisations.
+    result = collections.OrderedDict()
+    for org in comp.object.get_owned_organizations():
+        result[org.get_organization_id()] = org.get_members()
+    return result
+
+
+def _is_node(m):
+    return hasattr(m, 'full_path')
+
+
+# vim: set expandtab tabstop=8 shiftwidth=4 softtabstop=4 textwidth=79
@@ -43,19 +43,34 @@ class ConfigurationSet(object):
         self._object = object
         self._description = description
         self._data = data
+        # True when the data has been changed locally and the CORBA object's
+        # configuration data has not yet been rebuilt from it
+        self._stale = False
 
     def has_param(self, param):
         '''Check if this configuration set has the given parameter.'''
         return param in self.data
 
     def set_param(self, param, value):
-        '''Set a parameter in this configuration set.'''
+        '''Set a parameter in this configuration set.
+
+        The CORBA object's configuration data is rebuilt from the parameters
+        the next time the object is used.
+
+        '''
         self.data[param] = value
-        self._object.configuration_data = utils.dict_to_nvlist(self.data)
+        self._stale = True
 
     @property
     def data(self):
-        '''Read-only access to the configuration set's parameters.'''
+        '''Read-only access to the configuration set's parameters.
+
+        If the owning component has received notice of changes to this set,
+        the changed values are fetched first.
+
+        '''
+        if self._owner is not None and self._object is not None:
+            self._owner._flush_conf_updates(self._object.id)
         return self._data
 
     @property
@@ -66,6 +81,9 @@ class ConfigurationSet(object):
     @property
     def object(self):
         '''The CORBA ConfigurationSet object this object wraps.'''
+        if self._stale:
+            self._object.configuration_data = utils.dict_to_nvlist(self._data)
+            self._stale = False
         return self._object
 
     def _reload(self, object, description, data):
@@ -73,6 +91,19 @@ class ConfigurationSet(object):
         self._object = object
         self._description = description
         self._data = data
+        self._stale = False
+
+    def _update_params(self, object, values):
+        '''Update some parameters from a newly-fetched CORBA object.
+
+        Only the given parameters are changed in the data. The object's
+        configuration data is rebuilt from the data the next time the object
+        is used, so the two agree on the other parameters as well.
+
+        '''
+        self._object = object
+        self._data.update(values)
+        self._stale = True
 
 
 # vim: set expandtab tabstop=8 shiftwidth=4 softtabstop=4 textwidth=79
@@ -0,0 +1,189 @@
+# -*- Python -*-
+# -*- coding: utf-8 -*-
+
+'''rtctree
+
+Copyright (C) 2009-2015
+    Geoffrey Biggs
+    RT-Synthesis Research Group
+    Intelligent Systems Research Institute,
+    National Institute of Advanced Industrial Science and Technology (AIST),
+    Japan
+    All rights reserved.
+Licensed under the GNU Lesser General Public License version 3.
+http://www.gnu.org/licenses/lgpl-3.0.en.html
+
+Saving and restoring the configuration of a whole system.
+
+A configuration file holds the configuration sets, with their parameter
+values, and the name of the active set of every component in a tree. It is
+compressed JSON, keyed by the components' paths, so it can be restored into
+any tree containing the same components, such as after the system has been
+restarted.
+
+'''
+
+
+import gzip
+import json
+
+from rtctree import exceptions
+from rtctree import utils
+from rtctree.transaction import ConfigTransaction
+
+
+# Identifies configuration files
+FORMAT = 'rtctree-configuration'
+# Changed whenever the structure of the file changes
+FORMAT_VERSION = 1
+
+
+##############################################################################
+## API functions
+
+def save(tree, path, max_workers=None):
+    '''Save the configuration of all the components in a tree.
+
+    The configurations are fetched from the components concurrently. The
+    configurations of components kept up to date by an observer are not
+    fetched again.
+
+    @param tree The RTCTree to save.
+    @param path The path of the file to write.
+    @param max_workers The maximum number of remote calls to make at once.
+    @return A dictionary mapping the path of each component whose
+            configuration could not be fetched to the exception raised.
+
+    '''
+    comps = tree._root.iterate(lambda n, args: n, filter=['is_component'])
+    comps = utils.unique_nodes(comps)
+    results = utils.parallel_map(_fetch, comps, max_workers=max_workers,
+            return_exceptions=True)
+    data = {}
+    failed = {}
+    for c, r in zip(comps, results):
+        if isinstance(r, Exception):
+            failed[c.full_path_str] = r
+        else:
+            data[c.full_path_str] = r
+    f = gzip.open(path, 'wb')
+    try:
+        f.write(json.dumps({'format': FORMAT, 'version': FORMAT_VERSION,
+            'components': data}, sort_keys=True,
+            separators=(',', ':')).encode('utf-8'))
+    finally:
+        f.close()
+    return failed
+
+
+def load(tree, path, activate=True, max_workers=None):
+    '''Restore the configuration of the components in a tree.
+
+    The saved configuration of each component is compared with its current
+    configuration, fetched concurrently, and only the parameters that differ
+    are sent, with one call per changed configuration set. Components whose
+    configuration has not changed are not sent anything. The changes are
+    applied as a rtctree.transaction.ConfigTransaction, so the saved active
+    sets are only activated if all the changes succeed.
+
+    @param tree The RTCTree to restore the configuration into.
+    @param path The path of a file written by @ref save.
+    @param activate If True, the active set of each component is changed to
+                    the one saved, if it differs.
+    @param max_workers The maximum number of remote calls to make at once.
+    @return A dictionary mapping the path of each component in the file to
+            the number of configuration sets changed (and activated), or to
+            the exception raised if the component is not in the tree (a
+            BadPathError), its configuration does not have the saved sets
+            and parameters, or it could not be changed.
+    @raises BadConfigFileError
+
+    '''
+    saved = _read(path)
+    results = {}
+    comps = []
+    for comp_path in sorted(saved):
+        node_path = ['/'] + [p for p in comp_path.split('/') if p]
+        node = tree.get_node(node_path) if tree.has_path(node_path) else None
+        if node is None or not node.is_component:
+            results[comp_path] = exceptions.BadPathError(comp_path)
+        else:
+            comps.append((comp_path, node))
+    diffs = utils.parallel_map(lambda c: _diff(c[1], saved[c[0]], activate),
+            comps, max_workers=max_workers, return_exceptions=True)
+    txn = ConfigTransaction(max_workers=max_workers)
+    paths = {}
+    for (comp_path, node), diff in zip(comps, diffs):
+        if isinstance(diff, Exception):
+            results[comp_path] = diff
+            continue
+        changes, active = diff
+        for set_name, values in changes.items():
+            for param, value in values.items():
+                txn.set(node, set_name, param, value)
+        if active is not None:
+            txn.activate(node, active)
+        paths[node] = comp_path
+        results[comp_path] = len(changes) + (1 if active is not None else 0)
+    for node, r in txn.commit():
+        if isinstance(r, Exception):
+            results[paths[node]] = r
+    return results
+
+
+##############################################################################
+## Internal functions
+
+def _diff(comp, saved, activate):
+    # Find the parameters and active set that differ between a component's
+    # saved and current configuration.
+    current = _fetch(comp)
+    changes = {}
+    for set_name, values in saved['sets'].items():
+        if set_name not in current['sets']:
+            raise exceptions.NoSuchConfSetError(set_name)
+        live = current['sets'][set_name]
+        changed = {}
+        for param, value in values.items():
+            if param not in live:
+                raise exceptions.NoSuchConfParamError(param)
+            if live[param] != value:
+                changed[param] = value
+        if changed:
+            changes[set_name] = changed
+    active = None
+    if activate and saved['active'] and saved['active'] != current['active']:
+        active = saved['active']
+    return changes, active
+
+
+def _fetch(comp):
+    # Get a component's configuration, fetching it again unless an observer
+    # keeps it up to date.
+    if not comp._observes('CONFIGURATION'):
+        comp.reparse_conf_sets()
+    sets = comp.conf_sets
+    return {'active': comp.active_conf_set_name,
+            'sets': dict([(name, dict(cs.data)) for name, cs in sets.items()])}
+
+
+def _read(path):
+    # Read the saved configurations from a file.
+    try:
+        f = gzip.open(path, 'rb')
+        try:
+            data = json.loads(f.read().decode('utf-8'))
+        finally:
+            f.close()
+    except (IOError, OSError, ValueError) as e:
+        raise exceptions.BadConfigFileError(path, e)
+    if not isinstance(data, dict) or data.get('format') != FORMAT:
+        raise exceptions.BadConfigFileError(path,
+                'not a configuration file')
+    if data.get('version') != FORMAT_VERSION:
+        raise exceptions.BadConfigFileError(path,
+                'unsupported version {0}'.format(data.get('version')))
+    return data['components']
+
+
+# vim: set expandtab tabstop=8 shiftwidth=4 softtabstop=4 textwidth=79
@@ -0,0 +1,613 @@
+# -*- Python -*-
+# -*- coding: utf-8 -*-
+
+'''rtctree
+
+Copyright (C) 2009-2015
+    Geoffrey Biggs
+    RT-Synthesis Research Group
+    Intelligent Systems Research Institute,
+    National Institute of Advanced Industrial Science and Technology (AIST),
+    Japan
+    All rights reserved.
+Licensed under the GNU Lesser General Public License version 3.
+http://www.gnu.org/licenses/lgpl-3.0.en.html
+
+A local tree cache daemon and its client.
+
+The daemon keeps a dynamic RTCTree up to date using observers and serves it
+to processes on the same host over a Unix socket. The structure of the tree
+and the component profiles are published as a mapped snapshot (see
+rtctree.mapped), which clients read in place; other requests and change
+notifications are sent over the socket. This lets short-lived tools find
+components without creating an ORB or walking the name servers, and the name
+servers see a single client instead of one per tool.
+
+Requests and responses are JSON objects, one per line. Each request has an
+'op' member:
+
+  snapshot  Get the path of the mapped snapshot and its version.
+  get       Get fields of the node at 'path' (a list of path elements).
+            'fields' is an optional list of field names, as for
+            @ref RTCTree.query.
+  list      Get the names of the children of the node at 'path'.
+  find      Get the paths of the components matching 'criteria', as for
+            @ref RTCTree.find_components.
+  reparse   Reparse the node at 'path' from its remote object.
+  subscribe Receive a stream of change records until the connection is
+            closed.
+
+Responses have a 'result' member, or an 'error' member if the request failed.
+
+To run the daemon:
+
+  python -m rtctree.daemon [-s socket path] [name server ...]
+
+'''
+
+
+import json
+import optparse
+import os
+import os.path
+import socket
+import sys
+import tempfile
+import threading
+import time
+try:
+    import queue
+    import socketserver
+except ImportError:
+    import Queue as queue
+    import SocketServer as socketserver
+
+from rtctree import DAEMON_SOCKET_ENV_VAR
+from rtctree import exceptions
+from rtctree import index
+from rtctree import mapped
+from rtctree.tree import RTCTree
+
+
+# Events that change the contents of the mapped snapshot
+_STRUCTURE_EVENTS = ['node_added', 'node_removed', 'component_profile']
+
+
+##############################################################################
+## API functions
+
+def default_socket_path():
+    '''Get the path of the daemon's socket.
+
+    This is the value of the RTCTREE_DAEMON_SOCKET environment variable if it
+    is set, or a per-user path in the temporary directory otherwise.
+
+    '''
+    if DAEMON_SOCKET_ENV_VAR in os.environ:
+        return os.environ[DAEMON_SOCKET_ENV_VAR]
+    return os.path.join(tempfile.gettempdir(),
+            'rtctree-{0}.sock'.format(os.getuid()))
+
+
+##############################################################################
+## Daemon object
+
+class TreeDaemon(object):
+    '''Serves a dynamic tree to local client processes.'''
+    def __init__(self, socket_path=None, snapshot_path=None, servers=None,
+            orb=None, filter=[], tree=None, write_delay=0.5,
+            queue_size=1000, *args, **kwargs):
+        '''Constructor.
+
+        @param socket_path The path of the Unix socket to listen on. If None,
+                           @ref default_socket_path is used.
+        @param snapshot_path The path to write the mapped snapshot to. If
+                             None, the socket path with '.map' appended is
+                             used.
+        @param servers A list of name servers to parse into the tree. If
+                       None, the name servers in the environment are used.
+        @param orb If not None, the specified ORB will be used.
+        @param filter A list of paths to limit the tree to. See @ref RTCTree.
+        @param tree If not None, serve this tree instead of creating one. It
+                    should be dynamic.
+        @param write_delay The time in seconds to wait after the tree changes
+                           before rewriting the snapshot, so that bursts of
+                           changes cause a single write.
+        @param queue_size The maximum number of change records to queue for
+                          each subscriber. A subscriber that falls further
+                          behind receives an 'overflow' record and should
+                          reload the snapshot.
+
+        '''
+        super(TreeDaemon, self).__init__(*args, **kwargs)
+        self._socket_path = socket_path or default_socket_path()
+        self._snapshot_path = snapshot_path or self._socket_path + '.map'
+        if tree is None:
+            tree = RTCTree(servers=servers, orb=orb, filter=filter,
+                    dynamic=True)
+        self._tree = tree
+        self._write_delay = write_delay
+        self._queue_size = queue_size
+        self._mutex = threading.RLock()
+        self._subscribers = []
+        self._version = 0
+        self._changed = threading.Event()
+        self._stopping = False
+        self._server = None
+        self._writer = None
+
+    def serve_forever(self):
+        '''Write the snapshot and serve clients until @ref shutdown is called.
+        '''
+        self._write_snapshot()
+        self._tree.add_listener(self._tree_event)
+        self._writer = threading.Thread(target=self._write_loop)
+        self._writer.daemon = True
+        self._writer.start()
+        if os.path.exists(self._socket_path):
+            os.unlink(self._socket_path)
+        self._server = _Server(self._socket_path, _Handler)
+        self._server.tree_daemon = self
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            if os.path.exists(self._socket_path):
+                os.unlink(self._socket_path)
+
+    def shutdown(self):
+        '''Stop serving clients.'''
+        self._stopping = True
+        self._tree.remove_listener(self._tree_event)
+        self._changed.set()
+        with self._mutex:
+            subs = list(self._subscribers)
+        for s in subs:
+            s.put(None)
+        if self._server:
+            self._server.shutdown()
+
+    @property
+    def snapshot_path(self):
+        '''The path of the mapped snapshot.'''
+        return self._snapshot_path
+
+    @property
+    def socket_path(self):
+        '''The path of the socket clients connect to.'''
+        return self._socket_path
+
+    @property
+    def tree(self):
+        '''The tree being served.'''
+        return self._tree
+
+    @property
+    def version(self):
+        '''The number of times the snapshot has been written.'''
+        with self._mutex:
+            return self._version
+
+    def _handle(self, request):
+        # Handle a single request, returning the result.
+        op = request.get('op')
+        if op == 'snapshot':
+            with self._mutex:
+                return {'path': self._snapshot_path, 'version': self._version}
+        elif op in ('get', 'list', 'reparse'):
+            node = self._tree.get_node(request['path'])
+            if node is None:
+                raise exceptions.BadPathError(request['path'])
+            if op == 'get':
+                return _node_fields(node, request.get('fields'))
+            elif op == 'list':
+                return node.children_names
+            node.reparse()
+            return None
+        elif op == 'find':
+            return [n.full_path_str for n in \
+                    self._tree.find_components(request.get('criteria', {}))]
+        raise ValueError('unknown operation: {0}'.format(op))
+
+    def _publish(self, record):
+        with self._mutex:
+            subs = list(self._subscribers)
+        for s in subs:
+            s.put(record)
+
+    def _subscribe(self):
+        sub = _Subscriber(self._queue_size)
+        with self._mutex:
+            self._subscribers.append(sub)
+        return sub
+
+    def _tree_event(self, event, node, value):
+        if event in _STRUCTURE_EVENTS:
+            self._changed.set()
+        if event in ('node_added', 'node_removed'):
+            # The value is the parent node
+            value = value.full_path_str
+        self._publish({'event': event, 'path': node.full_path_str,
+            'value': _to_json(value)})
+
+    def _unsubscribe(self, sub):
+        with self._mutex:
+            self._subscribers.remove(sub)
+
+    def _write_loop(self):
+        # Rewrite the snapshot after the tree changes, at most once per write
+        # delay.
+        while True:
+            self._changed.wait()
+            if self._stopping:
+                return
+            time.sleep(self._write_delay)
+            self._changed.clear()
+            self._write_snapshot()
+
+    def _write_snapshot(self):
+        mapped.write(self._tree, self._snapshot_path)
+        with self._mutex:
+            self._version += 1
+            version = self._version
+        self._publish({'event': 'snapshot', 'path': None, 'value': version})
+
+
+##############################################################################
+## Client tree object
+
+class DaemonTree(object):
+    '''A read-only tree served by a @ref TreeDaemon.
+
+    The tree provides the read-only parts of the RTCTree API, answered from
+    the daemon's mapped snapshot. The snapshot is reopened automatically when
+    the daemon replaces it. Information that is not in the snapshot, such as
+    component states, is requested from the daemon using @ref get.
+
+    '''
+    def __init__(self, socket_path=None, *args, **kwargs):
+        '''Constructor.
+
+        @param socket_path The path of the daemon's socket. If None,
+                           @ref default_socket_path is used.
+        @raises socket.error if the daemon cannot be contacted.
+
+        '''
+        super(DaemonTree, self).__init__(*args, **kwargs)
+        self._socket_path = socket_path or default_socket_path()
+        self._mutex = threading.RLock()
+        self._conn = _Connection(self._socket_path)
+        self._snapshot_path = self._conn.request({'op': 'snapshot'})['path']
+        self._mapped = None
+        self._ino = None
+        self._open_snapshot()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def changes(self):
+        '''Iterate over the changes made to the tree.
+
+        Each change is a dictionary with the members 'event', 'path' and
+        'value'. A 'snapshot' event means the mapped snapshot has been
+        rewritten; an 'overflow' event means changes have been lost because
+        they were not consumed quickly enough. The iterator does not end until
+        the daemon shuts down.
+
+        '''
+        conn = _Connection(self._socket_path)
+        try:
+            conn.send({'op': 'subscribe'})
+            while True:
+                record = conn.receive()
+                if record is None:
+                    return
+                yield record
+        finally:
+            conn.close()
+
+    def close(self):
+        '''Disconnect from the daemon and unmap the snapshot.'''
+        with self._mutex:
+            self._conn.close()
+            if self._mapped is not None:
+                self._mapped.close()
+                self._mapped = None
+
+    def find_components(self, criteria={}, **kwargs):
+        '''Find the components in the tree matching a set of profile values.
+
+        See @ref RTCTree.find_components.
+
+        '''
+        return self._snapshot.find_components(criteria, **kwargs)
+
+    def get(self, path, fields=None):
+        '''Get the current values of fields of a node from the daemon.
+
+        @param path The path of the node, as a list of path elements.
+        @param fields A list of field names, as for @ref RTCTree.query. If
+                      None, the node's kind, the profile of a component and
+                      its state are returned.
+        @return A dictionary mapping the field names to their values.
+        @raises BadPathError, DaemonError
+
+        '''
+        with self._mutex:
+            return self._conn.request({'op': 'get', 'path': path,
+                'fields': fields})
+
+    def get_node(self, path):
+        '''Get a node by path from the snapshot.
+
+        @return A @ref MappedNode, or None if the path does not exist.
+
+        '''
+        return self._snapshot.get_node(path)
+
+    def has_path(self, path):
+        '''Check if the tree has a path.'''
+        return self._snapshot.has_path(path)
+
+    def is_component(self, path):
+        '''Is the node pointed to by @ref path a component?'''
+        return self._snapshot.is_component(path)
+
+    def is_directory(self, path):
+        '''Is the node pointed to by @ref path a directory?'''
+        return self._snapshot.is_directory(path)
+
+    def is_manager(self, path):
+        '''Is the node pointed to by @ref path a manager?'''
+        return self._snapshot.is_manager(path)
+
+    def is_nameserver(self, path):
+        '''Is the node pointed to by @ref path a name server?'''
+        return self._snapshot.is_nameserver(path)
+
+    def is_unknown(self, path):
+        '''Is the node pointed to by @ref path an unknown object?'''
+        return self._snapshot.is_unknown(path)
+
+    def is_zombie(self, path):
+        '''Is the node pointed to by @ref path a zombie object?'''
+        return self._snapshot.is_zombie(path)
+
+    def iterate(self, func, args=None, filter=[]):
+        '''Call a function on the root node, and recursively all its children.
+
+        See @ref TreeNode.iterate.
+
+        '''
+        return self._snapshot.iterate(func, args, filter)
+
+    def reparse(self, path):
+        '''Ask the daemon to reparse a node from its remote object.'''
+        with self._mutex:
+            self._conn.request({'op': 'reparse', 'path': path})
+
+    @property
+    def _snapshot(self):
+        # The mapped snapshot, reopened if the daemon has replaced it.
+        with self._mutex:
+            if os.stat(self._snapshot_path).st_ino != self._ino:
+                self._open_snapshot()
+            return self._mapped
+
+    def _open_snapshot(self):
+        ino = os.stat(self._snapshot_path).st_ino
+        new_mapped = mapped.MappedTree(self._snapshot_path)
+        if self._mapped is not None:
+            self._mapped.close()
+        self._mapped = new_mapped
+        self._ino = ino
+
+
+##############################################################################
+## Internal classes and functions
+
+class _Connection(object):
+    '''A client connection to the daemon.
+
+    Example, with a daemon that only lists the root node:
+    >>> class Daemon(object):
+    ...     def _handle(self, request):
+    ...         if request['path'] != ['/']:
+    ...             raise exceptions.BadPathError(request['path'])
+    ...         return ('localhost',)
+    >>> class Server(object):
+    ...     tree_daemon = Daemon()
+    >>> client_sock, server_sock = socket.socketpair()
+    >>> handler = threading.Thread(target=_Handler,
+    ...         args=(server_sock, None, Server()))
+    >>> handler.start()
+    >>> conn = _Connection(sock=client_sock)
+    >>> conn.request({'op': 'list', 'path': ['/']})
+    ['localhost']
+    >>> try:
+    ...     conn.request({'op': 'list', 'path': ['/', 'x']})
+    ... except exceptions.BadPathError as e:
+    ...     print(e)
+    Bad path: ['/', 'x']
+    >>> conn.close()
+    >>> handler.join()
+    >>> server_sock.close()
+    '''
+    def __init__(self, path=None, sock=None):
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(path)
+        self._sock = sock
+        self._rfile = self._sock.makefile('rb')
+
+    def close(self):
+        self._rfile.close()
+        self._sock.close()
+
+    def receive(self):
+        line = self._rfile.readline()
+        if not line:
+            return None
+        return json.loads(line.decode('utf-8'))
+
+    def request(self, request):
+        self.send(request)
+        response = self.receive()
+        if response is None:
+            raise socket.error('connection closed by daemon')
+        if 'error' in response:
+            if response.get('type') == 'BadPathError':
+                raise exceptions.BadPathError(request.get('path'))
+            raise exceptions.DaemonError(response['error'])
+        return response['result']
+
+    def send(self, request):
+        self._sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    # Handles the requests from one client connection.
+    def handle(self):
+        daemon = self.server.tree_daemon
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            try:
+                request = json.loads(line.decode('utf-8'))
+                if request.get('op') == 'subscribe':
+                    self._stream(daemon)
+                    return
+                response = {'result': _to_json(daemon._handle(request))}
+            except Exception as e:
+                response = {'error': str(e), 'type': type(e).__name__}
+            self._write(response)
+
+    def _stream(self, daemon):
+        sub = daemon._subscribe()
+        try:
+            while True:
+                record = sub.get()
+                if record is None:
+                    return
+                self._write(record)
+        except socket.error:
+            pass
+        finally:
+            daemon._unsubscribe(sub)
+
+    def _write(self, obj):
+        self.wfile.write(json.dumps(obj).encode('utf-8') + b'\n')
+        self.wfile.flush()
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _Subscriber(object):
+    '''A bounded queue of change records for one subscriber.
+
+    When the queue is full, records are dropped and a single 'overflow'
+    record is delivered once there is space.
+
+    Example:
+    >>> sub = _Subscriber(2)
+    >>> for ii in range(4):
+    ...     sub.put({'event': 'node_added', 'path': str(ii), 'value': None})
+    >>> sub.get()['path'], sub.get()['path'], sub.get()['event']
+    ('0', '1', 'overflow')
+    '''
+    def __init__(self, size):
+        self._queue = queue.Queue(size)
+        self._overflowed = False
+        self._mutex = threading.Lock()
+
+    def get(self):
+        record = self._queue.get()
+        with self._mutex:
+            if self._overflowed and self._queue.empty():
+                # Never block here: this thread is the queue's only
+                # consumer. If the queue is full, the flag stays set and the
+                # overflow is delivered later.
+                try:
+                    self._queue.put_nowait({'event': 'overflow', 'path': None,
+                        'value': None})
+                    self._overflowed = False
+                except queue.Full:
+                    pass
+        return record
+
+    def put(self, record):
+        with self._mutex:
+            try:
+                self._queue.put_nowait(record)
+            except queue.Full:
+                self._overflowed = True
+
+
+def _node_fields(node, fields):
+    # Get the values of fields of a node.
+    if fields is None:
+        result = {'full_path_str': node.full_path_str,
+                'kind': mapped._kind(node)}
+        if node.is_component:
+            for f in mapped._PROFILE_FIELDS:
+                result[f] = getattr(node, f)
+            result['properties'] = node.properties
+            result['state'] = node.state
+            result['state_string'] = node.get_state_string(add_colour=False)
+        return result
+    result = {}
+    for f in fields:
+        try:
+            if f.startswith('properties.'):
+                result[f] = index.get_field(node, f)
+            else:
+                result[f] = getattr(node, f)
+        except (AttributeError, KeyError):
+            result[f] = None
+    return result
+
+
+def _to_json(value):
+    # Convert a value to something that can be encoded as JSON.
+    if value is None or isinstance(value, (bool, int, float, str, type(u''))):
+        return value
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    if isinstance(value, (list, tuple, set)):
+        return [_to_json(v) for v in value]
+    if isinstance(value, dict):
+        return dict([(str(k), _to_json(v)) for k, v in value.items()])
+    return str(value)
+
+
+def main(argv=None):
+    '''Run the daemon from the command line.'''
+    if argv is None:
+        argv = sys.argv[1:]
+    parser = optparse.OptionParser(usage='%prog [options] [name server ...]')
+    parser.add_option('-s', '--socket', dest='socket_path', default=None,
+            help='Path of the socket to listen on. [Default: %default]')
+    parser.add_option('-m', '--snapshot', dest='snapshot_path', default=None,
+            help='Path to write the mapped snapshot to. [Default: the '
+            'socket path with .map appended]')
+    options, args = parser.parse_args(argv)
+    daemon = TreeDaemon(socket_path=options.socket_path,
+            snapshot_path=options.snapshot_path, servers=args or None)
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+
+# vim: set expandtab tabstop=8 shiftwidth=4 softtabstop=4 textwidth=79
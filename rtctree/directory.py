@@ -121,6 +121,19 @@ class Directory(TreeNode):
                                                 get_option('max_bindings'))
                 bindings_it.destroy()
 
+    def _reparse_child(self, name):
+        # Read the bindings of this directory's context again, but only
+        # process the binding with the given name. Use this to pick up a new
+        # object without rebuilding the rest of the directory.
+        self._parse_context(self._context, self.orb, filter=[[name]])
+
+    def _restore(self, data, orb):
+        # Restore the directory from snapshot data without contacting the
+        # name server. The child nodes are restored separately.
+        with self._mutex:
+            self._context = orb.string_to_object(data['ior'])._unchecked_narrow(
+                    CosNaming.NamingContext)
+
     def _process_binding(self, binding, orb, filter):
         if utils.filtered([corba_name_to_string(binding.binding_name)], filter):
             # Do not pass anything which does not pass the filter
@@ -163,7 +176,8 @@ class Directory(TreeNode):
                         self._add_child(Zombie(name, self))
                         return
                     try:
-                        leaf = Component(name, self, obj, dynamic=self.dynamic)
+                        leaf = self._get_shared_child(Component, name, obj,
+                                dynamic=self.dynamic)
                     except CORBA.OBJECT_NOT_EXIST:
                         # Component zombie
                         leaf = Zombie(name, self, dynamic=self.dynamic)
@@ -0,0 +1,382 @@
+# -*- Python -*-
+# -*- coding: utf-8 -*-
+
+'''rtctree
+
+Copyright (C) 2009-2015
+    Geoffrey Biggs
+    RT-Synthesis Research Group
+    Intelligent Systems Research Institute,
+    National Institute of Advanced Industrial Science and Technology (AIST),
+    Japan
+    All rights reserved.
+Licensed under the GNU Lesser General Public License version 3.
+http://www.gnu.org/licenses/lgpl-3.0.en.html
+
+Tree-wide change feed.
+
+The changes to all the nodes in a tree are published as ChangeRecord objects
+to any number of subscribers. Each subscriber has its own bounded queue,
+which it reads by iterating over the subscription, with a plain or an async
+for loop, or by calling get(). What happens when a subscriber's queue is full
+is chosen per subscriber.
+
+'''
+
+
+import collections
+import threading
+import time
+
+from rtctree import wait
+
+
+# Record kinds
+ADDED = 'added'
+REMOVED = 'removed'
+STATE = 'state'
+MERGED_STATE = 'merged_state'
+PORT = 'port'
+CONFIG = 'config'
+CONFIG_ERROR = 'config_error'
+EC = 'ec'
+HEARTBEAT = 'heartbeat'
+PROFILE = 'profile'
+FSM = 'fsm'
+OBSERVER = 'observer'
+
+# What to do when a subscriber's queue is full
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+BLOCK = 'block'
+
+
+# Node events and the kinds of record they are published as
+_KINDS = {'node_added': ADDED,
+          'node_removed': REMOVED,
+          'rtc_status': STATE,
+          'state_changed': MERGED_STATE,
+          'port_event': PORT,
+          'config_event': CONFIG,
+          'config_error': CONFIG_ERROR,
+          'ec_event': EC,
+          'heartbeat': HEARTBEAT,
+          'component_profile': PROFILE,
+          'fsm_event': FSM}
+
+
+##############################################################################
+## Change record object
+
+class ChangeRecord(object):
+    '''A change to a node in a tree.
+
+    @ref kind is one of the record kinds defined in this module, such as
+    ADDED or STATE. @ref path is the full path of the node, as a list. The
+    @ref value depends on the kind: for ADDED and REMOVED it is the path of
+    the node the node was added to or removed from; for the other kinds it is
+    the value passed to the node's callbacks for the event (see
+    @ref TreeNode.add_callback). OBSERVER records are only made when
+    replaying a recording into an event bus (see rtctree.recorder); their
+    node is None.
+
+    '''
+    __slots__ = ['kind', 'path', 'node', 'value', 'time']
+
+    def __init__(self, kind, path, node, value, time):
+        self.kind = kind
+        self.path = path
+        self.node = node
+        self.value = value
+        self.time = time
+
+    def __repr__(self):
+        return 'ChangeRecord({0!r}, {1!r}, {2!r})'.format(self.kind,
+                '/'.join(self.path)[1:] or '/', self.value)
+
+
+##############################################################################
+## Event bus object
+
+class EventBus(object):
+    '''Publishes the changes in a tree to its subscribers.'''
+    def __init__(self, *args, **kwargs):
+        super(EventBus, self).__init__(*args, **kwargs)
+        self._mutex = threading.Lock()
+        self._subscriptions = []
+
+    def publish(self, event, node, value):
+        '''Publish a node event to the subscribers interested in it.'''
+        with self._mutex:
+            subs = list(self._subscriptions)
+        if not subs:
+            return
+        kind = _KINDS.get(event, event)
+        if kind in (ADDED, REMOVED):
+            # A shared node's path is the one it was added or removed at
+            value = _path(value)
+            path = value + [node._name]
+        else:
+            path = _path(node)
+        record = ChangeRecord(kind, path, node, value, time.time())
+        for s in subs:
+            s._offer(record)
+
+    def publish_record(self, record):
+        '''Publish a change record to the subscribers interested in it.
+
+        This is used to replay recorded events (see rtctree.recorder).
+
+        '''
+        with self._mutex:
+            subs = list(self._subscriptions)
+        for s in subs:
+            s._offer(record)
+
+    def subscribe(self, kinds=None, path=None, maxsize=1000,
+            policy=DROP_OLDEST):
+        '''Subscribe to the changes in the tree.
+
+        @param kinds A list of the record kinds to receive, or None for all.
+        @param path A path; only changes to this node and the nodes below it
+                    are received. None for the whole tree.
+        @param maxsize The most records to queue for the subscriber.
+        @param policy What to do with a new record when the queue is full:
+                      DROP_OLDEST discards the oldest queued record,
+                      DROP_NEWEST discards the new record, and BLOCK makes
+                      the publisher wait for space. Records are published
+                      from the ORB's threads for dynamic trees, so BLOCK
+                      delays all other events while the subscriber is
+                      behind.
+        @return A Subscription object.
+
+        '''
+        sub = Subscription(self, kinds, path, maxsize, policy)
+        with self._mutex:
+            self._subscriptions.append(sub)
+        return sub
+
+    def _unsubscribe(self, sub):
+        with self._mutex:
+            if sub in self._subscriptions:
+                self._subscriptions.remove(sub)
+
+
+class Subscription(object):
+    '''A subscriber's queue of change records.
+
+    Iterating over a subscription (with for or async for) gives its records
+    as they arrive, until the subscription is closed.
+
+    Do not create Subscription objects directly. Call
+    @ref RTCTree.subscribe.
+
+    Example:
+    >>> from rtctree.node import TreeNode
+    >>> comp = TreeNode('c0.rtc', TreeNode('/'))
+    >>> bus = EventBus()
+    >>> sub = bus.subscribe(kinds=[STATE], maxsize=2)
+    >>> for status in ['ACTIVE', 'INACTIVE', 'ERROR']:
+    ...     bus.publish('rtc_status', comp, status)
+    >>> bus.publish('config_event', comp, 'default')
+    >>> sub.dropped, sub.pending
+    (1, 2)
+    >>> sub.get(0)
+    ChangeRecord('state', '/c0.rtc', 'INACTIVE')
+    >>> sub.get(0).value, sub.get(0)
+    ('ERROR', None)
+    >>> sub.close()
+    >>> bus.publish('rtc_status', comp, 'ACTIVE')
+    >>> sub.pending, list(sub)
+    (0, [])
+
+    A cancelled wait in an async for loop does not take a record:
+    >>> import asyncio
+    >>> loop = asyncio.new_event_loop()
+    >>> asyncio.set_event_loop(loop)
+    >>> sub = bus.subscribe()
+    >>> try:
+    ...     loop.run_until_complete(asyncio.wait_for(sub.__anext__(), 0.1))
+    ... except asyncio.TimeoutError:
+    ...     print('timed out')
+    timed out
+    >>> bus.publish('rtc_status', comp, 'ACTIVE')
+    >>> sub.pending
+    1
+    >>> loop.run_until_complete(sub.__anext__()).value
+    'ACTIVE'
+    >>> sub.close()
+    >>> try:
+    ...     loop.run_until_complete(sub.__anext__())
+    ... except StopAsyncIteration:
+    ...     print('closed')
+    closed
+    >>> loop.close()
+    >>> asyncio.set_event_loop(None)
+    '''
+    def __init__(self, bus, kinds, path, maxsize, policy, *args, **kwargs):
+        super(Subscription, self).__init__(*args, **kwargs)
+        if policy not in (DROP_OLDEST, DROP_NEWEST, BLOCK):
+            raise ValueError(policy)
+        self._bus = bus
+        self._kinds = None if kinds is None else set(kinds)
+        self._path = path
+        self._maxsize = maxsize
+        self._policy = policy
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._dropped = 0
+        # The futures of async for loops waiting for a record
+        self._waiters = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        record = self.get()
+        if record is None:
+            raise StopIteration
+        return record
+
+    next = __next__
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        # The future is completed in the event loop's thread, so a record is
+        # never taken for a wait that has been cancelled.
+        import asyncio
+        loop = asyncio.get_event_loop()
+        fut = loop.create_future()
+        self._poll_async(loop, fut)
+        return fut
+
+    def close(self):
+        '''Stop receiving records. Queued records can still be read.'''
+        self._bus._unsubscribe(self)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._wake_async()
+
+    def get(self, timeout=None):
+        '''Get the next record, waiting for one if the queue is empty.
+
+        @param timeout The longest time to wait, in seconds, or None to wait
+                       until a record arrives or the subscription is closed.
+        @return The record, or None if the wait timed out or the subscription
+                is closed and its queue is empty.
+
+        '''
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while not self._queue:
+                if self._closed:
+                    return None
+                remaining = wait.time_left(deadline)
+                if remaining == 0:
+                    return None
+                self._cond.wait(remaining)
+            record = self._queue.popleft()
+            self._cond.notify_all()
+            return record
+
+    @property
+    def closed(self):
+        '''Has the subscription been closed?'''
+        with self._cond:
+            return self._closed
+
+    @property
+    def dropped(self):
+        '''The number of records discarded because the queue was full.'''
+        with self._cond:
+            return self._dropped
+
+    @property
+    def pending(self):
+        '''The number of records waiting to be read.'''
+        with self._cond:
+            return len(self._queue)
+
+    def _poll_async(self, loop, fut):
+        # Complete an async for loop's future with the next record, or wait
+        # for one to arrive. Runs in the event loop's thread.
+        if fut.done():
+            return
+        with self._cond:
+            if self._queue:
+                record = self._queue.popleft()
+                self._cond.notify_all()
+            elif self._closed:
+                record = None
+            else:
+                self._waiters = [w for w in self._waiters if not w[1].done()]
+                self._waiters.append((loop, fut))
+                return
+        if record is None:
+            fut.set_exception(StopAsyncIteration())
+        else:
+            fut.set_result(record)
+
+    def _offer(self, record):
+        # Add a record to the queue, if the subscriber wants it.
+        if self._kinds is not None and record.kind not in self._kinds:
+            return
+        if self._path is not None and \
+                record.path[:len(self._path)] != self._path:
+            return
+        with self._cond:
+            if self._closed:
+                return
+            if len(self._queue) >= self._maxsize:
+                if self._policy == DROP_NEWEST:
+                    self._dropped += 1
+                    return
+                elif self._policy == DROP_OLDEST:
+                    self._queue.popleft()
+                    self._dropped += 1
+                else:
+                    while len(self._queue) >= self._maxsize and \
+                            not self._closed:
+                        self._cond.wait()
+                    if self._closed:
+                        return
+            self._queue.append(record)
+            self._cond.notify_all()
+        self._wake_async()
+
+    def _wake_async(self):
+        # Make the waiting async for loops check the queue again.
+        with self._cond:
+            waiters, self._waiters = self._waiters, []
+        for loop, fut in waiters:
+            try:
+                loop.call_soon_threadsafe(self._poll_async, loop, fut)
+            except RuntimeError:
+                # The event loop has been closed
+                pass
+
+
+##############################################################################
+## Internal functions
+
+def _path(node):
+    # Get the full path of a node without taking the nodes' locks; records
+    # are published from the ORB's threads.
+    path = []
+    while node is not None:
+        path.insert(0, node._name)
+        node = node._parent
+    return path
+
+
+# vim: set expandtab tabstop=8 shiftwidth=4 softtabstop=4 textwidth=79
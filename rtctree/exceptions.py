@@ -293,5 +293,43 @@ class InvalidSdoServiceError(RtcTreeError):
         return 'Invalid SDO service: {0}'.format(self.args[0])
 
 
+class BadSnapshotError(RtcTreeError):
+    '''A snapshot file could not be read.'''
+    def __str__(self):
+        return 'Bad snapshot file {0}: {1}'.format(self.args[0], self.args[1])
+
+
+class NotIndexedError(RtcTreeError):
+    '''The requested field is not indexed.'''
+    def __str__(self):
+        return 'Field {0} is not indexed.'.format(self.args[0])
+
+
+class DaemonError(RtcTreeError):
+    '''The tree daemon could not handle a request.'''
+    def __str__(self):
+        return 'Tree daemon error: {0}'.format(self.args[0])
+
+
+class WaitTimeoutError(RtcTreeError):
+    '''A waited-for condition did not hold before the timeout.'''
+    def __str__(self):
+        return 'Condition not met within {0} seconds.'.format(self.args[0])
+
+
+class BadRecordingError(RtcTreeError):
+    '''An event recording could not be read.'''
+    def __str__(self):
+        return 'Bad event recording {0}: {1}'.format(self.args[0],
+                self.args[1])
+
+
+class BadConfigFileError(RtcTreeError):
+    '''A system configuration file could not be read.'''
+    def __str__(self):
+        return 'Bad configuration file {0}: {1}'.format(self.args[0],
+                self.args[1])
+
+
 
 # vim: set expandtab tabstop=8 shiftwidth=4 softtabstop=4 textwidth=79
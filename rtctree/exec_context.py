@@ -18,17 +18,33 @@ Object representing an execution context.
 '''
 
 
+import collections
 import threading
+import time
+import weakref
 
 from rtctree import utils
+from rtctree.options import Options
 from rtctree.rtc import RTC
 
 
+# Maximum value for CORBA object hashes
+_MAX_HASH = 0x7FFFFFFF
+
+
 ##############################################################################
 ## Execution context object
 
 class ExecutionContext(object):
-    '''An execution context, within which components may be executing.'''
+    '''An execution context, within which components may be executing.
+
+    The kind and owner of the context are fetched once. The rate and running
+    state are cached: while a component that has this context observes it
+    (i.e. a dynamic component), they are kept current by its EC events;
+    otherwise they are fetched again once they are older than the
+    'ec_cache_ttl' option (in seconds; 0, the default, disables caching).
+
+    '''
     def __init__(self, ec_obj=None, handle=None, *args, **kwargs):
         '''Constructor.
 
@@ -45,6 +61,9 @@ class ExecutionContext(object):
             self._is_service = False
             self._obj = ec_obj
         self._handle = handle
+        self._handles = weakref.WeakKeyDictionary()
+        self._observers = weakref.WeakKeyDictionary()
+        self._monitor = None
         self._mutex = threading.RLock()
         self._parse()
 
@@ -75,6 +94,19 @@ class ExecutionContext(object):
         with self._mutex:
             self._obj.reset_component(comp_ref)
 
+    def get_handle(self, comp):
+        '''Get the handle a component uses for this context.
+
+        Each component participating in a context has its own handle for it.
+
+        @param comp The Component node.
+        @return The component's handle, or @ref handle if the component has
+                not registered a handle.
+
+        '''
+        with self._mutex:
+            return self._handles.get(comp, self._handle)
+
     def get_component_state(self, comp):
         '''Get the state of a component within this context.
 
@@ -92,13 +124,13 @@ class ExecutionContext(object):
         @return A string describing the kind of execution context this is.
 
         '''
-        with self._mutex:
-            if self.kind == self.PERIODIC:
-                result = 'Periodic', ['reset']
-            elif self.kind == self.EVENT_DRIVEN:
-                result = 'Event-driven', ['reset']
-            elif self.kind == self.OTHER:
-                result = 'Other', ['reset']
+        kind = self.kind
+        if kind == self.PERIODIC:
+            result = 'Periodic', ['reset']
+        elif kind == self.EVENT_DRIVEN:
+            result = 'Event-driven', ['reset']
+        else:
+            result = 'Other', ['reset']
         if add_colour:
             return utils.build_attr_string(result[1], supported=add_colour) + \
                     result[0] + utils.build_attr_string('reset', supported=add_colour)
@@ -121,11 +153,10 @@ class ExecutionContext(object):
         @return A string describing this context's running state.
 
         '''
-        with self._mutex:
-            if self.running:
-                result = 'Running', ['bold', 'green']
-            else:
-                result = 'Stopped', ['reset']
+        if self.running:
+            result = 'Running', ['bold', 'green']
+        else:
+            result = 'Stopped', ['reset']
         if add_colour:
             return utils.build_attr_string(result[1], supported=add_colour) + \
                     result[0] + utils.build_attr_string('reset', supported=add_colour)
@@ -136,15 +167,22 @@ class ExecutionContext(object):
         '''Start the context.'''
         with self._mutex:
             self._obj.start()
+            self._running_time = None
 
     def stop(self):
         '''Stop the context.'''
         with self._mutex:
             self._obj.stop()
+            self._running_time = None
 
     @property
     def handle(self):
-        '''The handle of this execution context.'''
+        '''The handle of this execution context.
+
+        This is the handle given when the object was created. Use
+        @ref get_handle to get the handle of a particular component.
+
+        '''
         with self._mutex:
             return self._handle
 
@@ -152,44 +190,66 @@ class ExecutionContext(object):
     def kind(self):
         '''The kind of this execution context.'''
         with self._mutex:
-            kind = self._obj.get_kind()
-            if kind == RTC.PERIODIC:
-                return self.PERIODIC
-            elif kind == RTC.EVENT_DRIVEN:
-                return self.EVENT_DRIVEN
-            else:
-                return self.OTHER
+            if self._kind is None:
+                kind = self._obj.get_kind()
+                if kind == RTC.PERIODIC:
+                    self._kind = self.PERIODIC
+                elif kind == RTC.EVENT_DRIVEN:
+                    self._kind = self.EVENT_DRIVEN
+                else:
+                    self._kind = self.OTHER
+            return self._kind
 
     @property
     def kind_string(self):
         '''The kind of this execution context as a coloured string.'''
         return self.kind_as_string()
 
+    @property
+    def monitor(self):
+        '''The @ref TimingMonitor recording this context's heartbeats.
+
+        Heartbeats are only received while a dynamic component observes this
+        context.
+
+        '''
+        with self._mutex:
+            if self._monitor is None:
+                self._monitor = TimingMonitor()
+            return self._monitor
+
     @property
     def owner(self):
         '''The RTObject that owns this context.'''
         with self._mutex:
+            self._parse_profile()
             return self._owner
 
     @property
     def owner_name(self):
         '''The name of the RTObject that owns this context.'''
         with self._mutex:
-            if self._owner:
-                return self._owner.get_component_profile().instance_name
-            else:
-                return ''
+            if self._owner_name is None:
+                self._parse_profile()
+                if self._owner:
+                    self._owner_name = \
+                            self._owner.get_component_profile().instance_name
+                else:
+                    self._owner_name = ''
+            return self._owner_name
 
     @property
     def participants(self):
         '''The list of RTObjects participating in this context.'''
         with self._mutex:
+            self._parse_profile()
             return self._participants
 
     @property
     def participant_names(self):
         '''The names of the RTObjects participating in this context.'''
         with self._mutex:
+            self._parse_profile()
             return [obj.get_component_profile().instance_name \
                     for obj in self._participants]
 
@@ -197,24 +257,30 @@ class ExecutionContext(object):
     def properties(self):
         '''The execution context's extra properties dictionary.'''
         with self._mutex:
+            self._parse_profile()
             return self._properties
 
     @property
     def rate(self):
         '''The execution rate of this execution context.'''
         with self._mutex:
-            return self._obj.get_rate()
+            if not self._is_fresh(self._rate_time):
+                self._set_rate(self._obj.get_rate())
+            return self._rate
 
     @rate.setter
     def rate(self, new_rate):
         with self._mutex:
             self._obj.set_rate(new_rate)
+            self._rate_time = None
 
     @property
     def running(self):
         '''Is this execution context running?'''
         with self._mutex:
-            return self._obj.is_running()
+            if not self._is_fresh(self._running_time):
+                self._set_running(self._obj.is_running())
+            return self._running
 
     @property
     def running_string(self):
@@ -222,8 +288,32 @@ class ExecutionContext(object):
         return self.running_as_string()
 
     def _parse(self):
-        # Parse the ExecutionContext object.
+        # Parse the ExecutionContext object. The profile is delay-parsed when
+        # it is first accessed.
+        with self._mutex:
+            self._profile_parsed = False
+            self._kind = None
+            self._owner_name = None
+            self._rate = None
+            self._rate_time = None
+            self._running = None
+            self._running_time = None
+
+    def _is_fresh(self, fetched_time):
+        # Check if a cached value fetched at a time can be used.
+        if fetched_time is None:
+            return False
+        if self._observers:
+            # Kept current by events
+            return True
+        ttl = Options().get_option('ec_cache_ttl')
+        return ttl > 0 and time.time() - fetched_time < ttl
+
+    def _parse_profile(self):
+        # Fetch the profile if it has not been fetched since the last parse.
         with self._mutex:
+            if self._profile_parsed:
+                return
             if self._is_service:
                 profile = self._obj.get_profile()
                 self._owner = profile.owner
@@ -233,6 +323,32 @@ class ExecutionContext(object):
                 self._owner = None
                 self._participants = []
                 self._properties = []
+            self._profile_parsed = True
+
+    def _set_handle(self, comp, handle):
+        # Record the handle a component uses for this context.
+        with self._mutex:
+            self._handles[comp] = handle
+
+    def _set_observed(self, comp, observed):
+        # Record whether a component is observing this context's events.
+        with self._mutex:
+            if observed:
+                self._observers[comp] = True
+            else:
+                self._observers.pop(comp, None)
+
+    def _set_rate(self, rate):
+        # Set the cached rate. A rate of None means it is no longer known.
+        with self._mutex:
+            self._rate = rate
+            self._rate_time = None if rate is None else time.time()
+
+    def _set_running(self, running):
+        # Set the cached running state.
+        with self._mutex:
+            self._running = running
+            self._running_time = time.time()
 
     ## Constant for a periodic execution context.
     PERIODIC = 1
@@ -242,4 +358,237 @@ class ExecutionContext(object):
     OTHER = 3
 
 
+##############################################################################
+## API functions
+
+def fetch_component_states(comps, max_workers=None):
+    '''Fetch the states of many components in all their execution contexts.
+
+    The execution contexts of the components are collected first, so that
+    each context shared by several components is visited once. The state of
+    every participant of every context is then requested concurrently, in
+    the same way as for a single component: a component that is not alive in
+    a context is in the CREATED state there. The results are stored in each
+    component's owned_ec_states and participating_ec_states.
+
+    @param comps The Component nodes.
+    @param max_workers The maximum number of remote calls to make at once.
+    @return The set of components whose states could not be fetched. Their
+            stored states are not changed.
+
+    '''
+    comps = utils.unique_nodes(comps)
+
+    def get_ecs(c):
+        return c.owned_ecs, c.participating_ecs
+    ec_lists = utils.parallel_map(get_ecs, comps, max_workers=max_workers,
+            return_exceptions=True)
+    failed = set()
+    # Group the (component, context) pairs by context
+    by_ec = {}
+    for c, lists in zip(comps, ec_lists):
+        if isinstance(lists, Exception):
+            failed.add(c)
+            continue
+        for ec in lists[0] + lists[1]:
+            by_ec.setdefault(id(ec), (ec, []))[1].append(c)
+    pairs = [(ec, c) for ec, members in by_ec.values() for c in members]
+
+    def get_state(pair):
+        ec, c = pair
+        return c._get_ec_state(ec)
+    results = utils.parallel_map(get_state, pairs, max_workers=max_workers,
+            return_exceptions=True)
+    states = {}
+    for (ec, c), r in zip(pairs, results):
+        if isinstance(r, Exception):
+            failed.add(c)
+        else:
+            states[(id(ec), id(c))] = r
+    # Fan the states back out to the components
+    for c, lists in zip(comps, ec_lists):
+        if c in failed:
+            continue
+        c._set_ec_states([states[(id(ec), id(c))] for ec in lists[0]],
+                [states[(id(ec), id(c))] for ec in lists[1]])
+    return failed
+
+
+##############################################################################
+## Timing monitor object
+
+class TimingMonitor(object):
+    '''Records the arrival times of an execution context's heartbeats and
+    state changes, and computes timing statistics from them.
+
+    The times are kept in a fixed-size ring buffer, so the statistics describe
+    the most recent part of the context's life.
+
+    Example:
+    >>> m = TimingMonitor(size=8, expected_period=1.0)
+    >>> for t in [0.0, 1.0, 2.1, 2.9, 5.0]:
+    ...     m.record_heartbeat(t)
+    >>> s = m.statistics()
+    >>> s['samples'], round(s['period'], 2), s['missed']
+    (4, 1.25, 1)
+    >>> round(s['max_period'], 2), round(s['jitter'][50], 2)
+    (2.1, 0.2)
+    '''
+    def __init__(self, size=None, expected_period=1.0, *args, **kwargs):
+        '''Constructor.
+
+        @param size The number of times to keep. If None, the
+                    'ec_monitor_size' option is used.
+        @param expected_period The expected time between heartbeats, in
+                               seconds. For EC heartbeats this is the
+                               observer's heartbeat interval.
+
+        '''
+        super(TimingMonitor, self).__init__(*args, **kwargs)
+        if size is None:
+            size = Options().get_option('ec_monitor_size')
+        self._mutex = threading.Lock()
+        self._heartbeats = collections.deque(maxlen=size)
+        self._state_changes = collections.deque(maxlen=size)
+        self.expected_period = expected_period
+
+    def clear(self):
+        '''Discard all recorded times.'''
+        with self._mutex:
+            self._heartbeats.clear()
+            self._state_changes.clear()
+
+    def record_heartbeat(self, t=None):
+        '''Record the arrival of a heartbeat at a time (default now).'''
+        with self._mutex:
+            self._heartbeats.append(time.time() if t is None else t)
+
+    def record_state_change(self, t=None):
+        '''Record the arrival of a state change at a time (default now).'''
+        with self._mutex:
+            self._state_changes.append(time.time() if t is None else t)
+
+    def statistics(self):
+        '''Compute timing statistics from the recorded heartbeats.
+
+        @return A dictionary containing:
+                - samples: The number of periods measured.
+                - period, min_period, max_period: The mean, smallest and
+                  largest time between heartbeats.
+                - jitter: A dictionary mapping the percentiles 50, 90 and 99
+                  to the deviation of the period from the expected period
+                  at that percentile.
+                - missed: The number of expected heartbeats that did not
+                  arrive.
+                - state_changes: The number of state changes recorded.
+                The period values are None if fewer than two heartbeats have
+                been recorded.
+
+        '''
+        with self._mutex:
+            beats = list(self._heartbeats)
+            num_changes = len(self._state_changes)
+        periods = [b - a for a, b in zip(beats, beats[1:])]
+        result = {'samples': len(periods), 'period': None,
+                'min_period': None, 'max_period': None,
+                'jitter': dict([(p, None) for p in (50, 90, 99)]),
+                'missed': 0, 'state_changes': num_changes}
+        if not periods:
+            return result
+        result['period'] = sum(periods) / len(periods)
+        result['min_period'] = min(periods)
+        result['max_period'] = max(periods)
+        deviations = sorted([abs(p - self.expected_period) for p in periods])
+        for pc in result['jitter']:
+            ii = int(pc * (len(deviations) - 1) / 100.0 + 0.5)
+            result['jitter'][pc] = deviations[ii]
+        if self.expected_period > 0:
+            result['missed'] = sum([max(0,
+                int(round(p / self.expected_period)) - 1) for p in periods])
+        return result
+
+    @property
+    def heartbeats(self):
+        '''The recorded heartbeat times, oldest first.'''
+        with self._mutex:
+            return list(self._heartbeats)
+
+    @property
+    def state_changes(self):
+        '''The recorded state change times, oldest first.'''
+        with self._mutex:
+            return list(self._state_changes)
+
+
+##############################################################################
+## Execution context registry object
+
+class ExecutionContextRegistry(object):
+    '''Shares one ExecutionContext object between all the components using
+    the same execution context.
+
+    Execution contexts are compared using their object references, which does
+    not require contacting them. The registry does not keep the
+    ExecutionContext objects alive; an object is dropped once no component
+    holds it.
+
+    '''
+    def __init__(self, *args, **kwargs):
+        super(ExecutionContextRegistry, self).__init__(*args, **kwargs)
+        self._mutex = threading.Lock()
+        # Object hash -> list of weak references to ExecutionContext objects
+        self._ecs = {}
+
+    def __len__(self):
+        with self._mutex:
+            return len([r for refs in self._ecs.values() for r in refs \
+                    if r() is not None])
+
+    @property
+    def contexts(self):
+        '''The ExecutionContext objects currently held by components.'''
+        with self._mutex:
+            return [ec for ec in [r() for refs in self._ecs.values() \
+                    for r in refs] if ec is not None]
+
+    def get(self, ec_obj, comp, handle):
+        '''Get the ExecutionContext object for an execution context.
+
+        The object is created if no component holds one for the context yet.
+
+        @param ec_obj The CORBA ExecutionContext object.
+        @param comp The Component node using the context.
+        @param handle The component's handle for the context.
+        @return The shared ExecutionContext object.
+
+        '''
+        with self._mutex:
+            ec = self._find(ec_obj)
+        if ec is None:
+            # Creating the object contacts the context, so do it outside the
+            # lock and check again afterwards
+            new_ec = ExecutionContext(ec_obj, handle)
+            with self._mutex:
+                ec = self._find(ec_obj)
+                if ec is None:
+                    ec = new_ec
+                    self._ecs.setdefault(ec_obj._hash(_MAX_HASH), []).append(
+                            weakref.ref(ec))
+        ec._set_handle(comp, handle)
+        return ec
+
+    def _find(self, ec_obj):
+        key = ec_obj._hash(_MAX_HASH)
+        refs = [r for r in self._ecs.get(key, []) if r() is not None]
+        if refs:
+            self._ecs[key] = refs
+        else:
+            self._ecs.pop(key, None)
+        for r in refs:
+            ec = r()
+            if ec is not None and ec._obj._is_equivalent(ec_obj):
+                return ec
+        return None
+
+
 # vim: set expandtab tabstop=8 shiftwidth=4 softtabstop=4 textwidth=79
@@ -0,0 +1,145 @@
+# -*- Python -*-
+# -*- coding: utf-8 -*-
+
+'''rtctree
+
+Copyright (C) 2009-2015
+    Geoffrey Biggs
+    RT-Synthesis Research Group
+    Intelligent Systems Research Institute,
+    National Institute of Advanced Industrial Science and Technology (AIST),
+    Japan
+    All rights reserved.
+Licensed under the GNU Lesser General Public License version 3.
+http://www.gnu.org/licenses/lgpl-3.0.en.html
+
+Identity map from remote objects to the nodes representing them.
+
+The same remote object can be reached through more than one part of a tree;
+for example, a component created by a manager is a child of the manager's node
+and is usually also bound in a naming context. The identity map lets the tree
+use a single node for such objects. The node's parent is the node that created
+it; the other nodes holding it have it as a child only.
+
+'''
+
+
+import threading
+
+
+# Maximum value for CORBA object hashes
+_MAX_HASH = 0x7FFFFFFF
+
+
+##############################################################################
+## Identity map object
+
+class IdentityMap(object):
+    '''Maps remote objects to nodes, and tracks the nodes holding each node.
+
+    Objects are compared using their object references (_hash and
+    _is_equivalent), which does not require contacting the remote objects.
+
+    '''
+    def __init__(self, *args, **kwargs):
+        super(IdentityMap, self).__init__(*args, **kwargs)
+        self._mutex = threading.RLock()
+        # Object hash -> list of entries
+        self._buckets = {}
+        # Node -> entry
+        self._nodes = {}
+
+    def __len__(self):
+        with self._mutex:
+            return len(self._nodes)
+
+    def holders(self, node):
+        '''Get the nodes that hold a node as a child.
+
+        @return A list of nodes, or an empty list if the node is not in the
+                map.
+
+        '''
+        with self._mutex:
+            entry = self._nodes.get(node)
+            if entry is None:
+                return []
+            return list(entry.holders)
+
+    def lookup(self, obj):
+        '''Get the node for a remote object.
+
+        @return The node, or None if no node is known for the object.
+
+        '''
+        with self._mutex:
+            entry = self._find(obj)
+            if entry is None:
+                return None
+            return entry.node
+
+    def register(self, obj, node, holder):
+        '''Register a node for a remote object and the node that holds it.
+
+        If a node with the same name is already registered for the object,
+        the holder is added to that node instead. If a node with a different
+        name is registered, the new node cannot be shared, and is not
+        registered.
+
+        @param obj The remote object.
+        @param node The node representing the object.
+        @param holder The node that holds @ref node as a child.
+        @return The node that should be used for the object.
+
+        '''
+        with self._mutex:
+            entry = self._find(obj)
+            if entry is None:
+                entry = _Entry(obj, node)
+                self._buckets.setdefault(obj._hash(_MAX_HASH), []).append(
+                        entry)
+                self._nodes[node] = entry
+            elif entry.node.name != node.name:
+                return node
+            if holder not in entry.holders:
+                entry.holders.append(holder)
+            return entry.node
+
+    def release(self, node, holder):
+        '''Record that a node is no longer held by a holder.
+
+        The node is removed from the map when it is no longer held by any
+        node.
+
+        @return The list of nodes still holding the node.
+
+        '''
+        with self._mutex:
+            entry = self._nodes.get(node)
+            if entry is None:
+                return []
+            if holder in entry.holders:
+                entry.holders.remove(holder)
+            if not entry.holders:
+                del self._nodes[node]
+                bucket = self._buckets[entry.obj._hash(_MAX_HASH)]
+                bucket.remove(entry)
+                if not bucket:
+                    del self._buckets[entry.obj._hash(_MAX_HASH)]
+            return list(entry.holders)
+
+    def _find(self, obj):
+        for entry in self._buckets.get(obj._hash(_MAX_HASH), []):
+            if entry.obj._is_equivalent(obj):
+                return entry
+        return None
+
+
+class _Entry(object):
+    def __init__(self, obj, node):
+        self.obj = obj
+        self.node = node
+        self.holders = []
+
+
+# vim: set expandtab tabstop=8 shiftwidth=4 softtabstop=4 textwidth=79
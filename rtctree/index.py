@@ -0,0 +1,262 @@
+# -*- Python -*-
+# -*- coding: utf-8 -*-
+
+'''rtctree
+
+Copyright (C) 2009-2015
+    Geoffrey Biggs
+    RT-Synthesis Research Group
+    Intelligent Systems Research Institute,
+    National Institute of Advanced Industrial Science and Technology (AIST),
+    Japan
+    All rights reserved.
+Licensed under the GNU Lesser General Public License version 3.
+http://www.gnu.org/licenses/lgpl-3.0.en.html
+
+Secondary indexes over the profile fields of the components in a tree.
+
+'''
+
+
+import threading
+
+from rtctree import exceptions
+
+
+##############################################################################
+## Component index object
+
+class ComponentIndex(object):
+    '''Multi-maps from component profile field values to component nodes.
+
+    An index is kept for each field in @ref fields. A field is either the name
+    of one of the component profile properties (instance_name, type_name,
+    description, version, vendor, category, parent_object) or the name of an
+    entry in the component's properties dictionary, prefixed with
+    'properties.' (e.g. 'properties.naming.type').
+
+    All components added to the index are tracked, whether or not any fields
+    are indexed, so queries on unindexed fields only need to scan the
+    components rather than the entire tree.
+
+    The index does not access the components' remote objects. It only reads
+    the profile information already stored in each node.
+
+    Example:
+    >>> class C(object):
+    ...     def __init__(self, name, type_name, category):
+    ...         self.instance_name = name
+    ...         self.type_name = type_name
+    ...         self.category = category
+    ...         self.properties = {'exec_cxt.periodic.rate': '1000'}
+    ...         self.full_path_str = '/localhost/' + name + '.rtc'
+    >>> c1 = C('C10', 'C1', 'DataProducer')
+    >>> c2 = C('C20', 'C2', 'DataConsumer')
+    >>> c3 = C('C11', 'C1', 'DataProducer')
+    >>> i = ComponentIndex(['type_name', 'category'])
+    >>> for c in [c1, c2, c3]:
+    ...     i.add(c)
+    >>> [c.instance_name for c in i.lookup('type_name', 'C1')]
+    ['C10', 'C11']
+    >>> [c.instance_name for c in i.query({'category': 'DataProducer',
+    ...     'instance_name': 'C11'})]
+    ['C11']
+    >>> [c.instance_name for c in i.query({'type_name': ['C1', 'C2'],
+    ...     'properties.exec_cxt.periodic.rate': '1000'})]
+    ['C10', 'C11', 'C20']
+    >>> i.remove(c1)
+    >>> [c.instance_name for c in i.lookup('category', 'DataProducer')]
+    ['C11']
+    '''
+    def __init__(self, fields=[], *args, **kwargs):
+        '''Constructor.
+
+        @param fields The profile fields to index.
+
+        '''
+        super(ComponentIndex, self).__init__(*args, **kwargs)
+        self._mutex = threading.RLock()
+        self._indexes = {}
+        self._nodes = {}
+        for f in fields:
+            self.add_field(f)
+
+    def add(self, node):
+        '''Add a component node to the index.
+
+        If the node is already in the index, its entries are updated.
+
+        '''
+        with self._mutex:
+            if node in self._nodes:
+                self._remove_entries(node)
+            self._nodes[node] = {}
+            for field in self._indexes:
+                self._add_entry(node, field)
+
+    def add_field(self, field):
+        '''Start indexing a profile field.
+
+        All components already in the index will be indexed on the new field.
+
+        '''
+        with self._mutex:
+            if field in self._indexes:
+                return
+            self._indexes[field] = {}
+            for node in self._nodes:
+                self._add_entry(node, field)
+
+    def lookup(self, field, value):
+        '''Get the components with the given value in a field.
+
+        @param field The field to look in.
+        @param value The value to look for.
+        @return A list of component nodes, sorted by path.
+        @raises NotIndexedError
+
+        '''
+        with self._mutex:
+            if field not in self._indexes:
+                raise exceptions.NotIndexedError(field)
+            return _sorted_nodes(self._indexes[field].get(value, []))
+
+    def query(self, criteria):
+        '''Find the components matching all the given criteria.
+
+        @param criteria A dictionary mapping fields to values. A component
+                        matches if its value for every field matches. A value
+                        may also be a list or tuple of values, in which case
+                        any of those values matches. Indexed fields are looked
+                        up first; any remaining fields are checked on the
+                        components found by those lookups.
+        @return A list of component nodes, sorted by path.
+
+        '''
+        with self._mutex:
+            candidates = None
+            remaining = {}
+            # Intersect the smallest index results first
+            lookups = []
+            for field, values in criteria.items():
+                if type(values) not in (list, tuple):
+                    values = [values]
+                if field in self._indexes:
+                    found = set()
+                    for v in values:
+                        found.update(self._indexes[field].get(v, []))
+                    lookups.append(found)
+                else:
+                    remaining[field] = values
+            for found in sorted(lookups, key=len):
+                if candidates is None:
+                    candidates = found
+                else:
+                    candidates = candidates & found
+                if not candidates:
+                    return []
+            if candidates is None:
+                candidates = self._nodes.keys()
+            result = [n for n in candidates if matches(n, remaining)]
+        return _sorted_nodes(result)
+
+    def remove(self, node):
+        '''Remove a component node from the index.'''
+        with self._mutex:
+            if node not in self._nodes:
+                return
+            self._remove_entries(node)
+            del self._nodes[node]
+
+    def remove_field(self, field):
+        '''Stop indexing a profile field.'''
+        with self._mutex:
+            if field not in self._indexes:
+                raise exceptions.NotIndexedError(field)
+            del self._indexes[field]
+            for keys in self._nodes.values():
+                keys.pop(field, None)
+
+    def update(self, node):
+        '''Update the index entries of a node after its profile changes.'''
+        self.add(node)
+
+    @property
+    def fields(self):
+        '''The list of fields that are indexed.'''
+        with self._mutex:
+            return list(self._indexes.keys())
+
+    @property
+    def nodes(self):
+        '''The list of component nodes in the index.'''
+        with self._mutex:
+            return _sorted_nodes(self._nodes.keys())
+
+    def _add_entry(self, node, field):
+        # Add a node to the index for a field, remembering the key it was
+        # stored under so it can be removed after the profile changes.
+        try:
+            value = get_field(node, field)
+            entries = self._indexes[field].setdefault(value, set())
+        except (KeyError, TypeError):
+            # Missing or unhashable values cannot be indexed
+            return
+        entries.add(node)
+        self._nodes[node][field] = value
+
+    def _remove_entries(self, node):
+        # Remove a node from all field indexes.
+        for field, value in self._nodes[node].items():
+            entries = self._indexes[field].get(value)
+            if entries is None:
+                continue
+            entries.discard(node)
+            if not entries:
+                del self._indexes[field][value]
+        self._nodes[node] = {}
+
+
+def get_field(node, field):
+    '''Get the value of a profile field from a component node.
+
+    @param node The component node.
+    @param field The field name. Entries in the component's properties
+                 dictionary are specified by prefixing the key with
+                 'properties.'.
+    @raises KeyError if the field does not exist.
+
+    '''
+    if field.startswith('properties.'):
+        return node.properties[field[len('properties.'):]]
+    try:
+        return getattr(node, field)
+    except AttributeError:
+        raise KeyError(field)
+
+
+def matches(node, criteria):
+    '''Check if a component node matches a set of criteria.
+
+    @param node The component node.
+    @param criteria A dictionary mapping fields to values, as for
+                    @ref ComponentIndex.query.
+    @return True if the node's value for every field matches.
+
+    '''
+    for field, values in criteria.items():
+        if type(values) not in (list, tuple):
+            values = [values]
+        try:
+            if get_field(node, field) not in values:
+                return False
+        except KeyError:
+            return False
+    return True
+
+
+def _sorted_nodes(nodes):
+    return sorted(nodes, key=lambda n: n.full_path_str)
+
+
+# vim: set expandtab tabstop=8 shiftwidth=4 softtabstop=4 textwidth=79
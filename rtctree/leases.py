@@ -0,0 +1,411 @@
+# -*- Python -*-
+# -*- coding: utf-8 -*-
+
+'''rtctree
+
+Copyright (C) 2009-2015
+    Geoffrey Biggs
+    RT-Synthesis Research Group
+    Intelligent Systems Research Institute,
+    National Institute of Advanced Industrial Science and Technology (AIST),
+    Japan
+    All rights reserved.
+Licensed under the GNU Lesser General Public License version 3.
+http://www.gnu.org/licenses/lgpl-3.0.en.html
+
+Leases on the observers and loggers that trees register with components.
+
+A tree that registers observers or loggers records each one, with the tree's
+session ID, in a lease file in a shared directory. The tree removes its
+observers and loggers and deletes its lease file when it is released. If the
+process using the tree exits without releasing it, the lease file remains,
+and the components keep sending notifications to the dead process. The
+reclaim functions, also available by running 'python -m rtctree.leases',
+find such stale leases and remove their service profiles from the
+components.
+
+The lease directory is given by the RTCTREE_LEASE_DIR environment variable,
+or is a directory in the system's temporary directory.
+
+'''
+
+
+from __future__ import print_function
+
+import binascii
+import glob
+import json
+import optparse
+import os
+import os.path
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+from omniORB import CORBA
+
+from rtctree import utils
+from rtctree import LEASE_DIR_ENV_VAR, ORB_ARGS_ENV_VAR
+from rtctree.rtc import RTC
+
+
+# File name extension of lease files
+LEASE_EXT = '.lease'
+# The interval at which a tree's lease file is touched while the tree is
+# alive, in seconds
+LEASE_REFRESH = 60.0
+
+
+##############################################################################
+## API functions
+
+def default_lease_dir():
+    '''Get the directory lease files are kept in.'''
+    if LEASE_DIR_ENV_VAR in os.environ:
+        return os.environ[LEASE_DIR_ENV_VAR]
+    return os.path.join(tempfile.gettempdir(), 'rtctree-leases')
+
+
+def find_stale(directory=None, max_age=None):
+    '''Find the lease files of trees that were not released.
+
+    A lease is stale if it was made on this host by a process that is no
+    longer running. Leases made on other hosts cannot be checked this way;
+    they are treated as stale if @ref max_age is given and the lease file
+    has not been modified for that long. Lease files are touched every
+    LEASE_REFRESH seconds while their trees are alive, so @ref max_age
+    should be several times that.
+
+    @param directory The lease directory. If None, @ref default_lease_dir
+                     is used.
+    @param max_age The age in seconds after which a lease from another host
+                   is stale, or None to never treat such leases as stale.
+    @return A list of the paths of the stale lease files.
+
+    Example:
+    >>> import json, subprocess, tempfile
+    >>> d = tempfile.mkdtemp()
+    >>> class FakeORB(object):
+    ...     def object_to_string(self, obj):
+    ...         return 'IOR:' + obj
+    >>> log = LeaseLog('live', directory=d, orb=FakeORB())
+    >>> log.add('c1', b'id', 'observer')
+    >>> read_lease(log.path)[1]
+    {('IOR:c1', '6964'): 'observer'}
+    >>> find_stale(d)
+    []
+    >>> p = subprocess.Popen([sys.executable, '-c', ''])
+    >>> p.wait()
+    0
+    >>> def write(name, host, pid):
+    ...     with open(os.path.join(d, name + LEASE_EXT), 'w') as f:
+    ...         f.write(json.dumps({'session': name, 'host': host,
+    ...             'pid': pid, 'created': 0}))
+    >>> write('dead', socket.gethostname(), p.pid)
+    >>> write('remote', 'elsewhere', 1)
+    >>> [os.path.basename(f) for f in find_stale(d)]
+    ['dead.lease']
+    >>> sorted([os.path.basename(f) for f in find_stale(d, max_age=-1)])
+    ['dead.lease', 'remote.lease']
+    >>> log.close()
+    >>> os.path.exists(log.path)
+    False
+    '''
+    if directory is None:
+        directory = default_lease_dir()
+    host = socket.gethostname()
+    result = []
+    for path in glob.glob(os.path.join(directory, '*' + LEASE_EXT)):
+        try:
+            header, services = read_lease(path)
+            age = time.time() - os.path.getmtime(path)
+        except (IOError, OSError, ValueError):
+            continue
+        if header.get('host') == host:
+            if not _pid_running(header.get('pid')):
+                result.append(path)
+        elif max_age is not None and age > max_age:
+            result.append(path)
+    return result
+
+
+def read_lease(path):
+    '''Read a lease file.
+
+    @param path The path of the lease file.
+    @return A tuple of the lease's header dictionary (containing the
+            session, host, pid and creation time) and a dictionary mapping
+            (object reference string, service ID) to the kind of service
+            ('observer' or 'logger') for each service still registered.
+    @raises ValueError if the file is not a lease file.
+
+    '''
+    services = {}
+    with open(path) as f:
+        header = json.loads(f.readline())
+        if 'session' not in header:
+            raise ValueError(path)
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                # A line cut short by the process dying
+                continue
+            key = (rec['ior'], rec['id'])
+            if rec['op'] == 'add':
+                services[key] = rec['kind']
+            else:
+                services.pop(key, None)
+    return header, services
+
+
+def reclaim(orb, paths, max_workers=None):
+    '''Remove the services recorded in lease files from their components.
+
+    The services are removed concurrently. A lease file is deleted once
+    all its services have been removed or their components no longer
+    exist.
+
+    @param orb The ORB to use to contact the components.
+    @param paths The paths of the lease files, such as returned by
+                 @ref find_stale.
+    @param max_workers The maximum number of remote calls to make at once.
+    @return A tuple of the number of services removed and the number that
+            could not be removed.
+
+    '''
+    items = []
+    for path in paths:
+        try:
+            header, services = read_lease(path)
+        except (IOError, OSError, ValueError):
+            continue
+        for (ior, service_id) in services:
+            items.append((path, ior, service_id))
+    results = utils.parallel_map(lambda i: _remove_service(orb, i), items,
+            max_workers=max_workers, return_exceptions=True)
+    failed_paths = set()
+    removed = 0
+    for (path, ior, service_id), r in zip(items, results):
+        if isinstance(r, Exception):
+            failed_paths.add(path)
+        else:
+            removed += 1
+    for path in paths:
+        if path not in failed_paths and os.path.exists(path):
+            os.remove(path)
+    return removed, len(items) - removed
+
+
+##############################################################################
+## Lease log object
+
+class LeaseLog(object):
+    '''The lease file of one tree.
+
+    Records are appended as services are added and removed, so recording a
+    service does not rewrite the file. The file is created when the first
+    service is recorded, and a background thread touches it every
+    LEASE_REFRESH seconds until it is deleted, so that other hosts can tell
+    the tree is alive.
+
+    '''
+    def __init__(self, session, directory=None, orb=None, *args, **kwargs):
+        '''Constructor.
+
+        @param session The tree's session ID.
+        @param directory The lease directory. If None,
+                         @ref default_lease_dir is used.
+        @param orb The ORB used to convert objects to reference strings.
+
+        '''
+        super(LeaseLog, self).__init__(*args, **kwargs)
+        if directory is None:
+            directory = default_lease_dir()
+        self._mutex = threading.Lock()
+        self._path = os.path.join(directory, session + LEASE_EXT)
+        self._session = session
+        self._orb = orb
+        self._file = None
+        self._count = 0
+        self._closed = None
+
+    def __len__(self):
+        with self._mutex:
+            return self._count
+
+    def add(self, obj, service_id, kind):
+        '''Record that a service was added to a component.
+
+        @param obj The component's object.
+        @param service_id The ID of the service profile.
+        @param kind 'observer' or 'logger'.
+
+        '''
+        self._write('add', obj, service_id, kind)
+
+    def close(self):
+        '''Delete the lease file.'''
+        with self._mutex:
+            if self._file is not None:
+                self._closed.set()
+                self._file.close()
+                self._file = None
+                if os.path.exists(self._path):
+                    os.remove(self._path)
+            self._count = 0
+
+    @property
+    def path(self):
+        '''The path of the lease file.'''
+        return self._path
+
+    def remove(self, obj, service_id):
+        '''Record that a service was removed from a component.'''
+        self._write('remove', obj, service_id, None)
+
+    def _open(self):
+        directory = os.path.dirname(self._path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Created by another process at the same time
+                pass
+        self._file = open(self._path, 'w')
+        self._file.write(json.dumps({'session': self._session,
+            'host': socket.gethostname(), 'pid': os.getpid(),
+            'created': time.time()}) + '\n')
+        self._closed = threading.Event()
+        t = threading.Thread(target=self._refresh_loop, args=(self._closed,))
+        t.daemon = True
+        t.start()
+
+    def _refresh_loop(self, closed):
+        # The thread that touches the lease file until it is closed.
+        while not closed.wait(LEASE_REFRESH):
+            with self._mutex:
+                if closed.is_set():
+                    return
+                try:
+                    os.utime(self._path, None)
+                except OSError as e:
+                    print('{0}: Cannot refresh lease file {1}: {2}'.format(
+                        sys.argv[0], self._path, e), file=sys.stderr)
+
+    def _write(self, op, obj, service_id, kind):
+        ior = self._orb.object_to_string(obj)
+        rec = json.dumps({'op': op, 'ior': ior, 'kind': kind,
+            'id': binascii.hexlify(service_id).decode('ascii')})
+        with self._mutex:
+            if self._file is None:
+                if op != 'add':
+                    return
+                try:
+                    self._open()
+                except (IOError, OSError) as e:
+                    print('{0}: Cannot write lease file {1}: {2}'.format(
+                        sys.argv[0], self._path, e), file=sys.stderr)
+                    return
+            self._file.write(rec + '\n')
+            self._file.flush()
+            self._count += 1 if op == 'add' else -1
+
+
+##############################################################################
+## Internal functions
+
+def _pid_running(pid):
+    # Check if a process is running on this host.
+    if not pid:
+        return False
+    if sys.platform == 'win32':
+        return _win32_pid_running(pid)
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        # EPERM means the process exists but belongs to another user
+        return e.errno == 1
+    return True
+
+
+def _win32_pid_running(pid):
+    # os.kill terminates the process on Windows, so ask for its exit code.
+    import ctypes
+    kernel32 = ctypes.windll.kernel32
+    PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+    ERROR_ACCESS_DENIED = 5
+    STILL_ACTIVE = 259
+    handle = kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False,
+            pid)
+    if not handle:
+        # Access is denied to processes of other users that exist
+        return kernel32.GetLastError() == ERROR_ACCESS_DENIED
+    try:
+        code = ctypes.c_ulong()
+        if not kernel32.GetExitCodeProcess(handle, ctypes.byref(code)):
+            return True
+        return code.value == STILL_ACTIVE
+    finally:
+        kernel32.CloseHandle(handle)
+
+
+def _remove_service(orb, item):
+    # Remove a service profile from a component. A component that no longer
+    # exists has no services to remove.
+    path, ior, service_id = item
+    obj = orb.string_to_object(ior)
+    try:
+        obj = obj._narrow(RTC.RTObject)
+        obj.get_configuration().remove_service_profile(
+                binascii.unhexlify(service_id))
+    except (CORBA.OBJECT_NOT_EXIST, CORBA.TRANSIENT):
+        pass
+
+
+def main(argv=None):
+    '''Find and reclaim stale leases from the command line.'''
+    if argv is None:
+        argv = sys.argv[1:]
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('-d', '--directory', dest='directory', default=None,
+            help='The lease directory. [Default: ${0} or a directory in '
+            'the temporary directory]'.format(LEASE_DIR_ENV_VAR))
+    parser.add_option('-a', '--max-age', dest='max_age', type='float',
+            default=None, help='Also reclaim leases from other hosts that '
+            'have not been refreshed for this many seconds; leases are '
+            'refreshed every {0:g} seconds. [Default: never]'.format(
+                LEASE_REFRESH))
+    parser.add_option('-n', '--dry-run', dest='dry_run',
+            action='store_true', default=False,
+            help='List the stale leases without reclaiming them.')
+    options, args = parser.parse_args(argv)
+    paths = find_stale(options.directory, options.max_age)
+    for p in paths:
+        header, services = read_lease(p)
+        print('{0}: session {1} (pid {2} on {3}), {4} services'.format(p,
+            header['session'], header['pid'], header['host'],
+            len(services)))
+    if options.dry_run or not paths:
+        return 0
+    if ORB_ARGS_ENV_VAR in os.environ:
+        orb_args = os.environ[ORB_ARGS_ENV_VAR].split(';')
+    else:
+        orb_args = []
+    orb = CORBA.ORB_init(orb_args)
+    try:
+        removed, failed = reclaim(orb, paths)
+    finally:
+        orb.destroy()
+    print('Removed {0} services; {1} could not be removed.'.format(removed,
+        failed))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+
+# vim: set expandtab tabstop=8 shiftwidth=4 softtabstop=4 textwidth=79
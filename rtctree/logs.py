@@ -0,0 +1,422 @@
+# -*- Python -*-
+# -*- coding: utf-8 -*-
+
+'''rtctree
+
+Copyright (C) 2009-2015
+    Geoffrey Biggs
+    RT-Synthesis Research Group
+    Intelligent Systems Research Institute,
+    National Institute of Advanced Industrial Science and Technology (AIST),
+    Japan
+    All rights reserved.
+Licensed under the GNU Lesser General Public License version 3.
+http://www.gnu.org/licenses/lgpl-3.0.en.html
+
+Collection of log records from many components.
+
+Components publish their log records from the ORB's threads. A LogCollector
+filters each record by level and source as it arrives and appends it to a
+bounded ring buffer, holding a lock only while it updates the buffer and the
+counters, so a busy component does not hold up the ORB. A delivery thread
+takes the records from the buffer in batches and writes each batch to the
+collector's sinks. If the records arrive faster than the sinks can take them,
+the oldest are overwritten and counted as dropped.
+
+'''
+
+
+from __future__ import print_function
+
+import collections
+import json
+import os
+import os.path
+import sys
+import threading
+import time
+
+from rtctree import utils
+
+
+# Log levels, from the most to the least important
+LEVELS = ['SILENT', 'ERROR', 'WARN', 'INFO', 'NORMAL', 'DEBUG', 'TRACE',
+        'VERBOSE', 'PARANOID']
+_LEVEL_NUMS = dict((l, i) for i, l in enumerate(LEVELS))
+
+
+##############################################################################
+## Log record object
+
+class LogRecord(object):
+    '''A log record received from a component.
+
+    @ref path is the full path of the component as a string, @ref time is a
+    floating-point time stamp, @ref source is the name of the logger in the
+    component that made the record, @ref level is one of @ref LEVELS and
+    @ref message is the text of the record.
+
+    '''
+    __slots__ = ['path', 'time', 'source', 'level', 'message']
+
+    def __init__(self, path, time, source, level, message):
+        self.path = path
+        self.time = time
+        self.source = source
+        self.level = level
+        self.message = message
+
+    def __repr__(self):
+        return 'LogRecord({0!r}, {1!r}, {2!r}, {3!r})'.format(self.path,
+                self.source, self.level, self.message)
+
+    def __str__(self):
+        return '{0} {1} {2} {3}: {4}'.format(time.strftime(
+            '%Y-%m-%d %H:%M:%S', time.localtime(self.time)), self.level,
+            self.path, self.source, self.message)
+
+    def to_dict(self):
+        '''Get the record as a dictionary, such as for JSON.'''
+        return {'path': self.path, 'time': self.time, 'source': self.source,
+                'level': self.level, 'message': self.message}
+
+
+##############################################################################
+## Log collector object
+
+class LogCollector(object):
+    '''Collects the log records of components and delivers them to sinks.
+
+    Example:
+    >>> got = []
+    >>> c = LogCollector([CallbackSink(got.extend)], size=2,
+    ...         flush_interval=60, level='INFO')
+    >>> rec = c._receiver('/localhost/c0.rtc')
+    >>> rec('c0', 0, 'main', 'INFO', 'one')
+    >>> rec('c0', 0, 'main', 'DEBUG', 'ignored')
+    >>> rec('c0', 0, 'main', 'ERROR', 'two')
+    >>> rec('c0', 0, 'main', 'WARN', 'three')
+    >>> c.close()
+    >>> [r.message for r in got]
+    ['two', 'three']
+    >>> c.received, c.filtered, c.dropped, c.delivered
+    (4, 1, 1, 2)
+    '''
+    def __init__(self, sinks=None, size=10000, batch_size=500,
+            flush_interval=0.5, level='PARANOID', sources=None, *args,
+            **kwargs):
+        '''Constructor.
+
+        @param sinks A list of sinks to deliver the records to. See
+                     @ref CallbackSink, @ref RotatingFileSink and
+                     @ref JSONLinesSink.
+        @param size The most records to hold in the ring buffer.
+        @param batch_size The most records to deliver to the sinks at once.
+                          The delivery thread is woken when this many records
+                          are waiting.
+        @param flush_interval The longest time a record waits in the buffer
+                              before it is delivered, in seconds.
+        @param level The least important level of record to collect.
+                     Components are also asked to only send records of this
+                     level or more important.
+        @param sources A list of the names of the loggers in the components
+                       to collect records from, or None for all loggers.
+
+        '''
+        super(LogCollector, self).__init__(*args, **kwargs)
+        if level not in _LEVEL_NUMS:
+            raise ValueError(level)
+        self._sinks = list(sinks or [])
+        self._size = size
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._level = level
+        self._max_level = _LEVEL_NUMS[level]
+        self._sources = None if sources is None else frozenset(sources)
+        # The buffer and the counters are protected by _buf_lock, which is
+        # only held briefly so the ORB's threads are not held up
+        self._buffer = collections.deque()
+        self._buf_lock = threading.Lock()
+        self._received = 0
+        self._filtered = 0
+        self._dropped = 0
+        self._delivered = 0
+        self._sink_errors = 0
+        self._loggers = {}
+        self._mutex = threading.Lock()
+        self._wake = threading.Event()
+        self._idle = threading.Condition()
+        self._busy = False
+        self._closed = False
+        self._thread = threading.Thread(target=self._deliver_loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def attach(self, comp, filters='ALL'):
+        '''Start collecting the log records of a component.
+
+        @param comp The component.
+        @param filters Filter the objects in the component from which to
+                       receive log records.
+        @raises AddLoggerError
+
+        '''
+        cb_id = comp.add_logger(self._receiver(comp.full_path_str),
+                level=self._level, filters=filters)
+        with self._mutex:
+            self._loggers[comp] = cb_id
+
+    def attach_all(self, comps, filters='ALL', max_workers=None):
+        '''Start collecting the log records of many components at once.
+
+        @param comps A list of components.
+        @param filters Filter the objects in the components from which to
+                       receive log records.
+        @param max_workers The maximum number of remote calls to make at once.
+        @return A list of None, for a component attached, or the exception
+                raised when attaching it, for each component.
+
+        '''
+        return utils.parallel_map(lambda c: self.attach(c, filters), comps,
+                max_workers=max_workers, return_exceptions=True)
+
+    def close(self):
+        '''Detach from all components, deliver the remaining records and
+        close the sinks.'''
+        with self._mutex:
+            comps = list(self._loggers.keys())
+        utils.parallel_map(self.detach, comps, return_exceptions=True)
+        self._closed = True
+        self._wake.set()
+        self._thread.join()
+        for s in self._sinks:
+            s.close()
+
+    @property
+    def delivered(self):
+        '''The number of records delivered to the sinks.'''
+        with self._buf_lock:
+            return self._delivered
+
+    def detach(self, comp):
+        '''Stop collecting the log records of a component.
+
+        @raises NoLoggerError
+
+        '''
+        with self._mutex:
+            cb_id = self._loggers.pop(comp, None)
+        if cb_id is not None:
+            comp.remove_logger(cb_id)
+
+    @property
+    def dropped(self):
+        '''The number of records overwritten in the buffer before they could
+        be delivered.'''
+        with self._buf_lock:
+            return self._dropped
+
+    @property
+    def filtered(self):
+        '''The number of records discarded by the level and source filters.'''
+        with self._buf_lock:
+            return self._filtered
+
+    def flush(self, timeout=None):
+        '''Wait until the records received so far have been delivered.
+
+        @param timeout The longest time to wait, in seconds, or None to wait
+                       until the buffer is empty.
+        @return True if the buffer is empty, False if the wait timed out.
+
+        '''
+        deadline = None if timeout is None else time.time() + timeout
+        with self._idle:
+            self._wake.set()
+            while self._buffer or self._busy:
+                remaining = None if deadline is None else \
+                        deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+            return True
+
+    @property
+    def pending(self):
+        '''The number of records waiting in the buffer.'''
+        return len(self._buffer)
+
+    @property
+    def received(self):
+        '''The number of records received from components.'''
+        with self._buf_lock:
+            return self._received
+
+    @property
+    def sink_errors(self):
+        '''The number of batches a sink failed to write.'''
+        return self._sink_errors
+
+    def _deliver(self):
+        # Deliver the records in the buffer to the sinks in batches.
+        buf = self._buffer
+        while True:
+            with self._buf_lock:
+                batch = [buf.popleft() \
+                        for ii in range(min(self._batch_size, len(buf)))]
+            if not batch:
+                return
+            for s in self._sinks:
+                try:
+                    s.write(batch)
+                except Exception as e:
+                    self._sink_errors += 1
+                    print('{0}: Log sink {1} failed: {2}'.format(sys.argv[0],
+                        s, e), file=sys.stderr)
+            with self._buf_lock:
+                self._delivered += len(batch)
+
+    def _deliver_loop(self):
+        # The delivery thread.
+        while True:
+            self._wake.wait(self._flush_interval)
+            self._wake.clear()
+            closed = self._closed
+            with self._idle:
+                self._busy = True
+            try:
+                self._deliver()
+            finally:
+                with self._idle:
+                    self._busy = False
+                    self._idle.notify_all()
+            if closed:
+                return
+
+    def _receiver(self, path):
+        # Make the callback given to a component's logger. It is called from
+        # the ORB's threads.
+        buf = self._buffer
+        lock = self._buf_lock
+        max_level = self._max_level
+        sources = self._sources
+        size = self._size
+        batch_size = self._batch_size
+
+        def receive(name, ts, source, level, message):
+            if _LEVEL_NUMS.get(level, 0) > max_level or \
+                    (sources is not None and source not in sources):
+                with lock:
+                    self._received += 1
+                    self._filtered += 1
+                return
+            record = LogRecord(path, ts, source, level, message)
+            with lock:
+                self._received += 1
+                if len(buf) >= size:
+                    # Overwrite the oldest record
+                    buf.popleft()
+                    self._dropped += 1
+                buf.append(record)
+                waiting = len(buf)
+            if waiting >= batch_size:
+                self._wake.set()
+        return receive
+
+
+##############################################################################
+## Sink objects
+
+class CallbackSink(object):
+    '''Delivers each batch of records to a function.
+
+    The function is called from the collector's delivery thread with a list
+    of LogRecord objects.
+
+    '''
+    def __init__(self, callback, *args, **kwargs):
+        super(CallbackSink, self).__init__(*args, **kwargs)
+        self._cb = callback
+
+    def close(self):
+        pass
+
+    def write(self, records):
+        self._cb(records)
+
+
+class RotatingFileSink(object):
+    '''Writes records to a text file, one per line.
+
+    When the file grows larger than @ref max_bytes, it is renamed with the
+    suffix '.1', any older files are renamed with increasing suffixes, and a
+    new file is started. Only @ref backups old files are kept.
+
+    '''
+    def __init__(self, path, max_bytes=10 * 1024 * 1024, backups=5, *args,
+            **kwargs):
+        '''Constructor.
+
+        @param path The path of the file.
+        @param max_bytes The size at which to start a new file, or None to
+                         never start a new file.
+        @param backups The number of old files to keep.
+
+        '''
+        super(RotatingFileSink, self).__init__(*args, **kwargs)
+        self._path = path
+        self._max_bytes = max_bytes
+        self._backups = backups
+        self._file = None
+
+    def __str__(self):
+        return self._path
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def write(self, records):
+        if self._file is None:
+            self._file = open(self._path, 'a')
+        self._file.write(''.join(self._format(r) + '\n' for r in records))
+        self._file.flush()
+        if self._max_bytes is not None and \
+                self._file.tell() >= self._max_bytes:
+            self._rotate()
+
+    def _format(self, record):
+        return str(record)
+
+    def _rotate(self):
+        # Start a new file, keeping the old ones.
+        self.close()
+        for ii in range(self._backups - 1, 0, -1):
+            src = '{0}.{1}'.format(self._path, ii)
+            if os.path.exists(src):
+                os.rename(src, '{0}.{1}'.format(self._path, ii + 1))
+        if self._backups > 0:
+            os.rename(self._path, self._path + '.1')
+        else:
+            os.remove(self._path)
+
+
+class JSONLinesSink(RotatingFileSink):
+    '''Writes records to a file as JSON objects, one per line.
+
+    Each object has the fields of a LogRecord. The file is rotated in the
+    same way as by @ref RotatingFileSink.
+
+    '''
+    def _format(self, record):
+        return json.dumps(record.to_dict())
+
+
+# vim: set expandtab tabstop=8 shiftwidth=4 softtabstop=4 textwidth=79
@@ -30,6 +30,11 @@ from rtctree import utils
 from rtctree.component import Component
 from rtctree.node import TreeNode
 from rtctree.rtc import RTC
+from rtctree.rtc import RTM
+
+
+# Maximum value for CORBA object hashes
+_MAX_HASH = 0x7FFFFFFF
 
 
 ##############################################################################
@@ -168,6 +173,43 @@ class Manager(TreeNode):
         self._obj = obj
         self._parse()
 
+    def reparse(self):
+        '''Reparse the manager's information.
+
+        The cached information, such as the configuration and the lists of
+        modules, is cleared and will be retrieved again when it is next
+        requested. The child component nodes are updated to match the
+        manager's components; nodes for components that have not changed are
+        kept.
+
+        If you only want to reparse a specific piece of information, use one of
+        the reparse_X() methods.
+
+        '''
+        self._reset_data()
+        self.reparse_components()
+
+    def reparse_components(self):
+        '''Update the child component nodes.
+
+        Nodes are added for new components and removed for components that
+        no longer exist. Only the new components are contacted.
+
+        '''
+        self._update_component_children()
+
+    def reparse_configuration(self):
+        '''Delayed reparse the manager's configuration.'''
+        self._reset_configuration()
+
+    def reparse_modules(self):
+        '''Delayed reparse the module lists and factory profiles.'''
+        self._reset_modules()
+
+    def reparse_profile(self):
+        '''Delayed reparse the manager's profile.'''
+        self._reset_profile()
+
     ##########################################################################
     # Module and component management
 
@@ -192,8 +234,42 @@ class Manager(TreeNode):
             if not self._obj.create_component(module_name):
                 raise exceptions.FailedToCreateComponentError(module_name)
             # The list of child components will have changed now, so it must be
-            # reparsed.
-            self._parse_component_children()
+            # updated.
+            self._update_component_children()
+
+    def create_components(self, module_names, max_workers=None):
+        '''Create several components out of loaded modules.
+
+        The components are created concurrently, and the child nodes are
+        updated once all of them have been created. Use this in place of
+        repeated calls to @ref create_component when launching many
+        components.
+
+        @param module_names A list of module names, which can contain
+                            options in the same way as for
+                            @ref create_component.
+        @param max_workers The maximum number of components to create at
+                           once. If None, the 'max_workers' option is used.
+        @return A list with an entry for each module name: the node of the new
+                component, or the exception raised when creating it
+                (FailedToCreateComponentError if the manager could not create
+                it).
+
+        '''
+        def create(module_name):
+            obj = self._obj.create_component(module_name)
+            if not obj:
+                raise exceptions.FailedToCreateComponentError(module_name)
+            return obj
+
+        with self._mutex:
+            results = utils.parallel_map(create, module_names,
+                    max_workers=max_workers, return_exceptions=True)
+            self._update_component_children()
+            for ii, r in enumerate(results):
+                if not isinstance(r, Exception):
+                    results[ii] = self._find_component_child(r)
+        return results
 
     def delete_component(self, instance_name):
         '''Delete a component.
@@ -209,8 +285,34 @@ class Manager(TreeNode):
             if self._obj.delete_component(instance_name) != RTC.RTC_OK:
                 raise exceptions.FailedToDeleteComponentError(instance_name)
             # The list of child components will have changed now, so it must be
-            # reparsed.
-            self._parse_component_children()
+            # updated.
+            self._update_component_children()
+
+    def delete_components(self, instance_names, max_workers=None):
+        '''Delete several components.
+
+        The components are deleted concurrently, and the child nodes are
+        updated once all of them have been deleted.
+
+        @param instance_names A list of the instance names of the components
+                              to delete.
+        @param max_workers The maximum number of components to delete at
+                           once. If None, the 'max_workers' option is used.
+        @return A list with an entry for each instance name: None if the
+                component was deleted, or the exception raised when deleting
+                it (FailedToDeleteComponentError if the manager could not
+                delete it).
+
+        '''
+        def delete(instance_name):
+            if self._obj.delete_component(instance_name) != RTC.RTC_OK:
+                raise exceptions.FailedToDeleteComponentError(instance_name)
+
+        with self._mutex:
+            results = utils.parallel_map(delete, instance_names,
+                    max_workers=max_workers, return_exceptions=True)
+            self._update_component_children()
+        return results
 
     def load_module(self, path, init_func):
         '''Load a shared library.
@@ -227,6 +329,7 @@ class Manager(TreeNode):
             with self._mutex:
                 if self._obj.load_module(path, init_func) != RTC.RTC_OK:
                     raise exceptions.FailedToLoadModuleError(path)
+                self._reset_modules()
         except CORBA.UNKNOWN as e:
             if e.args[0] == UNKNOWN_UserException:
                 raise exceptions.FailedToLoadModuleError(path, 'CORBA User Exception')
@@ -245,7 +348,8 @@ class Manager(TreeNode):
         '''
         with self._mutex:
             if self._obj.unload_module(path) != RTC.RTC_OK:
-                raise FailedToUnloadModuleError(path)
+                raise exceptions.FailedToUnloadModuleError(path)
+            self._reset_modules()
 
     @property
     def components(self):
@@ -257,7 +361,7 @@ class Manager(TreeNode):
 
         '''
         with self._mutex:
-            if not self._components:
+            if self._components is None:
                 self._components = [c for c in self.children if c.is_component]
         return self._components
 
@@ -265,7 +369,7 @@ class Manager(TreeNode):
     def factory_profiles(self):
         '''The factory profiles of all loaded modules.'''
         with self._mutex:
-            if not self._factory_profiles:
+            if self._factory_profiles is None:
                 self._factory_profiles = []
                 for fp in self._obj.get_factory_profiles():
                     self._factory_profiles.append(utils.nvlist_to_dict(fp.properties))
@@ -286,13 +390,13 @@ class Manager(TreeNode):
             if self._obj.set_configuration(param, value) != RTC.RTC_OK:
                 raise exceptions.FailedToSetConfigurationError(param, value)
             # Force a reparse of the configuration
-            self._configuration = None
+            self._reset_configuration()
 
     @property
     def configuration(self):
         '''The configuration dictionary of the manager.'''
         with self._mutex:
-            if not self._configuration:
+            if self._configuration is None:
                 self._configuration = utils.nvlist_to_dict(self._obj.get_configuration())
         return self._configuration
 
@@ -300,7 +404,7 @@ class Manager(TreeNode):
     def profile(self):
         '''The manager's profile.'''
         with self._mutex:
-            if not self._profile:
+            if self._profile is None:
                 profile = self._obj.get_profile()
                 self._profile = utils.nvlist_to_dict(profile.properties)
         return self._profile
@@ -358,7 +462,7 @@ class Manager(TreeNode):
     def loadable_modules(self):
         '''The list of loadable module profile dictionaries.'''
         with self._mutex:
-            if not self._loadable_modules:
+            if self._loadable_modules is None:
                 self._loadable_modules = []
                 for mp in self._obj.get_loadable_modules():
                     self._loadable_modules.append(utils.nvlist_to_dict(mp.properties))
@@ -368,7 +472,7 @@ class Manager(TreeNode):
     def loaded_modules(self):
         '''The list of loaded module profile dictionaries.'''
         with self._mutex:
-            if not self._loaded_modules:
+            if self._loaded_modules is None:
                 self._loaded_modules = []
                 for mp in self._obj.get_loaded_modules():
                     self._loaded_modules.append(utils.nvlist_to_dict(mp.properties))
@@ -395,7 +499,7 @@ class Manager(TreeNode):
 
         '''
         with self._mutex:
-            if not self._slaves:
+            if self._slaves is None:
                 self._slaves = [c for c in self.children if c.is_manager]
         return self._slaves
 
@@ -421,67 +525,200 @@ class Manager(TreeNode):
     def _parse(self):
         # Nearly everything is delay-parsed when it is first accessed.
         with self._mutex:
-            self._components = None
-            self._configuration = None
-            self._profile = None
-            self._factory_profiles = None
-            self._loadable_modules = None
-            self._loaded_modules = None
-            self._masters = None
-            self._slaves = None
+            self._reset_data()
             self._parse_children()
 
     def _parse_children(self):
         # Parses child managers and components.
         with self._mutex:
-            self._parse_component_children()
-            self._parse_manager_children()
+            self._add_children(self._get_component_objs() or [],
+                    self._get_slave_objs())
 
     def _parse_component_children(self):
         # Parses the list returned by _obj.get_components into child nodes.
         with self._mutex:
-            try:
-                comps = self._obj.get_components()
-            except CORBA.BAD_PARAM as e:
-                print('{0}: {1}'.format(os.path.basename(sys.argv[0]), e),
-                        file=sys.stderr)
-                return
-            for c in comps:
-                # Get the instance profile - this will be the node's name
-                profile = c.get_component_profile()
-                instance_name = profile.instance_name
-                # Create and store the new leaf node
-                leaf = Component(instance_name + '.rtc', self, c)
-                self._add_child(leaf)
+            self._add_children(self._get_component_objs() or [], [])
 
     def _parse_manager_children(self):
         # Parses the list returned by _obj.get_slave_managers into child nodes.
         with self._mutex:
+            self._add_children([], self._get_slave_objs())
+
+    def _add_children(self, comps, mgrs):
+        # Create child nodes for lists of component and slave manager objects.
+        # A hierarchy of slave managers is parsed a level at a time: the
+        # profiles of all the objects at one level are retrieved concurrently,
+        # then the nodes are created concurrently using those profiles, then
+        # the objects held by the new slave managers are retrieved for the
+        # next level. Each level uses a single pool of threads, so the number
+        # of threads does not grow with the depth of the hierarchy. The nodes
+        # below this manager are added to their parents without sending
+        # events; the events for the whole of each new subtree are sent when
+        # it is added to this manager, once its paths are final, or when this
+        # manager is added to its parent if it is being created.
+        dynamic = self._dynamic
+
+        def get_profile(item):
+            mgr, is_comp, obj = item
+            if is_comp:
+                return obj.get_component_profile()
             try:
-                mgrs = self._obj.get_slave_managers()
-            except CORBA.BAD_OPERATION:
-                # This manager does not support slave managers; ignore
-                return
-            index = 0
-            for m in mgrs:
-                # Add each slave manager as a child node.
-                try:
-                    props = utils.nvlist_to_dict(m.get_profile().properties)
-                except CORBA.TRANSIENT as e:
-                    if e.args[0] == TRANSIENT_ConnectFailed:
-                        print('{0}: Warning: zombie slave of '\
-                                'manager {1} found'.format(sys.argv[0],
-                                        self.name), file=sys.stderr)
-                        continue
+                return utils.nvlist_to_dict(obj.get_profile().properties)
+            except CORBA.TRANSIENT as e:
+                if e.args[0] == TRANSIENT_ConnectFailed:
+                    return None
+                raise
+
+        def make_child(child):
+            mgr, name, obj, profile = child
+            if profile is not None:
+                return mgr._get_shared_child(Component, name, obj,
+                        profile=profile, dynamic=dynamic)
+            return _new_slave(name, mgr, obj, dynamic)
+
+        def get_objs(slave):
+            return (slave._get_component_objs() or [],
+                    slave._get_slave_objs())
+
+        leaves = []
+        level = [(self, comps, mgrs)]
+        while level:
+            items = []
+            for mgr, level_comps, level_mgrs in level:
+                items += [(mgr, True, c) for c in level_comps] + \
+                        [(mgr, False, m) for m in level_mgrs]
+            profiles = utils.parallel_map(get_profile, items)
+
+            # Name the children
+            children = []
+            indices = {}
+            for (mgr, is_comp, obj), profile in zip(items, profiles):
+                if is_comp:
+                    # The instance name will be the node's name
+                    children.append((mgr, profile.instance_name + '.rtc',
+                        obj, profile))
+                elif profile is None:
+                    print('{0}: Warning: zombie slave of manager {1} '\
+                            'found'.format(sys.argv[0], mgr.name),
+                            file=sys.stderr)
+                else:
+                    if 'name' in profile:
+                        name = profile['name']
                     else:
-                        raise
-                if 'name' in props:
-                    name = props['name']
+                        index = indices.get(mgr, 0)
+                        name = 'slave{0}'.format(index)
+                        indices[mgr] = index + 1
+                    children.append((mgr, name, obj, None))
+
+            slaves = []
+            for (mgr, name, obj, profile), leaf in zip(children,
+                    utils.parallel_map(make_child, children)):
+                if mgr is self:
+                    leaves.append(leaf)
                 else:
-                    name = 'slave{0}'.format(index)
-                    index += 1
-                leaf = Manager(name, self, m)
+                    with mgr._mutex:
+                        mgr._children[leaf._name] = leaf
+                if profile is None:
+                    slaves.append(leaf)
+            level = [(slave, slave_comps, slave_mgrs) for slave,
+                    (slave_comps, slave_mgrs) in zip(slaves,
+                        utils.parallel_map(get_objs, slaves))]
+        parent = self._parent
+        if parent is not None and parent._children.get(self._name) is not self:
+            with self._mutex:
+                for leaf in leaves:
+                    self._children[leaf._name] = leaf
+        else:
+            for leaf in leaves:
                 self._add_child(leaf)
+        self._components = None
+        self._slaves = None
+
+    def _get_component_objs(self):
+        # Get the component objects held by the manager.
+        try:
+            return self._obj.get_components()
+        except CORBA.BAD_PARAM as e:
+            print('{0}: {1}'.format(os.path.basename(sys.argv[0]), e),
+                    file=sys.stderr)
+            return None
+
+    def _update_component_children(self):
+        # Update the child component nodes to match the list returned by
+        # _obj.get_components. Existing nodes are matched to the objects by
+        # reference, which does not contact the components, so only new
+        # components have their profiles retrieved. A new component with the
+        # same instance name as an existing node replaces that node.
+        with self._mutex:
+            objs = self._get_component_objs()
+            if objs is None:
+                return
+            current = {}
+            for c in self._children.values():
+                if c.is_component:
+                    current.setdefault(c.object._hash(_MAX_HASH), []).append(c)
+            kept = set()
+            new = []
+            for obj in objs:
+                for c in current.get(obj._hash(_MAX_HASH), []):
+                    if c.object._is_equivalent(obj):
+                        kept.add(c)
+                        break
+                else:
+                    new.append(obj)
+            for bucket in current.values():
+                for c in bucket:
+                    if c not in kept:
+                        self.remove_child(c)
+            self._components = None
+            self._add_children(new, [])
+
+    def _find_component_child(self, obj):
+        # Find the child component node for a component object.
+        with self._mutex:
+            for c in self._children.values():
+                if c.is_component and c.object._is_equivalent(obj):
+                    return c
+        return None
+
+    def _get_slave_objs(self):
+        # Get the slave manager objects of the manager.
+        try:
+            return self._obj.get_slave_managers()
+        except CORBA.BAD_OPERATION:
+            # This manager does not support slave managers; ignore
+            return []
+
+    def _reset_configuration(self):
+        with self._mutex:
+            self._configuration = None
+
+    def _reset_data(self):
+        with self._mutex:
+            self._components = None
+            self._masters = None
+            self._slaves = None
+        self._reset_configuration()
+        self._reset_modules()
+        self._reset_profile()
+
+    def _reset_modules(self):
+        with self._mutex:
+            self._factory_profiles = None
+            self._loadable_modules = None
+            self._loaded_modules = None
+
+    def _reset_profile(self):
+        with self._mutex:
+            self._profile = None
+
+    def _restore(self, data, orb):
+        # Restore the manager from snapshot data without contacting it. The
+        # child nodes are restored separately.
+        with self._mutex:
+            self._obj = orb.string_to_object(data['ior'])._unchecked_narrow(
+                    RTM.Manager)
+            self._reset_data()
 
     def _remove_master(self, master):
         # Remove a new master from this manager. A slave manager can have multiple
@@ -513,4 +750,17 @@ class Manager(TreeNode):
             self.parent = new_parent
 
 
+##############################################################################
+## Internal functions
+
+def _new_slave(name, master, obj, dynamic):
+    # Create the node for a slave manager without parsing its children; they
+    # are added by the master (see Manager._add_children).
+    slave = Manager.__new__(Manager)
+    TreeNode.__init__(slave, name=name, parent=master, dynamic=dynamic)
+    slave._obj = obj
+    slave._reset_data()
+    return slave
+
+
 # vim: set expandtab tabstop=8 shiftwidth=4 softtabstop=4 textwidth=79
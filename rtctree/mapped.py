@@ -0,0 +1,687 @@
+# -*- Python -*-
+# -*- coding: utf-8 -*-
+
+'''rtctree
+
+Copyright (C) 2009-2015
+    Geoffrey Biggs
+    RT-Synthesis Research Group
+    Intelligent Systems Research Institute,
+    National Institute of Advanced Industrial Science and Technology (AIST),
+    Japan
+    All rights reserved.
+Licensed under the GNU Lesser General Public License version 3.
+http://www.gnu.org/licenses/lgpl-3.0.en.html
+
+Read-only tree snapshots that are queried in place using a memory map.
+
+Unlike the snapshots in rtctree.snapshot, a mapped snapshot is not loaded into
+a tree of node objects. It is mapped into memory and read directly, so opening
+it costs nothing regardless of the size of the tree, and every process on a
+host that maps the same file shares a single copy of it in the page cache.
+
+The file is laid out as follows (all integers are little-endian, unsigned
+32-bit unless noted):
+
+  header      magic (8 bytes), format version (16-bit), padding (16-bit),
+              string count, node count, key/value pair count,
+              string table offset, string data offset, node array offset,
+              key/value array offset
+  strings     (offset, length) into the string data for each unique string
+  string data UTF-8 encoded string bytes
+  nodes       one fixed-size record per node: name string, kind (8-bit),
+              padding (24-bit), parent node (signed; -1 for the root), first
+              child node, child count, object reference string, first
+              key/value pair, key/value pair count, shared node
+  key/values  (key string, value string) pairs holding component profiles
+
+Nodes are stored breadth-first, so the children of a node are stored next to
+each other, sorted by name so they can be found using a binary search. The
+profile of a component is stored as key/value pairs using the field names
+from rtctree.index (e.g. 'type_name' and 'properties.naming.type').
+
+A component held by more than one node (see rtctree.node.SharedNode) is
+stored once. The records for the other holders' children have their own name
+and parent, and refer to the component's record by its number as their shared
+node; they use the component's kind, object reference and key/value pairs.
+The shared node of every other record is 0xFFFFFFFF.
+
+Example:
+>>> import os, shutil, tempfile
+>>> from rtctree.node import SharedNode, TreeNode
+>>> class Comp(TreeNode):
+...     is_component = True
+...     object = None
+...     instance_name = type_name = description = version = 'Motor'
+...     vendor = category = parent_object = 'Motor'
+...     properties = {'naming.type': 'rtc'}
+>>> root = TreeNode('/')
+>>> ns = TreeNode('localhost', root)
+>>> root._add_child(ns)
+>>> mgr = TreeNode('m.mgr', ns)
+>>> ns._add_child(mgr)
+>>> mgr._add_child(Comp('b.rtc', mgr))
+>>> ns._add_child(Comp('a.rtc', ns))
+>>> ns._add_child(SharedNode('b.rtc', ns, mgr.children[0]))
+>>> d = tempfile.mkdtemp()
+>>> write(root, os.path.join(d, 'tree.map'))
+>>> t = MappedTree(os.path.join(d, 'tree.map'))
+>>> t.iterate(lambda n, args: n.full_path_str, filter=['is_component'])
+['/localhost/a.rtc', '/localhost/b.rtc', '/localhost/m.mgr/b.rtc']
+>>> b = t.get_node(['/', 'localhost', 'b.rtc'])
+>>> b.parent_name, b.type_name, b.properties
+('localhost', 'Motor', {'naming.type': 'rtc'})
+>>> b.shared_node.full_path_str
+'/localhost/m.mgr/b.rtc'
+>>> t.get_node(['/', 'localhost', 'c.rtc']) is None
+True
+>>> len(t.find_components(type_name='Motor'))
+2
+>>> t.close()
+>>> shutil.rmtree(d)
+
+'''
+
+
+import mmap
+import os
+import os.path
+import struct
+import tempfile
+
+from rtctree import exceptions
+from rtctree import index
+from rtctree.node import SharedNode
+
+
+MAGIC = b'RTCTMMAP'
+FORMAT_VERSION = 2
+
+_HEADER = struct.Struct('<8sHxx7I')
+_STRING = struct.Struct('<II')
+_NODE = struct.Struct('<IBxxxiIIIIII')
+_KV = struct.Struct('<II')
+_NONE = 0xFFFFFFFF
+
+# Node kinds
+ROOT = 0
+NAMESERVER = 1
+DIRECTORY = 2
+MANAGER = 3
+COMPONENT = 4
+ZOMBIE = 5
+UNKNOWN = 6
+
+_PROFILE_FIELDS = ['instance_name', 'type_name', 'description', 'version',
+        'vendor', 'category', 'parent_object']
+
+
+##############################################################################
+## API functions
+
+def write(tree, path):
+    '''Write a mapped snapshot of a tree to a file.
+
+    The file is written to a temporary file and then renamed into place, so
+    processes that have the old file mapped are not affected.
+
+    @param tree The RTCTree (or a tree node) to write.
+    @param path The path of the file to write.
+
+    '''
+    if hasattr(tree, 'get_node'):
+        root = tree.get_node(['/'])
+    else:
+        root = tree
+    # Breadth-first, so each node's children are contiguous
+    order = []
+    queue = [(root, -1)]
+    while queue:
+        next_queue = []
+        for n, parent in queue:
+            ii = len(order)
+            order.append((n, parent))
+            if not n.is_component:
+                next_queue += [(c, ii) for c in sorted(n.children,
+                    key=lambda c: c.name.encode('utf-8'))]
+        queue = next_queue
+    # Nodes shared with another holder in the tree are written as references
+    # to the holder's record
+    written = dict([(id(n), ii) for ii, (n, parent) in enumerate(order) \
+            if not isinstance(n, SharedNode)])
+    shared = {}
+    for ii, (n, parent) in enumerate(order):
+        if isinstance(n, SharedNode) and id(n.shared_node) in written:
+            shared[ii] = written[id(n.shared_node)]
+
+    strings = _StringTable()
+    nodes = []
+    kvs = []
+    for ii, (n, parent) in enumerate(order):
+        child_count = 0
+        if not n.is_component:
+            child_count = len(n.children)
+        kv_start = len(kvs)
+        ior = _NONE
+        if ii not in shared:
+            if n.is_component:
+                for f in _PROFILE_FIELDS:
+                    kvs.append((strings.add(f),
+                        strings.add(_to_str(getattr(n, f)))))
+                for k in sorted(n.properties.keys()):
+                    kvs.append((strings.add('properties.' + k),
+                        strings.add(_to_str(n.properties[k]))))
+            obj = _get_object(n)
+            if obj is not None and n.orb is not None:
+                ior = strings.add(n.orb.object_to_string(obj))
+        nodes.append([strings.add(n.name), _kind(n), parent, 0, child_count,
+            ior, kv_start, len(kvs) - kv_start, _NONE])
+    for ii, target in shared.items():
+        rec = nodes[ii]
+        rec[1], rec[5], rec[6], rec[7] = nodes[target][1], \
+                nodes[target][5], nodes[target][6], nodes[target][7]
+        rec[8] = target
+    # Fill in the first child of each node now that the positions are known
+    next_child = 1
+    for rec in nodes:
+        rec[3] = next_child if rec[4] else _NONE
+        next_child += rec[4]
+
+    str_data = b''.join(strings.values)
+    str_table_off = _HEADER.size
+    str_data_off = str_table_off + _STRING.size * len(strings.values)
+    nodes_off = _align(str_data_off + len(str_data))
+    kv_off = nodes_off + _NODE.size * len(nodes)
+    parts = [_HEADER.pack(MAGIC, FORMAT_VERSION, len(strings.values),
+        len(nodes), len(kvs), str_table_off, str_data_off, nodes_off, kv_off)]
+    offset = 0
+    for s in strings.values:
+        parts.append(_STRING.pack(offset, len(s)))
+        offset += len(s)
+    parts.append(str_data)
+    parts.append(b'\0' * (nodes_off - str_data_off - len(str_data)))
+    for rec in nodes:
+        parts.append(_NODE.pack(*rec))
+    for kv in kvs:
+        parts.append(_KV.pack(*kv))
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(b''.join(parts))
+        # mkstemp creates the file readable only by its owner; give it the
+        # mode a newly-created file would have, so other processes can map it
+        os.chmod(tmp_path, 0o666 & ~_umask())
+        os.rename(tmp_path, path)
+    except:
+        os.unlink(tmp_path)
+        raise
+
+
+##############################################################################
+## Mapped tree object
+
+class MappedTree(object):
+    '''A read-only tree backed by a memory-mapped snapshot file.
+
+    The tree provides the read-only parts of the RTCTree API. The nodes it
+    returns are @ref MappedNode objects, which provide the read-only parts of
+    the TreeNode API and the profile properties of components.
+
+    '''
+    def __init__(self, path, *args, **kwargs):
+        '''Constructor.
+
+        @param path The path of a file written by @ref write.
+        @raises BadSnapshotError
+
+        '''
+        super(MappedTree, self).__init__(*args, **kwargs)
+        self._path = path
+        with open(path, 'rb') as f:
+            try:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, mmap.error) as e:
+                raise exceptions.BadSnapshotError(path, str(e))
+        if len(self._map) < _HEADER.size:
+            self.close()
+            raise exceptions.BadSnapshotError(path, 'truncated file')
+        (magic, version, self._num_strings, self._num_nodes, self._num_kvs,
+            self._str_table_off, self._str_data_off, self._nodes_off,
+            self._kv_off) = _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self.close()
+            raise exceptions.BadSnapshotError(path, 'incompatible version')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self._num_nodes
+
+    def close(self):
+        '''Unmap the snapshot file.'''
+        self._map.close()
+
+    def get_node(self, path):
+        '''Get a node by path.
+
+        @param path A list of path elements pointing to a node in the tree.
+                    For example, ['/', 'localhost', 'dir.host'].
+        @return The node, or None if it does not exist.
+
+        '''
+        return self.root.get_node(path)
+
+    def has_path(self, path):
+        '''Check if the tree has a path.'''
+        return self.get_node(path) is not None
+
+    def find_components(self, criteria={}, **kwargs):
+        '''Find the components in the tree matching a set of profile values.
+
+        See @ref RTCTree.find_components.
+
+        '''
+        criteria = dict(criteria)
+        criteria.update(kwargs)
+        return [n for n in self.nodes if n.is_component and \
+                n._rec[8] == _NONE and index.matches(n, criteria)]
+
+    def is_component(self, path):
+        '''Is the node pointed to by @ref path a component?'''
+        node = self.get_node(path)
+        return node is not None and node.is_component
+
+    def is_directory(self, path):
+        '''Is the node pointed to by @ref path a directory?'''
+        node = self.get_node(path)
+        return node is not None and node.is_directory
+
+    def is_manager(self, path):
+        '''Is the node pointed to by @ref path a manager?'''
+        node = self.get_node(path)
+        return node is not None and node.is_manager
+
+    def is_nameserver(self, path):
+        '''Is the node pointed to by @ref path a name server?'''
+        node = self.get_node(path)
+        return node is not None and node.is_nameserver
+
+    def is_unknown(self, path):
+        '''Is the node pointed to by @ref path an unknown object?'''
+        node = self.get_node(path)
+        return node is None or node.is_unknown
+
+    def is_zombie(self, path):
+        '''Is the node pointed to by @ref path a zombie object?'''
+        node = self.get_node(path)
+        return node is not None and node.is_zombie
+
+    def iterate(self, func, args=None, filter=[]):
+        '''Call a function on the root node, and recursively all its children.
+
+        See @ref TreeNode.iterate.
+
+        '''
+        return self.root.iterate(func, args, filter)
+
+    @property
+    def nodes(self):
+        '''All the nodes in the tree, in breadth-first order.'''
+        return [MappedNode(self, ii) for ii in range(self._num_nodes)]
+
+    @property
+    def path(self):
+        '''The path of the snapshot file.'''
+        return self._path
+
+    @property
+    def root(self):
+        '''The root node.'''
+        return MappedNode(self, 0)
+
+    def _find_child(self, ii, name):
+        # Binary search the children of a node for a name.
+        rec = self._node(ii)
+        lo = rec[3]
+        hi = lo + rec[4]
+        name = name.encode('utf-8')
+        while lo < hi:
+            mid = (lo + hi) // 2
+            mid_name = self._string_bytes(self._node(mid)[0])
+            if mid_name < name:
+                lo = mid + 1
+            elif mid_name > name:
+                hi = mid
+            else:
+                return mid
+        return None
+
+    def _kvs(self, ii):
+        # The key/value pairs of a node as a list of string tuples.
+        rec = self._node(ii)
+        result = []
+        for jj in range(rec[6], rec[6] + rec[7]):
+            k, v = _KV.unpack_from(self._map, self._kv_off + jj * _KV.size)
+            result.append((self._string(k), self._string(v)))
+        return result
+
+    def _node(self, ii):
+        return _NODE.unpack_from(self._map, self._nodes_off + ii * _NODE.size)
+
+    def _string(self, ii):
+        if ii == _NONE:
+            return None
+        return self._string_bytes(ii).decode('utf-8')
+
+    def _string_bytes(self, ii):
+        offset, length = _STRING.unpack_from(self._map,
+                self._str_table_off + ii * _STRING.size)
+        start = self._str_data_off + offset
+        return self._map[start:start + length]
+
+
+##############################################################################
+## Mapped node object
+
+class MappedNode(object):
+    '''A read-only view of a node in a mapped snapshot.
+
+    These objects are created on demand and hold no data other than their
+    position in the snapshot.
+
+    '''
+    def __init__(self, tree, ii, *args, **kwargs):
+        super(MappedNode, self).__init__(*args, **kwargs)
+        self._tree = tree
+        self._ii = ii
+
+    def __eq__(self, other):
+        return isinstance(other, MappedNode) and \
+                other._tree is self._tree and other._ii == self._ii
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((id(self._tree), self._ii))
+
+    def __repr__(self):
+        return '<MappedNode {0}>'.format(self.full_path_str)
+
+    def get_node(self, path):
+        '''Get a child node of this node, or this node, based on a path.
+
+        See @ref TreeNode.get_node.
+
+        '''
+        if path[0] != self.name:
+            return None
+        ii = self._ii
+        for name in path[1:]:
+            ii = self._tree._find_child(ii, name)
+            if ii is None:
+                return None
+        return MappedNode(self._tree, ii)
+
+    def has_path(self, path):
+        '''Check if a path exists below this node.'''
+        return self.get_node(path) is not None
+
+    def is_child(self, other_node):
+        '''Is @ref other_node a child of this node?'''
+        return other_node in self.children
+
+    def is_parent(self, other_node):
+        '''Is @ref other_node the parent of this note?'''
+        return other_node == self.parent
+
+    def iterate(self, func, args=None, filter=[]):
+        '''Call a function on this node, and recursively all its children.
+
+        See @ref TreeNode.iterate.
+
+        '''
+        result = []
+        passed = True
+        for f in filter:
+            if type(f) == str:
+                passed = getattr(self, f)
+            else:
+                passed = f(self)
+            if not passed:
+                break
+        if passed:
+            result.append(func(self, args))
+        for c in self.children:
+            result += c.iterate(func, args, filter)
+        return result
+
+    @property
+    def children(self):
+        '''The child nodes of this node (if any).'''
+        rec = self._rec
+        if not rec[4]:
+            return []
+        return [MappedNode(self._tree, ii) \
+                for ii in range(rec[3], rec[3] + rec[4])]
+
+    @property
+    def children_names(self):
+        '''A list of the names of the child nodes of this node (if any).'''
+        return [c.name for c in self.children]
+
+    @property
+    def depth(self):
+        '''The depth of this node in the tree.'''
+        return len(self.full_path) - 1
+
+    @property
+    def dynamic(self):
+        '''Mapped nodes are never dynamic.'''
+        return False
+
+    @property
+    def full_path(self):
+        '''The full path of this node.'''
+        path = []
+        node = self
+        while node is not None:
+            path.insert(0, node.name)
+            node = node.parent
+        return path
+
+    @property
+    def full_path_str(self):
+        '''The full path of this node as a string.'''
+        path = self.full_path
+        if len(path) == 1:
+            return path[0]
+        return '/' + '/'.join(path[1:])
+
+    @property
+    def ior(self):
+        '''The stringified object reference of this node's object, if any.'''
+        return self._tree._string(self._rec[5])
+
+    @property
+    def is_component(self):
+        '''Is this node a component?'''
+        return self._kind == COMPONENT
+
+    @property
+    def is_directory(self):
+        '''Is this node a directory?'''
+        return self._kind in (ROOT, NAMESERVER, DIRECTORY, MANAGER)
+
+    @property
+    def is_manager(self):
+        '''Is this node a manager?'''
+        return self._kind == MANAGER
+
+    @property
+    def is_nameserver(self):
+        '''Is this node a name server?'''
+        return self._kind == NAMESERVER
+
+    @property
+    def is_unknown(self):
+        '''Is this node unknown?'''
+        return self._kind == UNKNOWN
+
+    @property
+    def is_zombie(self):
+        '''Is this node a zombie?'''
+        return self._kind == ZOMBIE
+
+    @property
+    def name(self):
+        '''The name of this node.'''
+        return self._tree._string(self._rec[0])
+
+    @property
+    def nameserver(self):
+        '''The name server of the node (i.e. its top-most parent below /).'''
+        node = self
+        while node.parent is not None:
+            if node.parent._ii == 0:
+                return node
+            node = node.parent
+        return None
+
+    @property
+    def parent(self):
+        '''This node's parent, or None if no parent.'''
+        parent = self._rec[2]
+        if parent < 0:
+            return None
+        return MappedNode(self._tree, parent)
+
+    @property
+    def parent_name(self):
+        '''The name of this node's parent or an empty string if no parent.'''
+        parent = self.parent
+        if parent is None:
+            return ''
+        return parent.name
+
+    @property
+    def profile(self):
+        '''The profile of a component as a dictionary of field values.
+
+        Properties are included using their field names, e.g.
+        'properties.naming.type'.
+
+        '''
+        return dict(self._tree._kvs(self._ii))
+
+    @property
+    def properties(self):
+        '''The component's extra properties dictionary.'''
+        prefix = 'properties.'
+        return dict([(k[len(prefix):], v) for k, v in self._tree._kvs(self._ii) \
+                if k.startswith(prefix)])
+
+    @property
+    def root(self):
+        '''The root node of the tree this node is in.'''
+        return self._tree.root
+
+    @property
+    def shared_node(self):
+        '''The node holding the data of this node.
+
+        This is the node this node refers to, if it is held by more than one
+        node, otherwise this node.
+
+        '''
+        target = self._rec[8]
+        if target == _NONE:
+            return self
+        return MappedNode(self._tree, target)
+
+    @property
+    def _kind(self):
+        return self._rec[1]
+
+    @property
+    def _rec(self):
+        return self._tree._node(self._ii)
+
+    def __getattr__(self, name):
+        # Component profile fields
+        if name in _PROFILE_FIELDS:
+            for k, v in self._tree._kvs(self._ii):
+                if k == name:
+                    return v
+            if self.is_component:
+                return ''
+        raise AttributeError(name)
+
+
+##############################################################################
+## Internal functions
+
+class _StringTable(object):
+    # Interns strings and assigns each a number.
+    def __init__(self):
+        self.values = []
+        self._ids = {}
+
+    def add(self, s):
+        b = s.encode('utf-8')
+        if b not in self._ids:
+            self._ids[b] = len(self.values)
+            self.values.append(b)
+        return self._ids[b]
+
+
+def _align(offset, alignment=8):
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def _get_object(node):
+    if node.is_nameserver or (node.is_directory and not node.is_manager \
+            and node.parent is not None):
+        return node.context
+    if node.is_component or node.is_manager or node.is_unknown:
+        return node.object
+    return None
+
+
+def _kind(node):
+    if node.parent is None:
+        return ROOT
+    elif node.is_nameserver:
+        return NAMESERVER
+    elif node.is_manager:
+        return MANAGER
+    elif node.is_component:
+        return COMPONENT
+    elif node.is_zombie:
+        return ZOMBIE
+    elif node.is_unknown:
+        return UNKNOWN
+    return DIRECTORY
+
+
+def _to_str(value):
+    if isinstance(value, type(u'')):
+        return value
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    return type(u'')(value)
+
+
+def _umask():
+    # Get the process's umask. It can only be read by setting it.
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+
+# vim: set expandtab tabstop=8 shiftwidth=4 softtabstop=4 textwidth=79
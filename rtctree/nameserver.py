@@ -78,6 +78,18 @@ class NameServer(Directory):
             root_context = self._connect_to_naming_service(address)
             self._parse_context(root_context, orb, filter)
 
+    def _restore(self, data, orb):
+        # Restore the name server from snapshot data without contacting it.
+        # The child nodes are restored separately.
+        with self._mutex:
+            self._address = data['name']
+            self._orb = orb
+            self._full_address = 'corbaloc::{0}/NameService'.format(
+                    self._address)
+            self._context = orb.string_to_object(data['ior'])._unchecked_narrow(
+                    CosNaming.NamingContext)
+            self._ns_obj = self._context
+
     def _connect_to_naming_service(self, address):
         # Try to connect to a name server and get the root naming context.
         with self._mutex:
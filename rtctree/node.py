@@ -62,6 +62,7 @@ class TreeNode(object):
         else:
             self._children = {}
         self._cbs = {}
+        self._tree = None
         self._dynamic = dynamic
         if dynamic:
             self._enable_dynamic(dynamic)
@@ -89,10 +90,13 @@ class TreeNode(object):
         relevant information for the event, and cb_args are the arguments you
         registered with the callback.
 
+        Any number of callbacks can be added for an event; they are called in
+        the order they were added.
+
         '''
         if event not in self._cbs:
-            raise exceptions.NoSuchEventError
-        self._cbs[event] = [(cb, args)]
+            raise exceptions.NoSuchEventError(self.name, event)
+        self._cbs[event].append((cb, args))
 
     def get_node(self, path):
         '''Get a child node of this node, or this node, based on a path.
@@ -227,7 +231,7 @@ class TreeNode(object):
         '''
         if event not in self._cbs:
             raise exceptions.NoSuchEventError(self.name, event)
-        c = [(x[0], x[1]) for x in self._cbs[event]]
+        c = [x for x in self._cbs[event] if x[0] == cb]
         if not c:
             raise exceptions.NoCBError(self.name, event, cb)
         self._cbs[event].remove(c[0])
@@ -370,6 +374,7 @@ class TreeNode(object):
             if child.name not in self._children:
                 raise exceptions.NotRelatedError(self.name, child.name)
             del self._children[child.name]
+        self._tree_event('node_removed', child, self)
 
     @parent.setter
     def parent(self, new_parent):
@@ -397,30 +402,194 @@ class TreeNode(object):
             else:
                 return self
 
+    @property
+    def tree(self):
+        '''The RTCTree object this node belongs to.
+
+        None if the node is not part of a tree created by RTCTree.
+
+        '''
+        # Walk up without taking each node's lock; this is called from the ORB
+        # threads that deliver observer events.
+        node = self
+        while node._parent:
+            node = node._parent
+        if node._tree:
+            return node._tree()
+        return None
+
     def _add_child(self, new_child):
         # Add a child to this node.
         with self._mutex:
+            old_child = self._children.get(new_child._name)
             self._children[new_child._name] = new_child
+        if old_child is not None and old_child is not new_child:
+            self._tree_event('node_removed', old_child, self)
+        self._tree_event('node_added', new_child, self)
 
     def _call_cb(self, event, value):
         if event not in self._cbs:
             raise exceptions.NoSuchEventError(self.name, event)
-        for (cb, args) in self._cbs[event]:
+        for (cb, args) in list(self._cbs[event]):
             cb(self, value, args)
+        self._tree_event(event, self, value)
 
     def _enable_dynamic(self, enable=True):
         # Enable or disable dynamic features.
         # By default, do nothing.
         pass
 
+    def _get_shared_child(self, cls, name, obj, *args, **kwargs):
+        # Get the child node for a remote object that may also be reachable
+        # through another part of the tree, so that only one node (and one
+        # observer) exists for each object. The node is created, with this
+        # node as its parent, if no node with the same name exists for the
+        # object; otherwise a SharedNode for the existing node is returned.
+        tree = self.tree
+        if tree is None:
+            return cls(name, self, obj, *args, **kwargs)
+        node = tree._identities.lookup(obj)
+        if node is None or node.name != name:
+            node = cls(name, self, obj, *args, **kwargs)
+            shared = tree._identities.register(obj, node, self)
+            if shared is node:
+                return node
+            # Another thread created a node for the object at the same time
+            node.dynamic = False
+            node = shared
+        else:
+            tree._identities.register(obj, node, self)
+        if node._parent is self:
+            return node
+        # This node's lock is not taken; children are made in worker threads
+        # while the thread parsing this node holds it
+        existing = self._children.get(name)
+        if isinstance(existing, SharedNode) and existing._target is node:
+            return existing
+        return SharedNode(name, self, node)
+
     def _remove_all_children(self):
         # Remove all children from this node.
+        old_children = list(self._children.values())
         self._children = {}
+        for child in old_children:
+            self._tree_event('node_removed', child, self)
 
     def _set_events(self, events):
         self._cbs = {}
         for e in events:
             self._cbs[e] = []
 
+    def _tree_event(self, event, node, value=None):
+        # Pass an event up to the tree this node is in, if any, so that
+        # tree-wide structures such as indexes can be kept up to date.
+        tree = self.tree
+        if tree is not None:
+            tree._node_event(event, node, value)
+
+
+##############################################################################
+## Shared node object
+
+class SharedNode(TreeNode):
+    '''A node held by a node other than its parent.
+
+    The same remote object can be reached through more than one part of a
+    tree; for example, a component created by a manager is a child of the
+    manager's node and is usually also bound in a naming context. Only one
+    node, with one observer, is made for the object, and its parent is the
+    node that made it. The other nodes holding it have a SharedNode as their
+    child instead. A SharedNode has its own name, parent and path, and passes
+    everything else to the shared node, so it can be used in its place.
+
+    Example:
+    >>> ns = TreeNode(name='ns')
+    >>> mgr = TreeNode(name='mgr')
+    >>> c = TreeNode(name='c', parent=mgr)
+    >>> mgr._children['c'] = c
+    >>> v = SharedNode('c', ns, c)
+    >>> ns._children['c'] = v
+    >>> v.full_path, c.full_path
+    (['ns', 'c'], ['mgr', 'c'])
+    >>> v.parent is ns, v.shared_node is c
+    (True, True)
+    >>> c.profile = {'vendor': 'AIST'}
+    >>> v.profile
+    {'vendor': 'AIST'}
+    '''
+    def __init__(self, name, parent, target):
+        # TreeNode.__init__ is not called; all the state but the name and
+        # parent is the target's.
+        self._name = name
+        self._parent = parent
+        self._target = target
+        self._tree = None
+
+    def __getattr__(self, name):
+        # Called only for attributes this node does not have itself
+        try:
+            target = self.__dict__['_target']
+        except KeyError:
+            raise AttributeError(name)
+        return getattr(target, name)
+
+    @property
+    def dynamic(self):
+        '''Get and change the dynamic setting of the shared node.'''
+        return self._target.dynamic
+
+    @dynamic.setter
+    def dynamic(self, dynamic):
+        self._target.dynamic = dynamic
+
+    @property
+    def is_component(self):
+        '''Is the shared node a component?'''
+        return self._target.is_component
+
+    @property
+    def is_directory(self):
+        '''Is the shared node a directory?'''
+        return self._target.is_directory
+
+    @property
+    def is_manager(self):
+        '''Is the shared node a manager?'''
+        return self._target.is_manager
+
+    @property
+    def is_nameserver(self):
+        '''Is the shared node a name server?'''
+        return self._target.is_nameserver
+
+    @property
+    def is_unknown(self):
+        '''Is the shared node unknown?'''
+        return self._target.is_unknown
+
+    @property
+    def is_zombie(self):
+        '''Is the shared node a zombie?'''
+        return self._target.is_zombie
+
+    @property
+    def shared_node(self):
+        '''The node this node shares, whose parent is another node.'''
+        return self._target
+
+    def _add_child(self, new_child):
+        self._target._add_child(new_child)
+
+    def _enable_dynamic(self, enable=True):
+        self._target._enable_dynamic(enable)
+
+
+def shared_node(node):
+    '''Get the node a node shares, or the node itself if it is not a
+    SharedNode.'''
+    if isinstance(node, SharedNode):
+        return node._target
+    return node
+
 
 # vim: set expandtab tabstop=8 shiftwidth=4 softtabstop=4 textwidth=79
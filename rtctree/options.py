@@ -33,7 +33,12 @@ class Options(object):
         return cls._the_instance
 
     def init_options(self):
-        self.options = {'max_bindings': 100}
+        self.options = {'max_bindings': 100,
+                        'max_workers': 16,
+                        'ec_cache_ttl': 0,
+                        'ec_monitor_size': 256,
+                        'observer_retries': 3,
+                        'config_debounce': 0.5}
 
     def set_option(self, option, value):
         if not hasattr(self, 'options'):
@@ -27,6 +27,7 @@ import threading
 
 from rtctree import exceptions
 from rtctree import utils
+from rtctree import wait
 from rtctree.rtc import RTC
 
 
@@ -56,6 +57,22 @@ def parse_port(port_obj, owner):
         return Port(port_obj, owner)
 
 
+def restore_port(data, owner, orb):
+    '''Create a port object from snapshot data without contacting the port.
+
+    @param data The port's data from the snapshot.
+    @param owner The owner of this port. Should be a Component object or None.
+    @param orb The ORB to use to create the object references.
+    @return The created port object.
+
+    '''
+    cls = {'DataInPort': DataInPort, 'DataOutPort': DataOutPort,
+            'CorbaPort': CorbaPort}.get(data['porttype'], Port)
+    port = cls.__new__(cls)
+    port._restore(data, owner, orb)
+    return port
+
+
 ##############################################################################
 ## Base port object
 
@@ -188,6 +205,36 @@ class Port(object):
         with self._mutex:
             self._connections = None
 
+    def wait_for_connection(self, timeout=None):
+        '''Wait until this port is connected to another port.
+
+        If the port's owner has a registered observer, connections arrive as
+        events and the wait returns as soon as the port is connected.
+        Otherwise, the connections are reparsed at increasing intervals.
+
+        @param timeout The longest time to wait, in seconds, or None to wait
+                       until the port is connected.
+        @return The list of connections.
+        @raises WaitTimeoutError
+
+        '''
+        owner = self.owner
+        tree = None if owner is None else owner.tree
+
+        def refresh():
+            if owner is None or not owner._observes('PORT_PROFILE'):
+                self.reparse_connections()
+        wait.wait_until(tree, lambda: self.is_connected, refresh, timeout)
+        return self.connections
+
+    def wait_for_connection_async(self, timeout=None):
+        '''Asyncio version of @ref wait_for_connection.
+
+        @return An asyncio future that gives the list of connections.
+
+        '''
+        return wait.run_async(self.wait_for_connection, timeout)
+
     @property
     def connections(self):
         '''A list of connections to or from this port.
@@ -245,6 +292,26 @@ class Port(object):
         with self._mutex:
             return self._properties
 
+    def _restore(self, data, owner, orb):
+        # Restore the port and its connections from snapshot data.
+        self._mutex = threading.RLock()
+        with self._mutex:
+            self._obj = orb.string_to_object(data['ior'])._unchecked_narrow(
+                    RTC.PortService)
+            self._owner = owner
+            self._name = data['name']
+            self._properties = data['properties']
+            if data['connections'] is None:
+                self._connections = None
+            else:
+                self._connections = []
+                for c in data['connections']:
+                    ports = [orb.string_to_object(p)._unchecked_narrow(
+                        RTC.PortService) for p in c['ports']]
+                    cp = RTC.ConnectorProfile(c['name'], c['id'], ports,
+                            utils.dict_to_nvlist(c['properties']))
+                    self._connections.append(Connection(cp, self))
+
     def _parse(self):
         # Parse the PortService object to build a port profile.
         with self._mutex:
@@ -355,6 +422,10 @@ class CorbaPort(Port):
                                         *args, **kwargs)
         self._interfaces = None
 
+    def _restore(self, data, owner, orb):
+        super(CorbaPort, self)._restore(data, owner, orb)
+        self._interfaces = None
+
     def connect(self, dests=None, name=None, id='', props={}):
         '''Connect this port to other CorbaPorts.
 
@@ -0,0 +1,475 @@
+# -*- Python -*-
+# -*- coding: utf-8 -*-
+
+'''rtctree
+
+Copyright (C) 2009-2015
+    Geoffrey Biggs
+    RT-Synthesis Research Group
+    Intelligent Systems Research Institute,
+    National Institute of Advanced Industrial Science and Technology (AIST),
+    Japan
+    All rights reserved.
+Licensed under the GNU Lesser General Public License version 3.
+http://www.gnu.org/licenses/lgpl-3.0.en.html
+
+Queries over the nodes of a tree.
+
+A query is built from predicates, which can be combined using the &, | and ~
+operators, and an optional list of fields to select from each matching node.
+For example, to get the paths of all active DataProducer components:
+
+  from rtctree.component import Component
+  from rtctree.query import Field, Query, State
+  q = Query(Field('category', 'DataProducer') & State(Component.ACTIVE),
+            select=['full_path_str'])
+  results = q.execute(tree)
+
+Predicates that only need information already stored in the tree, such as the
+component profile, are checked first. Remote information (state, ports and
+connections) is only retrieved for the nodes that are still candidates once
+the local information has been checked, and it is retrieved for those nodes
+concurrently. If the tree has an index on a field used in a Field predicate,
+the index is used to find the candidate nodes.
+
+'''
+
+
+import fnmatch
+
+from rtctree import index
+from rtctree import utils
+from rtctree.exec_context import fetch_component_states
+
+
+# The kinds of remote data predicates and selected fields may need, in the
+# order in which they are fetched.
+STATE = 'state'
+PORTS = 'ports'
+CONNECTIONS = 'connections'
+FETCH_ORDER = [STATE, PORTS, CONNECTIONS]
+
+
+##############################################################################
+## Predicates
+
+class Predicate(object):
+    '''Base class for query predicates.
+
+    Predicates are checked against nodes using three-valued logic: a check
+    returns True or False if the predicate could be decided using the data
+    available, or None if it needs data that has not been fetched yet. The
+    base predicate matches every node.
+
+    Example:
+    >>> class Const(Predicate):
+    ...     def __init__(self, value, needs=[]):
+    ...         self._value = value
+    ...         self._needs = set(needs)
+    ...     def test(self, node):
+    ...         return self._value
+    ...     @property
+    ...     def needs(self):
+    ...         return self._needs
+    >>> yes, no, unknown = Const(True), Const(False), Const(True, [STATE])
+    >>> (yes & unknown).check(None, set()), (no & unknown).check(None, set())
+    (None, False)
+    >>> (yes | unknown).check(None, set()), (no | unknown).check(None, set())
+    (True, None)
+    >>> (~unknown).check(None, set()), (~unknown).check(None, set([STATE]))
+    (None, False)
+    >>> Predicate().check(None, set())
+    True
+    '''
+    def __and__(self, other):
+        return And(self, other)
+
+    def __or__(self, other):
+        return Or(self, other)
+
+    def __invert__(self):
+        return Not(self)
+
+    def check(self, node, fetched):
+        '''Check the predicate against a node.
+
+        @param node The node to check.
+        @param fetched The set of remote data kinds (@ref STATE, @ref PORTS,
+                       @ref CONNECTIONS) that have been fetched for the node.
+        @return True, False, or None if the result depends on data that has
+                not been fetched.
+
+        '''
+        if not self.needs.issubset(fetched):
+            return None
+        return self.test(node)
+
+    def index_criteria(self):
+        '''Criteria that an index can be used to satisfy.
+
+        @return A dictionary suitable for @ref ComponentIndex.query that every
+                node matching this predicate also matches, or None if this
+                predicate cannot use an index.
+
+        '''
+        return None
+
+    def test(self, node):
+        '''Test the predicate against a node.
+
+        All data the predicate needs must be available.
+
+        '''
+        return True
+
+    @property
+    def needs(self):
+        '''The set of remote data kinds this predicate needs.'''
+        return set()
+
+
+class And(Predicate):
+    '''All of the predicates must be True.'''
+    def __init__(self, *preds):
+        self._preds = preds
+
+    def check(self, node, fetched):
+        result = True
+        for p in self._preds:
+            r = p.check(node, fetched)
+            if r is False:
+                return False
+            elif r is None:
+                result = None
+        return result
+
+    def index_criteria(self):
+        criteria = {}
+        for p in self._preds:
+            c = p.index_criteria()
+            if c:
+                criteria.update(c)
+        return criteria or None
+
+    def test(self, node):
+        return all(p.test(node) for p in self._preds)
+
+    @property
+    def needs(self):
+        return set().union(*[p.needs for p in self._preds])
+
+
+class Or(Predicate):
+    '''At least one of the predicates must be True.'''
+    def __init__(self, *preds):
+        self._preds = preds
+
+    def check(self, node, fetched):
+        result = False
+        for p in self._preds:
+            r = p.check(node, fetched)
+            if r is True:
+                return True
+            elif r is None:
+                result = None
+        return result
+
+    def test(self, node):
+        return any(p.test(node) for p in self._preds)
+
+    @property
+    def needs(self):
+        return set().union(*[p.needs for p in self._preds])
+
+
+class Not(Predicate):
+    '''The predicate must be False.'''
+    def __init__(self, pred):
+        self._pred = pred
+
+    def check(self, node, fetched):
+        r = self._pred.check(node, fetched)
+        if r is None:
+            return None
+        return not r
+
+    def test(self, node):
+        return not self._pred.test(node)
+
+    @property
+    def needs(self):
+        return self._pred.needs
+
+
+class Kind(Predicate):
+    '''The node must be one of the given kinds.
+
+    Valid kinds are 'component', 'manager', 'directory', 'nameserver',
+    'zombie' and 'unknown'.
+
+    '''
+    def __init__(self, *kinds):
+        self._kinds = kinds
+
+    def test(self, node):
+        for k in self._kinds:
+            if getattr(node, 'is_' + k):
+                return True
+        return False
+
+
+class Path(Predicate):
+    '''The node's full path must match a shell-style wildcard pattern.
+
+    For example, '/localhost/*/Motor*.rtc'.
+
+    '''
+    def __init__(self, pattern):
+        self._pattern = pattern
+
+    def test(self, node):
+        return fnmatch.fnmatchcase(node.full_path_str, self._pattern)
+
+
+class Field(Predicate):
+    '''The node must be a component with the given value for a profile field.
+
+    Fields are specified as for @ref ComponentIndex. If more than one value is
+    given, any of them matches.
+
+    '''
+    def __init__(self, field, *values):
+        self._field = field
+        self._values = list(values)
+
+    def index_criteria(self):
+        return {self._field: self._values}
+
+    def test(self, node):
+        if not node.is_component:
+            return False
+        return index.matches(node, {self._field: self._values})
+
+
+class State(Predicate):
+    '''The node must be a component in one of the given states.
+
+    States are the state constants of the Component class, such as
+    Component.ACTIVE.
+
+    '''
+    def __init__(self, *states):
+        self._states = states
+
+    def test(self, node):
+        if not node.is_component:
+            return False
+        return node.state in self._states
+
+    @property
+    def needs(self):
+        return set([STATE])
+
+
+class HasPort(Predicate):
+    '''The node must be a component with a port matching the given name and
+    type.
+
+    @param name The name of the port. If None, any name matches.
+    @param porttype The type of the port, e.g. 'DataInPort'. If None, any
+                    type matches.
+
+    '''
+    def __init__(self, name=None, porttype=None):
+        self._name = name
+        self._porttype = porttype
+
+    def test(self, node):
+        if not node.is_component:
+            return False
+        for p in node.ports:
+            if _port_matches(p, self._name, self._porttype):
+                return True
+        return False
+
+    @property
+    def needs(self):
+        return set([PORTS])
+
+
+class Connected(Predicate):
+    '''The node must be a component with a connected port matching the given
+    name and type.
+
+    @param name The name of the port. If None, any name matches.
+    @param porttype The type of the port, e.g. 'DataInPort'. If None, any
+                    type matches.
+
+    '''
+    def __init__(self, name=None, porttype=None):
+        self._name = name
+        self._porttype = porttype
+
+    def test(self, node):
+        if not node.is_component:
+            return False
+        for p in node.ports:
+            if _port_matches(p, self._name, self._porttype) and \
+                    p.is_connected:
+                return True
+        return False
+
+    @property
+    def needs(self):
+        return set([PORTS, CONNECTIONS])
+
+
+##############################################################################
+## Query object
+
+class Query(object):
+    '''A query over the nodes of a tree.'''
+    def __init__(self, where=None, select=None, *args, **kwargs):
+        '''Constructor.
+
+        @param where The predicate nodes must match. If None, all nodes
+                     match.
+        @param select A list of fields to select from each matching node. A
+                      field is the name of a node property (e.g.
+                      'full_path_str', 'state', 'type_name') or a component
+                      property prefixed with 'properties.'. If None, the
+                      matching nodes themselves are returned.
+
+        '''
+        super(Query, self).__init__(*args, **kwargs)
+        self._where = where
+        self._select = select
+
+    def execute(self, target, max_workers=None):
+        '''Execute the query.
+
+        @param target The RTCTree or node to search. If a node is given, it
+                      and the nodes below it are searched.
+        @param max_workers The maximum number of remote calls to make at once.
+                           If None, the 'max_workers' option is used.
+        @return A list of the matching nodes, or a list of dictionaries
+                mapping the selected fields to their values, in path order.
+
+        '''
+        candidates = self._candidates(target)
+        failed = set()
+        if self._where:
+            fetched = set()
+            matched = []
+            while candidates:
+                undecided = []
+                for n in candidates:
+                    r = self._where.check(n, fetched)
+                    if r is True:
+                        matched.append(n)
+                    elif r is None:
+                        undecided.append(n)
+                needed = [k for k in FETCH_ORDER \
+                        if k in self._where.needs and k not in fetched]
+                if not undecided or not needed:
+                    break
+                # Fetch the next kind of data for the undecided nodes only.
+                # Nodes that cannot be reached do not match.
+                failed = _fetch(undecided, needed[0], max_workers)
+                fetched.add(needed[0])
+                candidates = [n for n in undecided if n not in failed]
+            candidates = sorted(matched, key=lambda n: n.full_path_str)
+        if self._select is None:
+            return candidates
+        return _project(candidates, self._select, max_workers)
+
+    def _candidates(self, target):
+        # Use an index to get the candidate nodes if possible.
+        tree_index = getattr(target, 'index', None)
+        if self._where and tree_index is not None:
+            criteria = self._where.index_criteria()
+            if criteria and \
+                    [f for f in criteria if f in tree_index.fields]:
+                return tree_index.query(criteria)
+        if hasattr(target, 'get_node') and hasattr(target, 'index'):
+            # An RTCTree
+            target = target.get_node(['/'])
+        return utils.unique_nodes(target.iterate(lambda n, args: n))
+
+
+##############################################################################
+## Internal functions
+
+def _fetch(nodes, kind, max_workers):
+    # Fetch a kind of remote data for many nodes concurrently. Returns the set
+    # of nodes for which the data could not be fetched.
+    if kind == STATE:
+        return fetch_component_states([n for n in nodes if n.is_component],
+                max_workers=max_workers)
+
+    def fetch_one(n):
+        if not n.is_component:
+            return
+        if kind == PORTS:
+            n.ports
+        elif kind == CONNECTIONS:
+            for p in n.ports:
+                p.connections
+    results = utils.parallel_map(fetch_one, nodes, max_workers=max_workers,
+            return_exceptions=True)
+    return set([n for n, r in zip(nodes, results) if isinstance(r, Exception)])
+
+
+def _field_needs(field):
+    # The remote data needed to read a selected field.
+    if 'state' in field:
+        return STATE
+    elif field.startswith('connected_'):
+        return CONNECTIONS
+    elif 'ports' in field:
+        return PORTS
+    return None
+
+
+def _get(node, field):
+    # Get a selected field from a node.
+    try:
+        if field.startswith('properties.'):
+            if not node.is_component:
+                return None
+            return index.get_field(node, field)
+        return getattr(node, field)
+    except (AttributeError, KeyError):
+        return None
+
+
+def _port_matches(port, name, porttype):
+    if name is not None and port.name != name:
+        return False
+    if porttype is not None and port.porttype != porttype:
+        return False
+    return True
+
+
+def _project(nodes, fields, max_workers):
+    # Fetch the data needed by the selected fields, then read them. Fields
+    # needing data that could not be fetched for a node are None.
+    kinds = set([_field_needs(f) for f in fields])
+    if CONNECTIONS in kinds:
+        kinds.add(PORTS)
+    failed = set()
+    for k in FETCH_ORDER:
+        if k in kinds:
+            failed |= _fetch([n for n in nodes if n not in failed], k,
+                    max_workers)
+    result = []
+    for n in nodes:
+        if n in failed:
+            result.append(dict([(f, None if _field_needs(f) else _get(n, f)) \
+                    for f in fields]))
+        else:
+            result.append(dict([(f, _get(n, f)) for f in fields]))
+    return result
+
+
+# vim: set expandtab tabstop=8 shiftwidth=4 softtabstop=4 textwidth=79
@@ -0,0 +1,241 @@
+# -*- Python -*-
+# -*- coding: utf-8 -*-
+
+'''rtctree
+
+Copyright (C) 2009-2015
+    Geoffrey Biggs
+    RT-Synthesis Research Group
+    Intelligent Systems Research Institute,
+    National Institute of Advanced Industrial Science and Technology (AIST),
+    Japan
+    All rights reserved.
+Licensed under the GNU Lesser General Public License version 3.
+http://www.gnu.org/licenses/lgpl-3.0.en.html
+
+Recording and replay of observer events.
+
+While a tree is recording, every status update its components' observers
+receive is appended to a binary log with its time stamp and the path of the
+component. A recording can be replayed into a tree, where the updates are
+handled exactly as if the observers had received them, or into an event bus,
+at the recorded speed or faster. This makes it possible to reproduce the
+order of events seen on a live system, and to measure how fast tools handle
+events, without the system.
+
+'''
+
+
+import collections
+import struct
+import threading
+import time
+
+from rtctree import events
+from rtctree import exceptions
+from rtctree import sdo
+
+
+# The first bytes of a recording
+MAGIC = b'RTCEVT\x00\x01'
+
+# Each event is this header followed by the component's path, the kind of
+# status and the hint, encoded as UTF-8
+_HEADER = struct.Struct('!dHHI')
+
+
+# An event read from a recording
+RecordedEvent = collections.namedtuple('RecordedEvent',
+        ['time', 'path', 'kind', 'hint'])
+
+
+##############################################################################
+## API functions
+
+def read_events(path):
+    '''Read the events in a recording.
+
+    An event cut short at the end of the file, such as by the recording
+    process dying, is ignored.
+
+    @param path The path of the recording.
+    @return An iterator of RecordedEvent objects, in the order they were
+            recorded. The path of each event is a string.
+    @raises BadRecordingError
+
+    '''
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise exceptions.BadRecordingError(path,
+                    'not an event recording')
+        while True:
+            head = f.read(_HEADER.size)
+            if len(head) < _HEADER.size:
+                return
+            ts, path_len, kind_len, hint_len = _HEADER.unpack(head)
+            body = f.read(path_len + kind_len + hint_len)
+            if len(body) < path_len + kind_len + hint_len:
+                return
+            yield RecordedEvent(ts, body[:path_len].decode('utf-8'),
+                    body[path_len:path_len + kind_len].decode('utf-8'),
+                    body[path_len + kind_len:].decode('utf-8'))
+
+
+def replay(path, tree=None, bus=None, speed=1.0):
+    '''Replay a recording into a tree or an event bus.
+
+    When replaying into a tree, each event is given to the component at the
+    recorded path as if its observer had received it, so the tree's nodes
+    change, and its callbacks, listeners and subscribers are called, as they
+    were when the events were recorded. Events for components not in the
+    tree are skipped.
+
+    When replaying into an event bus, each event is published as a
+    ChangeRecord of kind rtctree.events.OBSERVER, with the recorded time, the
+    component's path and a value of the (kind, hint) tuple the observer
+    received. No node is given.
+
+    @param path The path of the recording.
+    @param tree The RTCTree to replay the events into.
+    @param bus The rtctree.events.EventBus to replay the events into. A bus
+               created for the replay can be used to measure the throughput
+               of subscribers without a tree.
+    @param speed How many times faster than recorded to replay the events,
+                 or None to replay them as fast as possible.
+    @return A tuple of the number of events replayed and the time taken, in
+            seconds.
+    @raises BadRecordingError
+
+    '''
+    observers = {}
+    count = 0
+    start = time.time()
+    first = None
+    for ev in read_events(path):
+        if speed:
+            if first is None:
+                first = ev.time
+            delay = start + (ev.time - first) / speed - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        node_path = ['/'] + [p for p in ev.path.split('/') if p]
+        if tree is not None:
+            obs = observers.get(ev.path)
+            if obs is None:
+                if not tree.has_path(node_path):
+                    continue
+                comp = tree.get_node(node_path)
+                if not comp.is_component:
+                    continue
+                obs = observers[ev.path] = sdo.RTCObserver(comp)
+            obs._update(ev.kind, ev.hint)
+        if bus is not None:
+            bus.publish_record(events.ChangeRecord(events.OBSERVER,
+                node_path, None, (ev.kind, ev.hint), ev.time))
+        count += 1
+    return count, time.time() - start
+
+
+##############################################################################
+## Recorder object
+
+class EventRecorder(object):
+    '''Appends observer events to a recording.
+
+    If the file already holds a recording, the new events are added to the
+    end of it.
+
+    Do not create EventRecorder objects directly. Call
+    @ref RTCTree.record_events.
+
+    Example:
+    >>> import os, shutil, tempfile
+    >>> from rtctree.events import EventBus
+    >>> from rtctree.node import TreeNode
+    >>> comp = TreeNode('c0.rtc', TreeNode('/'))
+    >>> d = tempfile.mkdtemp()
+    >>> path = os.path.join(d, 'events.rec')
+    >>> rec = EventRecorder(path)
+    >>> rec.record(comp, 'RTC_STATUS', 'ACTIVE:0')
+    >>> rec.record(comp, 'EC_STATUS', 'ATTACHED:1')
+    >>> rec.close()
+    >>> for e in read_events(path):
+    ...     print(' '.join([e.path, e.kind, e.hint]))
+    /c0.rtc RTC_STATUS ACTIVE:0
+    /c0.rtc EC_STATUS ATTACHED:1
+    >>> bus = EventBus()
+    >>> sub = bus.subscribe()
+    >>> replay(path, bus=bus, speed=None)[0]
+    2
+    >>> sub.get(0)
+    ChangeRecord('observer', '/c0.rtc', ('RTC_STATUS', 'ACTIVE:0'))
+    >>> sub.get(0).value
+    ('EC_STATUS', 'ATTACHED:1')
+    >>> shutil.rmtree(d)
+    '''
+    def __init__(self, path, *args, **kwargs):
+        '''Constructor.
+
+        @param path The path of the recording.
+        @raises BadRecordingError
+
+        '''
+        super(EventRecorder, self).__init__(*args, **kwargs)
+        self._path = path
+        self._mutex = threading.Lock()
+        self._count = 0
+        self._file = open(path, 'ab+')
+        self._file.seek(0)
+        head = self._file.read(len(MAGIC))
+        if not head:
+            self._file.write(MAGIC)
+        elif head != MAGIC:
+            self._file.close()
+            raise exceptions.BadRecordingError(path,
+                    'not an event recording')
+        self._file.flush()
+
+    def __len__(self):
+        with self._mutex:
+            return self._count
+
+    def close(self):
+        '''Stop recording and close the file.'''
+        with self._mutex:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    @property
+    def path(self):
+        '''The path of the recording.'''
+        return self._path
+
+    def record(self, comp, kind, hint, when=None):
+        '''Record a status update received by a component's observer.
+
+        This is called from the ORB's threads.
+
+        @param comp The component.
+        @param kind The kind of status.
+        @param hint The hint sent with the update.
+        @param when The time the update was received, or None for now.
+
+        '''
+        path = events._path(comp)
+        path = ('/' + '/'.join(path[1:])).encode('utf-8')
+        kind = kind.encode('utf-8')
+        hint = hint.encode('utf-8')
+        if when is None:
+            when = time.time()
+        data = _HEADER.pack(when, len(path), len(kind), len(hint)) + \
+                path + kind + hint
+        with self._mutex:
+            if self._file is None:
+                return
+            self._file.write(data)
+            self._file.flush()
+            self._count += 1
+
+
+# vim: set expandtab tabstop=8 shiftwidth=4 softtabstop=4 textwidth=79
@@ -0,0 +1,143 @@
+# -*- Python -*-
+# -*- coding: utf-8 -*-
+
+'''rtctree
+
+Copyright (C) 2009-2015
+    Geoffrey Biggs
+    RT-Synthesis Research Group
+    Intelligent Systems Research Institute,
+    National Institute of Advanced Industrial Science and Technology (AIST),
+    Japan
+    All rights reserved.
+Licensed under the GNU Lesser General Public License version 3.
+http://www.gnu.org/licenses/lgpl-3.0.en.html
+
+Background registration of component observers.
+
+Registering an observer with a component takes several remote calls. When a
+dynamic tree is parsed, the components are queued for registration instead,
+and a pool of threads registers them while the tree is being used.
+
+'''
+
+
+from __future__ import print_function
+
+import collections
+import sys
+import threading
+import time
+
+from rtctree.options import Options
+
+
+##############################################################################
+## Registrar object
+
+class ObserverRegistrar(object):
+    '''Registers the observers of queued components in background threads.
+
+    A component whose registration fails is tried again, after a delay that
+    doubles each time, up to the 'observer_retries' option times.
+
+    '''
+    def __init__(self, max_workers=None, retry_delay=0.5, *args, **kwargs):
+        '''Constructor.
+
+        @param max_workers The maximum number of registrations to make at
+                           once. If None, the 'max_workers' option is used.
+        @param retry_delay The time to wait before the first retry of a failed
+                           registration, in seconds.
+
+        '''
+        super(ObserverRegistrar, self).__init__(*args, **kwargs)
+        if max_workers is None:
+            max_workers = Options().get_option('max_workers')
+        self._max_workers = max_workers
+        self._retry_delay = retry_delay
+        self._cond = threading.Condition()
+        self._queue = collections.deque()
+        self._workers = 0
+        self._active = 0
+
+    @property
+    def pending(self):
+        '''The number of components waiting for or undergoing registration.'''
+        with self._cond:
+            return len(self._queue) + self._active
+
+    def submit(self, comp):
+        '''Queue a component for registration.
+
+        The component's _register_observer method is called from a
+        background thread. It returns False if the registration is no longer
+        wanted, and raises an exception if it failed.
+
+        '''
+        with self._cond:
+            self._queue.append(comp)
+            if self._workers < self._max_workers:
+                self._workers += 1
+                t = threading.Thread(target=self._work)
+                t.daemon = True
+                t.start()
+
+    def wait(self, timeout=None):
+        '''Wait until all queued components have been registered or have
+        failed.
+
+        @param timeout The longest time to wait, in seconds, or None to wait
+                       until the queue is empty.
+        @return True if the queue is empty, False if the wait timed out.
+
+        '''
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while self._queue or self._active:
+                if deadline is None:
+                    self._cond.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+            return True
+
+    def _register(self, comp):
+        # Register a component's observer, retrying if it fails.
+        retries = Options().get_option('observer_retries')
+        delay = self._retry_delay
+        for attempt in range(retries + 1):
+            try:
+                comp._register_observer()
+                return
+            except Exception as e:
+                if attempt == retries:
+                    comp._observer_failed()
+                    print('{0}: Failed to register observer for {1}: '\
+                            '{2}'.format(sys.argv[0], comp.name, e),
+                            file=sys.stderr)
+                    return
+            time.sleep(delay)
+            delay *= 2
+
+    def _work(self):
+        # Register queued components until the queue is empty.
+        while True:
+            with self._cond:
+                if not self._queue:
+                    self._workers -= 1
+                    self._cond.notify_all()
+                    return
+                comp = self._queue.popleft()
+                self._active += 1
+            try:
+                self._register(comp)
+            finally:
+                with self._cond:
+                    self._active -= 1
+                    self._cond.notify_all()
+
+
+# vim: set expandtab tabstop=8 shiftwidth=4 softtabstop=4 textwidth=79
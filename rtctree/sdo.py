@@ -18,16 +18,128 @@ SDO client objects.
 '''
 
 
+from __future__ import print_function
+
+import struct
+import sys
+import time
+
 from rtctree.rtc import OpenRTM__POA
 from rtctree.rtc import RTC__POA
 
 
+class ObserverProfile(object):
+    '''The notifications sent to the observer of a dynamic component.
+
+    Choosing only the kinds of status a client needs reduces the traffic
+    from each component. A component's observer can be changed to a new
+    profile at any time, without creating a new observer.
+
+    Example:
+    >>> p = ObserverProfile(['RTC_STATUS'], heartbeat=None,
+    ...         rtc_heartbeat=None, ec_heartbeat=2.0)
+    >>> p.properties()['observed_status']
+    'RTC_STATUS,EC_HEARTBEAT'
+    >>> p.properties()['ec_heartbeat.interval']
+    '2.0'
+    >>> p.properties()['rtc_heartbeat.enable']
+    'NO'
+    >>> ObserverProfile().properties()['observed_status']
+    'ALL'
+    '''
+    # The kinds of status that can be observed
+    KINDS = ['COMPONENT_PROFILE', 'RTC_STATUS', 'EC_STATUS', 'PORT_PROFILE',
+            'CONFIGURATION', 'FSM_PROFILE', 'FSM_STATUS', 'FSM_STRUCTURE']
+
+    def __init__(self, kinds=None, heartbeat=1.0, rtc_heartbeat=1.0,
+            ec_heartbeat=1.0):
+        '''Constructor.
+
+        @param kinds A list of the kinds of status to observe, from
+                     @ref KINDS, or None to observe all kinds.
+        @param heartbeat The interval of the component heartbeat sent by
+                         older versions of OpenRTM-aist, in seconds, or None
+                         to disable it.
+        @param rtc_heartbeat The interval of the component heartbeat, in
+                             seconds, or None to disable it.
+        @param ec_heartbeat The interval of the execution context heartbeats,
+                            in seconds, or None to disable them.
+
+        '''
+        if kinds is not None:
+            for k in kinds:
+                if k not in self.KINDS:
+                    raise ValueError(k)
+        self._kinds = None if kinds is None else list(kinds)
+        self._heartbeats = [('heartbeat', 'HEARTBEAT', heartbeat),
+                ('rtc_heartbeat', 'RTC_HEARTBEAT', rtc_heartbeat),
+                ('ec_heartbeat', 'EC_HEARTBEAT', ec_heartbeat)]
+
+    def __eq__(self, other):
+        return isinstance(other, ObserverProfile) and \
+                self.properties() == other.properties()
+
+    def __ne__(self, other):
+        return not self == other
+
+    @property
+    def ec_heartbeat(self):
+        '''The interval of the execution context heartbeats, or None.'''
+        return self._heartbeats[2][2]
+
+    @property
+    def kinds(self):
+        '''The kinds of status observed, or None for all kinds.'''
+        return self._kinds
+
+    def properties(self):
+        '''Get the service profile properties that select the notifications.
+
+        @return A dictionary of properties.
+
+        '''
+        result = {}
+        if self._kinds is None:
+            result['observed_status'] = 'ALL'
+            status = None
+        else:
+            status = list(self._kinds)
+        for name, kind, interval in self._heartbeats:
+            if interval is None:
+                result[name + '.enable'] = 'NO'
+            else:
+                result[name + '.enable'] = 'YES'
+                result[name + '.interval'] = str(float(interval))
+                if status is not None:
+                    status.append(kind)
+        if status is not None:
+            result['observed_status'] = ','.join(status)
+        return result
+
+
 class RTCObserver(RTC__POA.ComponentObserver):
     def __init__(self, target):
         self._tgt = target
 
     def update_status(self, kind, hint):
         kind = str(kind)
+        # Updates are recorded as they arrive, before they are handled, so
+        # the recording keeps their order and includes updates whose
+        # handling fails. The recording can be stopped by another thread at
+        # any time.
+        tree = self._tgt.tree
+        rec = None if tree is None else tree._recorder
+        if rec is not None:
+            try:
+                rec.record(self._tgt, kind, hint, time.time())
+            except (IOError, OSError, struct.error) as e:
+                print('{0}: Failed to record event for {1}: {2}'.format(
+                    sys.argv[0], self._tgt.name, e), file=sys.stderr)
+        self._update(kind, hint)
+
+    def _update(self, kind, hint):
+        # Apply a status update to the target. Replayed updates (see
+        # rtctree.recorder) are applied here so they are not recorded again.
         if kind == 'COMPONENT_PROFILE':
             self._tgt._profile_update([x.strip() for x in hint.split(',')])
         elif kind == 'RTC_STATUS':
@@ -79,7 +191,7 @@ class RTCObserver(RTC__POA.ComponentObserver):
                 event = self._tgt.CFG_ACTIVATE_SET
             self._tgt._config_event(arg, event)
         elif kind == 'HEARTBEAT' or kind == 'RTC_HEARTBEAT' or kind == 'EC_HEARTBEAT':
-            self._tgt._heartbeat(kind)
+            self._tgt._heartbeat(kind, hint)
         elif kind == 'FSM_PROFILE' or kind == 'FSM_STATUS' or kind == 'FSM_STRUCTURE':
             self._tgt._fsm_event(kind, hint)
 
@@ -87,11 +199,17 @@ class RTCObserver(RTC__POA.ComponentObserver):
 class RTCLogger(OpenRTM__POA.Logger):
     def __init__(self, target, callback):
         self._tgt = target
+        self._name = target.name
         self._cb = callback
 
     def publish(self, record):
         ts = record.time.sec + record.time.nsec / 1e9
-        self._cb(self._tgt.name, ts, loggername, level, message)
+        self._cb(self._name, ts, record.loggername, str(record.level),
+                record.message)
+
+    def close(self):
+        # The component is finalising; it will publish no more records.
+        pass
 
 
 # vim: set expandtab tabstop=8 shiftwidth=4 softtabstop=4 textwidth=79
@@ -0,0 +1,358 @@
+# -*- Python -*-
+# -*- coding: utf-8 -*-
+
+'''rtctree
+
+Copyright (C) 2009-2015
+    Geoffrey Biggs
+    RT-Synthesis Research Group
+    Intelligent Systems Research Institute,
+    National Institute of Advanced Industrial Science and Technology (AIST),
+    Japan
+    All rights reserved.
+Licensed under the GNU Lesser General Public License version 3.
+http://www.gnu.org/licenses/lgpl-3.0.en.html
+
+Saving and loading snapshots of a tree.
+
+A snapshot stores the names, kinds and object references of the nodes in a
+tree, the profiles of the components, and their ports and connections. Loading
+a snapshot rebuilds the tree without contacting the name servers or the
+components, so tools started one after another can skip the cost of parsing
+the name servers each time. Because the system may have changed since the
+snapshot was saved, a loaded tree should be validated against the name
+servers; see @ref validate.
+
+Snapshots are a cache, not an interchange format. They are only readable by
+the same version of rtctree and the same major version of Python that wrote
+them.
+
+Example:
+>>> import os, shutil, tempfile
+>>> class Tree(object):
+...     orb = None
+...     dynamic = False
+...     def __init__(self):
+...         self.root = TreeNode('/')
+...     def get_node(self, path):
+...         return self.root.get_node(path)
+>>> tree = Tree()
+>>> ns = TreeNode('localhost', tree.root)
+>>> tree.root._add_child(ns)
+>>> ns._add_child(Zombie('dead.rtc', ns))
+>>> d = tempfile.mkdtemp()
+>>> path = os.path.join(d, 'tree.snap')
+>>> save(tree, path, fetch_ports=False)
+>>> loaded = Tree()
+>>> load(loaded, path) > 0
+True
+>>> dead = loaded.get_node(['/', 'localhost', 'dead.rtc'])
+>>> dead.full_path_str, dead.is_zombie
+('/localhost/dead.rtc', True)
+
+A snapshot written by another version is rejected:
+>>> with open(path, 'rb') as f:
+...     data = f.read()
+>>> with open(path, 'wb') as f:
+...     _ = f.write(_HEADER.pack(MAGIC, FORMAT_VERSION + 1,
+...             sys.version_info[0]) + data[_HEADER.size:])
+>>> try:
+...     load(Tree(), path)
+... except exceptions.BadSnapshotError as e:
+...     print(e.args[1])
+incompatible version
+>>> shutil.rmtree(d)
+
+'''
+
+
+import marshal
+import struct
+import sys
+import time
+import zlib
+
+from rtctree import exceptions
+from rtctree import utils
+from rtctree.component import Component
+from rtctree.directory import Directory, corba_name_to_string
+from rtctree.manager import Manager
+from rtctree.nameserver import NameServer
+from rtctree.node import SharedNode, TreeNode, shared_node
+from rtctree.unknown import Unknown
+from rtctree.zombie import Zombie
+
+
+# Identifies snapshot files
+MAGIC = b'RTCTSNAP'
+# Changed whenever the structure of the snapshot data changes
+FORMAT_VERSION = 2
+_HEADER = struct.Struct('>8sHH')
+
+
+##############################################################################
+## API functions
+
+def save(tree, path, fetch_ports=True, max_workers=None):
+    '''Save a snapshot of a tree to a file.
+
+    @param tree The RTCTree to save.
+    @param path The path of the file to write.
+    @param fetch_ports If True, the ports and connections of components that
+                       have not yet been retrieved are retrieved before saving
+                       (concurrently). If False, only those already known are
+                       saved, and the others will be retrieved when first
+                       used after loading.
+    @param max_workers The maximum number of remote calls to make at once.
+
+    '''
+    root = tree.get_node(['/'])
+    if fetch_ports:
+        comps = utils.unique_nodes(root.iterate(lambda n, args: n,
+            filter=['is_component']))
+        utils.parallel_map(_fetch_ports, comps, max_workers=max_workers,
+                return_exceptions=True)
+    data = {'created': time.time(),
+            'root': _dump_node(root, tree.orb)}
+    with open(path, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, sys.version_info[0]))
+        f.write(zlib.compress(marshal.dumps(data)))
+
+
+def load(tree, path):
+    '''Load the nodes stored in a snapshot file into a tree.
+
+    The nodes are created without contacting the remote objects. Name servers
+    already in the tree are not replaced.
+
+    @param tree The RTCTree to load the nodes into.
+    @param path The path of the snapshot file.
+    @return The time the snapshot was created.
+    @raises BadSnapshotError
+
+    '''
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(_HEADER.size)
+            if len(header) != _HEADER.size:
+                raise exceptions.BadSnapshotError(path, 'truncated file')
+            magic, version, py_version = _HEADER.unpack(header)
+            if magic != MAGIC:
+                raise exceptions.BadSnapshotError(path, 'not a snapshot')
+            if version != FORMAT_VERSION or py_version != sys.version_info[0]:
+                raise exceptions.BadSnapshotError(path, 'incompatible version')
+            data = marshal.loads(zlib.decompress(f.read()))
+    except (IOError, EOFError, ValueError, TypeError, zlib.error) as e:
+        raise exceptions.BadSnapshotError(path, str(e))
+    root = tree.get_node(['/'])
+    refs = []
+    for ns_data in data['root']['children']:
+        if ns_data['name'] in root.children_names:
+            continue
+        root._add_child(_load_node(ns_data, root, tree.orb, tree.dynamic,
+            refs))
+    for c in root.iterate(lambda n, args: n, filter=['is_component']):
+        if c.parent is not None:
+            tree._identities.register(c.object, c, c.parent)
+    # Components held by more than one node are stored once, and referred to
+    # from the other nodes by path
+    for holder, path in refs:
+        c = tree.get_node(path)
+        if c is not None and c.is_component:
+            tree._identities.register(c.object, c, holder)
+            holder._add_child(SharedNode(c.name, holder, c))
+    return data['created']
+
+
+def validate(tree, max_workers=None):
+    '''Validate the nodes of a tree against the name servers.
+
+    This is intended for trees loaded from a snapshot. Each naming context is
+    listed and compared to the tree; contexts that have changed are reparsed.
+    Each object in the tree is then checked for existence, concurrently, and
+    nodes for objects that no longer exist are replaced by zombies.
+
+    @param tree The RTCTree to validate.
+    @param max_workers The maximum number of remote calls to make at once.
+
+    '''
+    root = tree.get_node(['/'])
+    dirs = root.iterate(lambda n, args: n,
+            filter=[lambda n: n.is_directory and not n.is_manager \
+                    and n.parent is not None])
+    changed = utils.parallel_map(_context_changed, dirs,
+            max_workers=max_workers, return_exceptions=True)
+    for d, c in zip(dirs, changed):
+        # Reparsing a context replaces the nodes below it, so skip contexts
+        # that have been replaced by the reparse of an ancestor
+        if c is True and _in_tree(d, root):
+            d.reparse()
+    objs = utils.unique_nodes(root.iterate(lambda n, args: n,
+            filter=[lambda n: n.is_component or n.is_manager or n.is_unknown]))
+    exists = utils.parallel_map(_exists, objs, max_workers=max_workers,
+            return_exceptions=True)
+    for n, e in zip(objs, exists):
+        if e is not True and n.parent is not None:
+            n = shared_node(n)
+            for holder in tree._identities.holders(n) or [n.parent]:
+                holder._add_child(Zombie(n.name, holder))
+
+
+##############################################################################
+## Internal functions
+
+def _context_changed(d):
+    # Check if the bindings in a naming context differ from the node's
+    # children.
+    names = set()
+    bindings, bindings_it = d.context.list(0)
+    if bindings_it:
+        while True:
+            remaining, bindings = bindings_it.next_n(100)
+            for b in bindings:
+                names.add(corba_name_to_string(b.binding_name))
+            if not remaining:
+                break
+        bindings_it.destroy()
+    return names != set(d.children_names)
+
+
+def _in_tree(node, root):
+    # Check if a node is still reachable from the root of its tree.
+    while node is not root:
+        parent = node.parent
+        if parent is None or \
+                parent._children.get(node.name) is not node:
+            return False
+        node = parent
+    return True
+
+
+def _dump_connection(conn, orb):
+    return {'name': conn.name,
+            'id': conn.id,
+            'properties': _plain(conn.properties),
+            'ports': [orb.object_to_string(p) for p in conn._obj.ports]}
+
+
+def _dump_node(node, orb):
+    # Convert a node and its children into plain data.
+    data = {'name': node.name}
+    if node.is_nameserver:
+        data['kind'] = 'nameserver'
+        data['ior'] = orb.object_to_string(node.context)
+    elif node.is_manager:
+        data['kind'] = 'manager'
+        data['ior'] = orb.object_to_string(node.object)
+    elif node.is_directory and node.parent is not None:
+        data['kind'] = 'directory'
+        data['ior'] = orb.object_to_string(node.context)
+    elif node.is_component:
+        data['kind'] = 'component'
+        data['ior'] = orb.object_to_string(node.object)
+        data['profile'] = {'instance_name': node.instance_name,
+                'type_name': node.type_name,
+                'description': node.description,
+                'version': node.version,
+                'vendor': node.vendor,
+                'category': node.category,
+                'parent_object': node.parent_object,
+                'properties': _plain(node.properties)}
+        data['ports'] = _dump_ports(node, orb)
+    elif node.is_zombie:
+        data['kind'] = 'zombie'
+    elif node.is_unknown:
+        data['kind'] = 'unknown'
+        data['ior'] = orb.object_to_string(node.object)
+    else:
+        data['kind'] = 'node'
+    if node.is_component:
+        data['children'] = []
+    else:
+        data['children'] = [_dump_ref(c) if isinstance(c, SharedNode) \
+                else _dump_node(c, orb) for c in node.children]
+    return data
+
+
+def _dump_ref(node):
+    # A reference to a node whose parent is elsewhere in the tree.
+    return {'name': node.name, 'kind': 'ref',
+            'path': shared_node(node).full_path,
+            'children': []}
+
+
+def _dump_ports(comp, orb):
+    # Dump the ports of a component if they have been retrieved.
+    with comp._mutex:
+        if comp._ports is None:
+            return None
+        result = []
+        for p in comp._ports:
+            with p._mutex:
+                conns = p._connections
+            result.append({'name': p.name,
+                    'porttype': p.porttype,
+                    'ior': orb.object_to_string(p.object),
+                    'properties': _plain(p.properties),
+                    'connections': None if conns is None else \
+                            [_dump_connection(c, orb) for c in conns]})
+        return result
+
+
+def _exists(node):
+    return not node.object._non_existent()
+
+
+def _fetch_ports(comp):
+    for p in comp.ports:
+        p.connections
+
+
+def _load_node(data, parent, orb, dynamic, refs):
+    # Create a node and its children from plain data. References to nodes
+    # elsewhere in the tree are added to refs, to be resolved once the whole
+    # tree is loaded.
+    kind = data['kind']
+    if kind == 'zombie':
+        return Zombie(data['name'], parent)
+    cls = {'nameserver': NameServer, 'directory': Directory,
+            'manager': Manager, 'component': Component,
+            'unknown': Unknown}.get(kind, TreeNode)
+    # Components register their observers once they have been restored
+    node = _new_node(cls, data['name'], parent,
+            dynamic and cls is not Component)
+    if cls is not TreeNode:
+        node._restore(data, orb)
+    for c in data['children']:
+        if c['kind'] == 'ref':
+            refs.append((node, c['path']))
+        else:
+            node._add_child(_load_node(c, node, orb, dynamic, refs))
+    if dynamic and cls is Component:
+        node.dynamic = True
+    return node
+
+
+def _new_node(cls, name, parent, dynamic):
+    # Create a node object without parsing its remote object.
+    node = cls.__new__(cls)
+    TreeNode.__init__(node, name=name, parent=parent, dynamic=dynamic)
+    return node
+
+
+def _plain(d):
+    # Keep only the values of a dictionary that can be stored in a snapshot.
+    plain_types = (str, bytes, int, float, bool, type(None), type(u''))
+    if sys.version_info[0] < 3:
+        plain_types += (long,)
+    result = {}
+    for k, v in d.items():
+        if isinstance(v, plain_types):
+            result[k] = v
+        elif isinstance(v, (list, tuple)) and \
+                all(isinstance(x, plain_types) for x in v):
+            result[k] = list(v)
+    return result
+
+
+# vim: set expandtab tabstop=8 shiftwidth=4 softtabstop=4 textwidth=79
@@ -0,0 +1,172 @@
+# -*- Python -*-
+# -*- coding: utf-8 -*-
+
+'''rtctree
+
+Copyright (C) 2009-2015
+    Geoffrey Biggs
+    RT-Synthesis Research Group
+    Intelligent Systems Research Institute,
+    National Institute of Advanced Industrial Science and Technology (AIST),
+    Japan
+    All rights reserved.
+Licensed under the GNU Lesser General Public License version 3.
+http://www.gnu.org/licenses/lgpl-3.0.en.html
+
+Batched configuration changes across many components.
+
+'''
+
+
+import threading
+
+from rtctree import utils
+from rtctree.node import shared_node
+
+
+##############################################################################
+## Configuration transaction object
+
+class ConfigTransaction(object):
+    '''Collects configuration changes to many components and applies them
+    together.
+
+    Parameter changes are collected with @ref set and configuration set
+    activations with @ref activate. Nothing is sent until @ref commit is
+    called. The changes to each configuration set of a component are then
+    sent in one call, and the components are updated concurrently. The
+    activations are made only after all the parameter changes have been
+    applied.
+
+    Shared nodes are treated as the nodes they share, so changes made through
+    a shared node and through the node it shares are sent together.
+
+    A transaction can be used as a context manager, in which case it is
+    committed at the end of the with block unless an exception was raised.
+
+    Example:
+    with tree.config_transaction() as txn:
+        for c in comps:
+            txn.set(c, 'default', 'gain', '2.0')
+            txn.set(c, 'default', 'rate', '100')
+            txn.activate(c, 'default')
+
+    '''
+    def __init__(self, max_workers=None, *args, **kwargs):
+        '''Constructor.
+
+        @param max_workers The maximum number of components to update at
+                           once. If None, the 'max_workers' option is used.
+
+        '''
+        super(ConfigTransaction, self).__init__(*args, **kwargs)
+        self._max_workers = max_workers
+        self._mutex = threading.Lock()
+        self._changes = {}
+        self._activations = {}
+        self._order = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+
+    def activate(self, comp, set_name):
+        '''Activate a configuration set of a component when the transaction
+        is committed.
+
+        @param comp The component.
+        @param set_name The name of the configuration set to activate.
+
+        '''
+        comp = shared_node(comp)
+        with self._mutex:
+            self._add_component(comp)
+            self._activations[comp] = set_name
+
+    def commit(self):
+        '''Apply the collected changes.
+
+        First, the configuration sets and parameters of all the components
+        are checked; if any do not exist, nothing is changed. Then the
+        parameter changes are sent, one call per configuration set, to all
+        the components concurrently. If all succeed, the configuration set
+        activations are made concurrently. If any component could not be
+        changed, no sets are activated.
+
+        The collected changes are cleared, even if the check fails, so the
+        transaction can be used again.
+
+        @return A list of (component, result) tuples, one for each component
+                changed, in the order they were first given. The result is
+                None if the component's changes were applied, or the exception
+                raised when applying them.
+        @raises NoSuchConfSetError, NoSuchConfParamError
+
+        '''
+        with self._mutex:
+            changes, self._changes = self._changes, {}
+            activations, self._activations = self._activations, {}
+            comps, self._order = self._order, []
+
+        def check(comp):
+            for set_name, values in changes.get(comp, {}).items():
+                comp._check_conf_set_values(set_name, values)
+            if comp in activations:
+                comp._check_conf_set_values(activations[comp], {})
+
+        def apply(comp):
+            for set_name, values in changes.get(comp, {}).items():
+                comp.set_conf_set_values(set_name, values)
+
+        # Checking fetches the configuration of components that have not been
+        # read yet
+        for r in utils.parallel_map(check, comps,
+                max_workers=self._max_workers, return_exceptions=True):
+            if isinstance(r, Exception):
+                raise r
+        results = utils.parallel_map(apply, comps,
+                max_workers=self._max_workers, return_exceptions=True)
+        if activations and \
+                not [r for r in results if isinstance(r, Exception)]:
+            act_comps = [c for c in comps if c in activations]
+            act_results = utils.parallel_map(
+                    lambda c: c.activate_conf_set(activations[c]), act_comps,
+                    max_workers=self._max_workers, return_exceptions=True)
+            act_results = dict(zip(act_comps, act_results))
+            results = [act_results.get(c, r) for c, r in zip(comps, results)]
+        return list(zip(comps, results))
+
+    @property
+    def pending(self):
+        '''The number of parameter changes and activations not yet
+        committed.'''
+        with self._mutex:
+            return sum([len(v) for sets in self._changes.values() \
+                    for v in sets.values()]) + len(self._activations)
+
+    def set(self, comp, set_name, param, value):
+        '''Set a configuration parameter when the transaction is committed.
+
+        If the same parameter is set more than once, the last value is used.
+
+        @param comp The component.
+        @param set_name The name of the configuration set the parameter is in.
+        @param param The name of the parameter.
+        @param value The new value of the parameter.
+
+        '''
+        comp = shared_node(comp)
+        with self._mutex:
+            self._add_component(comp)
+            sets = self._changes.setdefault(comp, {})
+            sets.setdefault(set_name, {})[param] = value
+
+    def _add_component(self, comp):
+        if comp not in self._changes and comp not in self._activations:
+            self._order.append(comp)
+
+
+# vim: set expandtab tabstop=8 shiftwidth=4 softtabstop=4 textwidth=79
@@ -21,13 +21,33 @@ of name servers, directories, managers and components.
 import copy
 import os
 import sys
+import threading
+import time
+import uuid
+import weakref
 
 from omniORB import CORBA
 
+from rtctree import config_snapshot
+from rtctree import events
 from rtctree import exceptions
+from rtctree import mapped
+from rtctree import recorder
+from rtctree import transaction
 from rtctree import NAMESERVERS_ENV_VAR, ORB_ARGS_ENV_VAR
+from rtctree import snapshot as snapshot_mod
 from rtctree import utils
-from rtctree.node import TreeNode
+from rtctree import wait
+from rtctree.composition import CompositionIndex
+from rtctree.exec_context import ExecutionContextRegistry, \
+        fetch_component_states
+from rtctree.identity import IdentityMap
+from rtctree.index import ComponentIndex, matches
+from rtctree.leases import LeaseLog
+from rtctree.node import SharedNode, TreeNode, shared_node
+from rtctree.query import Query
+from rtctree.registrar import ObserverRegistrar
+from rtctree.sdo import ObserverProfile
 from rtctree.directory import Directory
 from rtctree.nameserver import NameServer
 from rtctree.manager import Manager
@@ -102,7 +122,8 @@ class RTCTree(object):
     -15
     '''
     def __init__(self, servers=None, paths=None, orb=None, filter=[],
-            dynamic=False, *args, **kwargs):
+            dynamic=False, indexes=[], snapshot=None, validate='background',
+            observer_profile=None, *args, **kwargs):
         '''Constructor.
 
         @param servers A list of servers to parse into the tree.
@@ -120,13 +141,53 @@ class RTCTree(object):
                        when a component changes state, an observer can notify
                        RTCTree so that the corresponding object in the tree can
                        be updated. Currently this only affects components.
-        @raises NonRootPathError
+                       The observers are registered in the background; see
+                       @ref wait_for_observers.
+        @param indexes A list of component profile fields to index. See
+                       @ref add_index.
+        @param snapshot The path of a snapshot file saved using
+                        @ref save_snapshot. If given, the tree is loaded from
+                        the snapshot instead of parsing the name servers given
+                        in the environment variable. Name servers given in
+                        @ref servers or @ref paths that are not in the
+                        snapshot are still parsed.
+        @param validate How to validate a tree loaded from a snapshot against
+                        the name servers. If 'background', the tree is
+                        validated in a separate thread and may change while
+                        it is being used. If True, the tree is validated
+                        before the constructor returns. If False, the tree is
+                        not validated; call @ref validate later.
+        @param observer_profile The notifications the observers of dynamic
+                                components receive, as an
+                                rtctree.sdo.ObserverProfile. If None, all
+                                notifications are received. See
+                                @ref observer_profile.
+        @raises NonRootPathError, BadSnapshotError
 
         '''
         super(RTCTree, self).__init__()
         self._root = TreeNode('/', None, dynamic=dynamic)
+        self._root._tree = weakref.ref(self)
+        self._index = None
+        self._listeners = []
+        self._bus = events.EventBus()
+        self._recorder = None
+        self._identities = IdentityMap()
+        self._ecs = ExecutionContextRegistry()
+        self._composition = None
+        # Component -> last known merged state, and state -> count
+        self._states = {}
+        self._state_counts = {}
+        self._observer_profile = observer_profile or ObserverProfile()
+        self._registrar = ObserverRegistrar()
+        for field in indexes:
+            self.add_index(field)
         self._create_orb(orb)
+        self._session = uuid.uuid4().hex
+        self._leases = LeaseLog(self._session, orb=self._orb)
         self._dynamic = dynamic
+        if snapshot:
+            snapshot_mod.load(self, snapshot)
         if servers:
             self._parse_name_servers(servers, filter=filter, dynamic=dynamic)
         if paths:
@@ -144,11 +205,25 @@ class RTCTree(object):
                         self.add_name_server(p[1], filter=filter,
                                 dynamic=dynamic)
             self.load_servers_from_env(filter=filter, dynamic=dynamic)
-        if not servers and not paths:
+        if not servers and not paths and not snapshot:
             self.load_servers_from_env(filter=filter, dynamic=dynamic)
+        if snapshot:
+            if validate == 'background':
+                t = threading.Thread(target=self.validate)
+                t.daemon = True
+                t.start()
+            elif validate:
+                self.validate()
 
     def __del__(self):
-        # Destructor to ensure the ORB shuts down correctly.
+        # Destructor to ensure the ORB shuts down correctly, after removing
+        # any observers and loggers from the components.
+        leases = getattr(self, '_leases', None)
+        if leases is not None and len(leases):
+            try:
+                self.release_observers()
+            except Exception:
+                pass
         if self._orb_is_mine:
             self._orb.shutdown(wait_for_completion=CORBA.FALSE)
             self._orb.destroy()
@@ -176,6 +251,112 @@ class RTCTree(object):
             dynamic = self._dynamic
         self._parse_name_server(server, filter, dynamic=dynamic)
 
+    def add_index(self, field):
+        '''Index the components in the tree by a profile field.
+
+        Indexes are kept up-to-date as nodes are added to and removed from the
+        tree, and when a dynamic component reports that its profile has
+        changed. Use @ref find_components to search the tree using the
+        indexes.
+
+        @param field The profile field to index. This may be one of
+                     instance_name, type_name, description, version, vendor,
+                     category and parent_object, or the name of an entry in
+                     the components' properties dictionaries prefixed with
+                     'properties.' (e.g. 'properties.naming.type').
+
+        '''
+        if self._index is None:
+            self._index = ComponentIndex()
+            for c in self._root.iterate(lambda n, args: n,
+                    filter=['is_component']):
+                self._index.add(c)
+        self._index.add_field(field)
+
+    def add_listener(self, cb):
+        '''Add a function to be called when any node in the tree changes.
+
+        The function is called with the event name, the node and the event
+        value. Events are 'node_added' and 'node_removed', when nodes are
+        added to or removed from the tree (the value is the node they were
+        added to or removed from), and the events of the nodes' own callbacks
+        (see @ref TreeNode.add_callback). For dynamic trees, it will be called
+        from the ORB's threads.
+
+        '''
+        with self._root._mutex:
+            self._listeners.append(cb)
+
+    def ec_statistics(self):
+        '''Get the timing statistics of the execution contexts in the tree.
+
+        Heartbeats are only received from contexts observed by dynamic
+        components. See @ref TimingMonitor.statistics.
+
+        @return A list of (ExecutionContext, statistics) tuples for the
+                contexts that have received heartbeats, with the contexts
+                that missed the most heartbeats first.
+
+        '''
+        result = [(ec, ec.monitor.statistics()) for ec in self._ecs.contexts \
+                if ec.monitor.heartbeats]
+        return sorted(result, key=lambda r: r[1]['missed'], reverse=True)
+
+    def config_transaction(self, max_workers=None):
+        '''Start a transaction to change the configuration of many components.
+
+        See rtctree.transaction.ConfigTransaction.
+
+        @param max_workers The maximum number of components to update at
+                           once.
+        @return A ConfigTransaction object.
+
+        '''
+        return transaction.ConfigTransaction(max_workers=max_workers)
+
+    def fetch_states(self, nodes=None, max_workers=None):
+        '''Fetch the states of many components at once.
+
+        The states are requested from each execution context for all the
+        components in it, concurrently, rather than component by component.
+        Reading the state of the components afterwards does not contact them.
+
+        @param nodes A list of component nodes. If None, all the components
+                     in the tree are used.
+        @param max_workers The maximum number of remote calls to make at once.
+        @return The set of components whose states could not be fetched.
+
+        '''
+        if nodes is None:
+            nodes = self._root.iterate(lambda n, args: n,
+                    filter=['is_component'])
+        return fetch_component_states(nodes, max_workers=max_workers)
+
+    def find_components(self, criteria={}, **kwargs):
+        '''Find the components in the tree matching a set of profile values.
+
+        Example, to find all DataProducer components of type 'Motor':
+        tree.find_components(category='DataProducer', type_name='Motor')
+
+        Indexed fields are searched using the indexes, and the results are
+        combined. Fields that are not indexed are checked on the components
+        found by the indexes. If the tree has no indexes, every component in
+        the tree is checked.
+
+        @param criteria A dictionary mapping fields to values. Use this for
+                        fields that cannot be given as keyword arguments, such
+                        as 'properties.naming.type'.
+        @param kwargs Further field=value criteria.
+        @return A list of the matching component nodes.
+
+        '''
+        criteria = dict(criteria)
+        criteria.update(kwargs)
+        if self._index is not None:
+            return self._index.query(criteria)
+        return utils.unique_nodes(self._root.iterate(lambda n, args: n,
+                filter=['is_component', lambda n: matches(n, criteria)]))
+
     def get_node(self, path):
         '''Get a node by path.
 
@@ -284,6 +465,306 @@ class RTCTree(object):
                          if s]
             self._parse_name_servers(servers, filter, dynamic)
 
+    def query(self, where=None, select=None, max_workers=None):
+        '''Find the nodes in the tree matching a predicate.
+
+        See the rtctree.query module for the available predicates. Remote
+        information needed by the predicates or the selected fields is only
+        fetched for the nodes that need it, and is fetched concurrently.
+
+        Example, to get the paths and states of all components with a
+        connected input port:
+        tree.query(Kind('component') & Connected(porttype='DataInPort'),
+                   select=['full_path_str', 'state'])
+
+        @param where The predicate nodes must match. If None, all nodes match.
+        @param select A list of fields to select from each matching node. If
+                      None, the matching nodes are returned.
+        @param max_workers The maximum number of remote calls to make at once.
+        @return A list of nodes or of dictionaries of selected fields, in path
+                order.
+
+        '''
+        return Query(where, select).execute(self, max_workers=max_workers)
+
+    def load_configuration(self, path, activate=True, max_workers=None):
+        '''Restore the configuration of the components from a file.
+
+        Each component's current configuration is fetched concurrently and
+        compared with the saved one, and only the changed parameters of the
+        changed configuration sets are sent. See
+        rtctree.config_snapshot.load.
+
+        @param path The path of a file written by @ref save_configuration.
+        @param activate If True, the saved active sets are also activated.
+        @param max_workers The maximum number of remote calls to make at once.
+        @return A dictionary mapping the path of each component in the file to
+                the number of configuration sets changed, or to the exception
+                raised when restoring it.
+        @raises BadConfigFileError
+
+        '''
+        return config_snapshot.load(self, path, activate=activate,
+                max_workers=max_workers)
+
+    def record_events(self, path):
+        '''Start recording the status updates received by the observers of
+        the dynamic components.
+
+        The updates are appended to a binary file as they arrive. Replay them
+        with @ref replay_events or rtctree.recorder.replay.
+
+        @param path The path of the recording. If the file holds a recording
+                    already, the new updates are added to it.
+        @return The rtctree.recorder.EventRecorder object.
+        @raises BadRecordingError
+
+        '''
+        rec = recorder.EventRecorder(path)
+        old, self._recorder = self._recorder, rec
+        if old is not None:
+            old.close()
+        return rec
+
+    def release_observers(self, max_workers=None):
+        '''Remove the observers and loggers the tree has registered.
+
+        The observers and loggers of all the components are removed
+        concurrently, and the components stop being dynamic. When all have
+        been removed, the tree's lease file is deleted (see rtctree.leases).
+        This is done automatically when the tree is destroyed; call it
+        before exiting to be sure it is done.
+
+        @param max_workers The maximum number of remote calls to make at once.
+
+        '''
+        comps = utils.unique_nodes(self._root.iterate(lambda n, args: n,
+            filter=['is_component']))
+        results = utils.parallel_map(lambda c: c._release_services(), comps,
+                max_workers=max_workers, return_exceptions=True)
+        if not [r for r in results if isinstance(r, Exception)]:
+            self._leases.close()
+
+    def replay_events(self, path, speed=1.0, nodes=True):
+        '''Replay a recording of observer status updates.
+
+        @param path The path of the recording, made by @ref record_events.
+        @param speed How many times faster than recorded to replay the
+                     updates, or None to replay them as fast as possible.
+        @param nodes If True, the updates are given to the components in
+                     this tree as if their observers had received them. If
+                     False, they are only published to the subscribers of
+                     the tree (see @ref subscribe) as records of kind
+                     rtctree.events.OBSERVER.
+        @return A tuple of the number of updates replayed and the time taken,
+                in seconds.
+        @raises BadRecordingError
+
+        '''
+        if nodes:
+            return recorder.replay(path, tree=self, speed=speed)
+        return recorder.replay(path, bus=self._bus, speed=speed)
+
+    def remove_index(self, field):
+        '''Stop indexing the components in the tree by a profile field.
+
+        @raises NotIndexedError
+
+        '''
+        if self._index is None:
+            raise exceptions.NotIndexedError(field)
+        self._index.remove_field(field)
+
+    def remove_listener(self, cb):
+        '''Remove a function added using @ref add_listener.'''
+        with self._root._mutex:
+            self._listeners.remove(cb)
+
+    def save_snapshot(self, path, fetch_ports=True, max_workers=None):
+        '''Save a snapshot of the tree to a file.
+
+        The snapshot can be loaded by passing it to the constructor, which is
+        much faster than parsing the name servers.
+
+        @param path The path of the file to write.
+        @param fetch_ports If True, the ports and connections of all
+                           components are retrieved (concurrently) and
+                           included in the snapshot. If False, only those
+                           already retrieved are included.
+        @param max_workers The maximum number of remote calls to make at once.
+
+        '''
+        snapshot_mod.save(self, path, fetch_ports=fetch_ports,
+                max_workers=max_workers)
+
+    def save_configuration(self, path, max_workers=None):
+        '''Save the configuration of all the components to a file.
+
+        The configuration sets, parameter values and active set of every
+        component are fetched concurrently and written to a compressed file,
+        which can be restored with @ref load_configuration.
+
+        @param path The path of the file to write.
+        @param max_workers The maximum number of remote calls to make at once.
+        @return A dictionary mapping the path of each component whose
+                configuration could not be fetched to the exception raised.
+
+        '''
+        return config_snapshot.save(self, path, max_workers=max_workers)
+
+    def save_mapped_snapshot(self, path):
+        '''Save a read-only snapshot of the tree that can be memory-mapped.
+
+        The snapshot is opened using @ref MappedTree, which reads it in place
+        without parsing it. Ports and connections are not included.
+
+        @param path The path of the file to write.
+
+        '''
+        mapped.write(self, path)
+
+    def state_counts(self, fetch=False, max_workers=None):
+        '''Count the components in the tree in each state.
+
+        The counts are kept up to date as the states of the components
+        become known and change, so getting them does not contact any
+        components. Components whose states have not been retrieved are not
+        counted.
+
+        @param fetch If True, the states of all the components are fetched
+                     (see @ref fetch_states) before counting.
+        @param max_workers The maximum number of remote calls to make at once
+                           when fetching the states.
+        @return A dictionary mapping state constants, such as
+                Component.ACTIVE, to the number of components in that state.
+
+        '''
+        if fetch:
+            self.fetch_states(max_workers=max_workers)
+        with self._root._mutex:
+            return dict([(s, n) for s, n in self._state_counts.items() if n])
+
+    def stop_recording(self):
+        '''Stop recording observer status updates.'''
+        old, self._recorder = self._recorder, None
+        if old is not None:
+            old.close()
+
+    def subscribe(self, kinds=None, path=None, maxsize=1000,
+            policy=events.DROP_OLDEST):
+        '''Subscribe to a feed of the changes to the nodes in the tree.
+
+        Any number of subscribers can receive the changes at once, each with
+        its own queue. For dynamic trees, this includes the changes reported
+        by the components' observers. See @ref EventBus.subscribe for the
+        arguments.
+
+        Example, to print the state changes of all components:
+        with tree.subscribe(kinds=[rtctree.events.MERGED_STATE]) as sub:
+            for record in sub:
+                print(record.path, record.value)
+
+        @return An rtctree.events.Subscription object. Close it when it is no
+                longer needed.
+
+        '''
+        return self._bus.subscribe(kinds=kinds, path=path, maxsize=maxsize,
+                policy=policy)
+
+    def validate(self, max_workers=None):
+        '''Validate the tree against the name servers.
+
+        Naming contexts that have changed are reparsed, and nodes for objects
+        that no longer exist are replaced by zombies. This is mainly useful
+        for trees loaded from a snapshot.
+
+        @param max_workers The maximum number of remote calls to make at once.
+
+        '''
+        snapshot_mod.validate(self, max_workers=max_workers)
+
+    def wait_for_component(self, path, timeout=None):
+        '''Wait until a component is present in the tree.
+
+        The tree's events are used to notice the component as soon as it is
+        added, such as by a dynamic manager. Because name servers do not send
+        events, the naming context the component should be bound in is also
+        checked at increasing intervals; only the missing binding is
+        processed.
+
+        @param path A list of path elements pointing to the component.
+        @param timeout The longest time to wait, in seconds, or None to wait
+                       until the component is present.
+        @return The component's node.
+        @raises WaitTimeoutError
+
+        '''
+        def present():
+            node = self._root.get_node(path)
+            return node is not None and node.is_component
+        wait.wait_until(self, present, lambda: self._refresh_path(path),
+                timeout)
+        return self._root.get_node(path)
+
+    def wait_for_component_async(self, path, timeout=None):
+        '''Asyncio version of @ref wait_for_component.
+
+        @return An asyncio future that gives the component's node.
+
+        '''
+        return wait.run_async(self.wait_for_component, path, timeout)
+
+    def wait_for_observers(self, timeout=None):
+        '''Wait until the observers of the dynamic components are registered.
+
+        The observers are registered in the background after the components
+        are added to the tree, so a dynamic tree can be used as soon as it
+        has been parsed. Components report their progress in
+        @ref Component.observer_status.
+
+        @param timeout The longest time to wait, in seconds, or None to wait
+                       until all the registrations have finished.
+        @raises WaitTimeoutError
+
+        '''
+        if not self._registrar.wait(timeout):
+            raise exceptions.WaitTimeoutError(timeout)
+
+    def wait_for_state(self, paths, state, timeout=None):
+        '''Wait until components are present and all in a state.
+
+        Dynamic components send their state changes as events. The states of
+        other components are fetched at increasing intervals, together (see
+        @ref fetch_states).
+
+        @param paths A list of paths to components.
+        @param state The state to wait for, such as Component.ACTIVE.
+        @param timeout The longest time to wait, in seconds, or None to wait
+                       until the components are in the state.
+        @return A list of the component nodes.
+        @raises WaitTimeoutError
+
+        '''
+        deadline = None if timeout is None else time.time() + timeout
+        comps = [self.wait_for_component(p, wait.time_left(deadline)) \
+                for p in paths]
+
+        def refresh():
+            static = [c for c in comps if not c._observes('RTC_STATUS')]
+            if static:
+                self.fetch_states(static)
+        wait.wait_until(self, lambda: all([c.state == state for c in comps]),
+                refresh, wait.time_left(deadline))
+        return comps
+
+    def wait_for_state_async(self, paths, state, timeout=None):
+        '''Asyncio version of @ref wait_for_state.
+
+        @return An asyncio future that gives the list of component nodes.
+
+        '''
+        return wait.run_async(self.wait_for_state, paths, state, timeout)
+
     def give_away_orb(self):
         '''Releases ownership of an ORB created by the tree.
 
@@ -300,6 +781,66 @@ class RTCTree(object):
         '''
         self._orb_is_mine = True
 
+    @property
+    def composition(self):
+        '''The index of composite components and their members.
+
+        The index is built when this property is first read, by retrieving
+        the organisations of every component in the tree concurrently. From
+        then on, the composition properties of the components in the tree
+        (members, is_member, is_composite, composite_parent, etc.) are
+        answered from the index, which is kept up to date as components are
+        added to and removed from the tree and compositions are changed
+        through rtctree.
+
+        '''
+        if self._composition is None:
+            # Build outside the lock, as it contacts every component
+            index = CompositionIndex()
+            index.build(self._root.iterate(lambda n, args: n,
+                filter=['is_component']))
+            with self._root._mutex:
+                if self._composition is None:
+                    self._composition = index
+        return self._composition
+
+    @property
+    def dynamic(self):
+        '''The tree-wide dynamic setting given when the tree was created.'''
+        return self._dynamic
+
+    @property
+    def session_id(self):
+        '''The identity of this tree, which tags the service profiles of the
+        observers and loggers it registers.'''
+        return self._session
+
+    @property
+    def observer_profile(self):
+        '''The notifications the observers of dynamic components receive.
+
+        Setting a new rtctree.sdo.ObserverProfile updates the observers of
+        all dynamic components in the tree that do not have their own
+        profile (see @ref Component.observer_profile), concurrently. The
+        observers are not replaced.
+
+        '''
+        return self._observer_profile
+
+    @observer_profile.setter
+    def observer_profile(self, profile):
+        self._observer_profile = profile or ObserverProfile()
+        comps = [c for c in utils.unique_nodes(self._root.iterate(
+            lambda n, args: n, filter=['is_component'])) \
+                if c.observer_status == 'observing' and \
+                        c._observer_profile is None]
+        utils.parallel_map(lambda c: c._update_observer(), comps)
+
+    @property
+    def index(self):
+        '''The index of component profile fields, or None if not indexing.'''
+        return self._index
+
     @property
     def orb(self):
         '''The reference to the ORB held by this tree.'''
@@ -322,6 +863,80 @@ class RTCTree(object):
         self._poa = self._orb.resolve_initial_references('RootPOA')
         self._poa._get_the_POAManager().activate()
 
+    def _node_event(self, event, node, value):
+        # Called by the nodes in the tree when they are added or removed, and
+        # when their callbacks are called. For node_added and node_removed,
+        # the value is the node the child was added to or removed from.
+        if event == 'node_removed':
+            # Components still held by other nodes remain in the tree
+            removed = []
+            for holder, c in _held_components(node, value):
+                remaining = self._identities.release(c, holder)
+                if not remaining:
+                    removed.append(c)
+                elif c._parent is holder:
+                    _promote(c, remaining[0])
+        elif event == 'node_added':
+            # Nodes shared with other holders are already in the tree
+            added = [c for c in node.iterate(lambda n, args: n,
+                filter=['is_component']) if not isinstance(c, SharedNode)]
+        if self._composition is not None:
+            if event == 'node_added':
+                for c in added:
+                    self._composition.add(c)
+            elif event == 'node_removed':
+                for c in removed:
+                    self._composition.remove(c)
+        if event == 'node_added':
+            for c in added:
+                if c._merged_state is not None:
+                    self._set_component_state(c, c._merged_state)
+        elif event == 'node_removed':
+            for c in removed:
+                self._set_component_state(c, None)
+        elif event == 'state_changed':
+            self._set_component_state(node, value)
+        if self._index is not None:
+            if event == 'node_added':
+                for c in added:
+                    self._index.add(c)
+            elif event == 'node_removed':
+                for c in removed:
+                    self._index.remove(c)
+            elif event == 'component_profile':
+                self._index.update(node)
+        with self._root._mutex:
+            listeners = list(self._listeners)
+        for cb in listeners:
+            cb(event, node, value)
+        self._bus.publish(event, node, value)
+
+    def _refresh_path(self, path):
+        # Update the first missing or zombie node along a path from the
+        # remote object that should hold it.
+        node = self._root
+        for name in path[1:]:
+            child = node._children.get(name)
+            if child is None or child.is_zombie:
+                if isinstance(node, Directory):
+                    node._reparse_child(name)
+                elif node.is_manager:
+                    node.reparse_components()
+                return
+            node = child
+
+    def _set_component_state(self, comp, state):
+        # Record the state of a component in the state counts. A state of
+        # None removes the component from the counts.
+        with self._root._mutex:
+            old = self._states.pop(comp, None)
+            if old is not None:
+                self._state_counts[old] -= 1
+            if state is not None:
+                self._states[comp] = state
+                self._state_counts[state] = \
+                        self._state_counts.get(state, 0) + 1
+
     def _parse_name_servers(self, servers, filter=[], dynamic=False):
         # Parse a list of name servers.
         if type(servers) is str:
@@ -344,4 +959,27 @@ class RTCTree(object):
             self._root._add_child(new_ns_node)
 
 
+##############################################################################
+## Internal functions
+
+def _held_components(node, holder):
+    # Get the components in a subtree, each with the node holding it.
+    if node.is_component:
+        return [(holder, shared_node(node))]
+    result = []
+    for c in node.children:
+        result += _held_components(c, node)
+    return result
+
+
+def _promote(comp, holder):
+    # Make a node that holds a shared component through a SharedNode its
+    # parent, after the component's parent has removed it.
+    with comp._mutex:
+        comp._parent = holder
+    with holder._mutex:
+        if isinstance(holder._children.get(comp._name), SharedNode):
+            holder._children[comp._name] = comp
+
+
 # vim: set expandtab tabstop=8 shiftwidth=4 softtabstop=4 textwidth=79
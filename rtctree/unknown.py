@@ -64,5 +64,10 @@ class Unknown(TreeNode):
         # Unknowns cannot contain children.
         raise exceptions.CannotHoldChildrenError
 
+    def _restore(self, data, orb):
+        # Restore the object from snapshot data.
+        with self._mutex:
+            self._obj = orb.string_to_object(data['ior'])
+
 
 # vim: set expandtab tabstop=8 shiftwidth=4 softtabstop=4 textwidth=79
@@ -19,10 +19,12 @@ of name servers, directories, managers and components.
 '''
 
 import sys
+import threading
 
 import omniORB
 import omniORB.any
 
+from rtctree.options import Options
 from rtctree.rtc import SDOPackage
 
 
@@ -176,6 +178,70 @@ def nvlist_to_dict(nvlist):
     return result
 
 
+def parallel_map(func, items, max_workers=None, return_exceptions=False):
+    '''Call a function on each item of a list using a pool of threads.
+
+    Use this to overlap the remote calls made for many objects, such as
+    fetching the profiles of a large number of components.
+
+    @param func The function to call. It is called once for each item, with
+                the item as its only argument.
+    @param items The list of items.
+    @param max_workers The maximum number of threads to use. If None, the
+                       'max_workers' option is used.
+    @param return_exceptions If True, an exception raised by @ref func is
+                             placed in the results in place of the return
+                             value. If False, the first such exception is
+                             raised once all items have been processed.
+    @return A list of the results of each call, in the same order as
+            @ref items.
+
+    Example:
+    >>> parallel_map(lambda x: x * 2, [1, 2, 3], max_workers=2)
+    [2, 4, 6]
+    >>> r = parallel_map(lambda x: 1 // x, [1, 0], return_exceptions=True)
+    >>> r[0], type(r[1]).__name__
+    (1, 'ZeroDivisionError')
+    '''
+    items = list(items)
+    if max_workers is None:
+        max_workers = Options().get_option('max_workers')
+    results = [None] * len(items)
+    errors = [None] * len(items)
+    next_item = [0]
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                ii = next_item[0]
+                if ii >= len(items):
+                    return
+                next_item[0] += 1
+            try:
+                results[ii] = func(items[ii])
+            except Exception as e:
+                errors[ii] = e
+
+    num_threads = min(max_workers, len(items))
+    if num_threads <= 1:
+        worker()
+    else:
+        threads = [threading.Thread(target=worker) \
+                for ii in range(num_threads)]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        for t in threads:
+            t.join()
+    for ii, e in enumerate(errors):
+        if e is not None:
+            if not return_exceptions:
+                raise e
+            results[ii] = e
+    return results
+
+
 def filtered(path, filter):
     '''Check if a path is removed by a filter.
 
@@ -206,4 +272,24 @@ def trim_filter(filter, levels=1):
     return [f for f in trimmed if f]
 
 
+def unique_nodes(nodes):
+    '''Remove repeated nodes from a list, keeping the first of each.
+
+    A node can appear more than once when iterating over a tree, because
+    components created by managers are children of both the manager and a
+    naming context. The holders other than the component's parent hold it
+    through a SharedNode, which counts as the same node.
+
+    '''
+    seen = set()
+    result = []
+    for n in nodes:
+        # A SharedNode is the same as the node it shares
+        key = id(getattr(n, '_target', n))
+        if key not in seen:
+            seen.add(key)
+            result.append(n)
+    return result
+
+
 # vim: set expandtab tabstop=8 shiftwidth=4 softtabstop=4 textwidth=79
@@ -0,0 +1,131 @@
+# -*- Python -*-
+# -*- coding: utf-8 -*-
+
+'''rtctree
+
+Copyright (C) 2009-2015
+    Geoffrey Biggs
+    RT-Synthesis Research Group
+    Intelligent Systems Research Institute,
+    National Institute of Advanced Industrial Science and Technology (AIST),
+    Japan
+    All rights reserved.
+Licensed under the GNU Lesser General Public License version 3.
+http://www.gnu.org/licenses/lgpl-3.0.en.html
+
+Functions for waiting until a condition in a tree holds.
+
+A wait checks its condition again each time the tree reports an event, such
+as a node being added or a dynamic component changing state, so it returns
+as soon as the condition holds. Name servers and nodes that are not dynamic do
+not report changes, so the information the condition depends on is also
+refreshed at intervals, starting at FIRST_POLL seconds and doubling up to
+MAX_POLL seconds.
+
+'''
+
+
+import functools
+import threading
+import time
+
+from rtctree import exceptions
+
+
+# The first interval between refreshes, in seconds
+FIRST_POLL = 0.05
+# The longest interval between refreshes, in seconds
+MAX_POLL = 2.0
+
+
+##############################################################################
+## API functions
+
+def wait_until(tree, condition, refresh=None, timeout=None):
+    '''Wait until a condition holds.
+
+    @param tree The RTCTree whose events cause the condition to be checked,
+                or None to only check it after each refresh.
+    @param condition A function taking no arguments that returns True when
+                     the condition holds.
+    @param refresh A function taking no arguments that updates the
+                   information used by @ref condition which is not kept up to
+                   date by events. It is called at increasing intervals.
+    @param timeout The longest time to wait, in seconds, or None to wait until
+                   the condition holds.
+    @raises WaitTimeoutError
+
+    Example:
+    >>> start = time.time()
+    >>> wait_until(None, lambda: time.time() - start > 0.1)
+    >>> try:
+    ...     wait_until(None, lambda: False, timeout=0.1)
+    ... except exceptions.WaitTimeoutError as e:
+    ...     print(e)
+    Condition not met within 0.1 seconds.
+    '''
+    changed = threading.Event()
+
+    def on_event(event, node, value):
+        # Heartbeats do not change anything a condition can depend on
+        if event != 'heartbeat':
+            changed.set()
+
+    if tree is not None:
+        tree.add_listener(on_event)
+    try:
+        now = time.time()
+        deadline = None if timeout is None else now + timeout
+        interval = FIRST_POLL
+        next_refresh = now + interval
+        while not condition():
+            now = time.time()
+            if deadline is not None and now >= deadline:
+                raise exceptions.WaitTimeoutError(timeout)
+            if now >= next_refresh:
+                if refresh is not None:
+                    refresh()
+                interval = min(interval * 2, MAX_POLL)
+                next_refresh = now + interval
+                continue
+            delay = next_refresh - now
+            if deadline is not None:
+                delay = min(delay, deadline - now)
+            changed.wait(delay)
+            changed.clear()
+    finally:
+        if tree is not None:
+            tree.remove_listener(on_event)
+
+
+def run_async(func, *args, **kwargs):
+    '''Run a blocking function in the default executor of the asyncio event
+    loop.
+
+    Use this to wait for a tree condition from a coroutine without blocking
+    the event loop.
+
+    @return An asyncio future that gives the result of the function.
+
+    '''
+    import asyncio
+    loop = asyncio.get_event_loop()
+    return loop.run_in_executor(None, functools.partial(func, *args,
+        **kwargs))
+
+
+def time_left(deadline):
+    '''Get the time remaining before a deadline, for passing on as a
+    timeout.
+
+    @param deadline The time returned by time.time() at which to stop
+                    waiting, or None for no deadline.
+    @return The remaining time in seconds (at least zero), or None.
+
+    '''
+    if deadline is None:
+        return None
+    return max(deadline - time.time(), 0)
+
+
+# vim: set expandtab tabstop=8 shiftwidth=4 softtabstop=4 textwidth=79